@@ -0,0 +1,75 @@
+"""
+Import-time benchmark: each module is imported in a fresh interpreter, its
+startup time is compared with a budget and the heavy dependencies must stay
+unloaded until first use.
+
+python import_benchmark.py            # table
+python -m unittest import_benchmark   # guard
+"""
+import json
+import subprocess
+import sys
+import unittest
+
+# Loaded on first use only
+heavy_modules = ('asyncio', 'keyring', 'matplotlib', 'mysql', 'pandas',
+                 'pyvisa', 'scipy', 'seaborn', 'statsmodels', 'unittest2',
+                 'visa')
+
+# Budget (s) of the import including numpy, on top of the interpreter startup
+budgets = {
+    'instr.base': 0.5,
+    'instr.agilent4156c': 0.5,
+    'instr.ap1628t2': 0.5,
+    'instr.ke2400': 0.5,
+    'instr.ke2636a': 0.5,
+    'instr.lsci331': 0.5,
+    'instr.sci9700': 0.5,
+    'instr.suss_pa300': 0.5,
+    'lib.algorithms': 0.5,
+    'lib.constants': 0.1,
+    'lib.database': 0.5,
+    'lib.mysql_handler': 0.1,
+    'pa300_plot': 0.5,
+    'vi_meas': 0.5,
+}
+
+_probe = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+t = time.perf_counter() - t0
+print(json.dumps([t, sorted(set(m.split('.')[0] for m in sys.modules))]))
+"""
+
+
+def import_time(module, repeat=3):
+    """
+    :return: best import time (s) of module, top-level packages loaded
+    :rtype: float, list of str
+    """
+    best = None
+    for _ in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, '-c', _probe.format(module=module)])
+        t, loaded = json.loads(out.decode())
+        best = t if best is None else min(best, t)
+    return best, loaded
+
+
+class TestImportTime(unittest.TestCase):
+    def test_import_time(self):
+        for module, budget in sorted(budgets.items()):
+            with self.subTest(module=module):
+                t, loaded = import_time(module)
+                self.assertEqual([m for m in heavy_modules if m in loaded],
+                                 [])
+                self.assertLess(t, budget)
+
+
+if __name__ == '__main__':
+    for module, budget in sorted(budgets.items()):
+        t, loaded = import_time(module)
+        heavy = [m for m in heavy_modules if m in loaded]
+        print('{:<20} {:7.3f}s / {:.1f}s  {}'.format(
+            module, t, budget, ' '.join(heavy)))
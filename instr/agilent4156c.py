@@ -1,37 +1,58 @@
-﻿import numpy as np
-import unittest2
-import visa
+﻿from math import ceil
+from time import perf_counter
+import unittest
 
-from instr.base import SourceMeter
+import numpy as np
+
+from instr.base import SourceMeter, operation_method, parse_binary_blocks
+from instr.sweep_plan import SweepPlan, SweepResult
 
 
 # TODO compliance
 
 class Agilent4156C(SourceMeter):
+    _input_buffer_size = 256
+    # For the expected duration of a measurement (see deadline)
+    _integration_sec = {'SHOR': 0.64e-3, 'MED': 20e-3, 'LONG': 320e-3}
+    _point_overhead_sec = 5e-3
+    _measurement_overhead_sec = 0.1
+    # Steps of a VAR1 sweep (one direction), and points of the data buffer
+    # shared by appended measurements
+    _sweep_points = 1001
+    _data_points = 8000
+    # See SourceMeter.profile.  Only the integration time: the SMUs range
+    # automatically.
+    _profiles = {'fast': {'itim': 'SHOR'}, 'balanced': {'itim': 'MED'},
+                 'precise': {'itim': 'LONG'}}
+
     def __init__(self, use_us_commands=False, gnd_smu=2, bias_smu=1,
-                 rsrc=None, timeout_sec=600, reset=True):
+                 rsrc=None, timeout_sec=600, reset=True,
+                 binary_transfer=False):
+        """
+        :param binary_transfer: Read data in REAL,64 instead of ASCII.
+        """
         self._gnd_smu = gnd_smu
         self._src_smu = bias_smu
         idn = 'HEWLETT-PACKARD,4156C'
         super().__init__(rsrc, idn, timeout_sec, reset)
         self._use_us_commands = use_us_commands
         self._integration_time = 'SHOR'
+        self.binary_transfer = binary_transfer
 
-    def check_error(self):
-        """
-        >>> a = Agilent4156C()
-        debug mode (Agilent4156C): skip BaseInstr.__init__.
-        >>> a.check_error()
-        debug mode (Agilent4156C): skip check_error.
-        """
-        if self._debug_mode:
-            super().check_error()
-            return
+    def _check_error(self):
         tmp = self.q("SYST:ERR?")
         tmp = tmp.split(',')
         if tmp[0] != '+0':
             raise RuntimeError('Error on Agilent 4156C.')
 
+    def _error_pending(self):
+        # QYE, DDE, EXE and CME bits of the standard event status register
+        return bool(int(self.q('*ESR?')) & 0b111100)
+
+    def _clear_errors(self):
+        self._write('*CLS')
+
+    @operation_method
     def reset(self):
         """
         >>> a = Agilent4156C()
@@ -43,22 +64,72 @@ class Agilent4156C(SourceMeter):
         if self._debug_mode:
             super().reset()
             return
-        self.w('*RST')  # Restore default configuration
-        self.w('*CLS')  # Clear query buffer
-        self.check_error()
+        with self.batch():
+            self.w('*RST')  # Restore default configuration
+            self.w('*CLS')  # Clear query buffer
+            self.check_error()
+        self._reset_shadow()
+
+    def _batch_unit(self, write_str):
+        """
+        >>> a = Agilent4156C()
+        debug mode (Agilent4156C): skip BaseInstr.__init__.
+        >>> a._batch_unit(":page:chan:ufun:def 'R','ohm','V1/I1';")
+        ":page:chan:ufun:def 'R','ohm','V1/I1'"
+        >>> a._batch_unit('SYST:ERR?')
+        ':SYST:ERR?'
+        """
+        # Headers without leading ':' are relative to the previous one.
+        unit = super()._batch_unit(write_str)
+        if not unit.startswith((':', '*')):
+            unit = ':' + unit
+        return unit
 
     @property
     def integration_time(self):
         return self._integration_time
 
     @integration_time.setter
+    @operation_method
     def integration_time(self, value):
         if value not in ['SHOR', 'MED', 'LONG']:
             raise ValueError("integ_time: 'SHOR' or 'MED', 'LONG'")
         self._integration_time = value
-        self.w(":PAGE:MEAS:MSET:ITIM {}".format(self._integration_time))
+        self.w_shadow(':PAGE:MEAS:MSET:ITIM',
+                      ":PAGE:MEAS:MSET:ITIM {}".format(self._integration_time))
         self.check_error()
 
+    def _itime(self, i_limit, default=None):
+        """
+        Integration time of a measurement at i_limit: of profile if set,
+        else default (None: integration_time).
+        """
+        settings = self._profile_settings(i_limit)
+        if settings is not None:
+            return settings['itim']
+        return self._integration_time if default is None else default
+
+    def _configure_profile(self, i_limit):
+        """
+        Integration time of profile, or integration_time if not set (back
+        from a profile).  integration_time itself is left as set.
+
+        >>> from instr.emulator import Agilent4156CEmulator
+        >>> a = Agilent4156C(rsrc=Agilent4156CEmulator())
+        >>> a.integration_time = 'MED'
+        >>> a.profile = 'fast'
+        >>> vis, aborted = a.iv_sweep_double(0.1, v_points=2)
+        >>> a.integration_time, a._shadow[':PAGE:MEAS:MSET:ITIM']
+        ('MED', ':PAGE:MEAS:MSET:ITIM SHOR')
+        >>> a.profile = None
+        >>> vis, aborted = a.iv_sweep_double(0.1, v_points=2)
+        >>> a._shadow[':PAGE:MEAS:MSET:ITIM']
+        ':PAGE:MEAS:MSET:ITIM MED'
+        """
+        self.w_shadow(':PAGE:MEAS:MSET:ITIM',
+                      ":PAGE:MEAS:MSET:ITIM {}".format(self._itime(i_limit)))
+
+    @operation_method
     def _disable_all_units(self, *except_units):
         if self._debug_mode:
             self._dbg_print_skip_method()
@@ -68,12 +139,15 @@ class Agilent4156C(SourceMeter):
         else:
             units = ["SMU1", "SMU2", "SMU3", "SMU4",
                      "VSU1", "VSU2", "VMU1", "VMU2"]
-            for i in range(8):
-                if (i + 1) in except_units:
-                    continue
-                self.w(":PAGE:CHAN:{}:DIS".format(units[i]))
-        self.check_error()
-
+            with self.batch():
+                for i in range(8):
+                    if (i + 1) in except_units:
+                        continue
+                    self.w_shadow(':PAGE:CHAN:' + units[i],
+                                  ":PAGE:CHAN:{}:DIS".format(units[i]))
+                self.check_error()
+
+    @operation_method
     def _configure_smu(self, smu_num, mode, func, V_name=None, I_name=None):
         """
         >>> a = Agilent4156C()
@@ -103,16 +177,21 @@ class Agilent4156C(SourceMeter):
             _mode = ('V', 'I', 'COMM')[mode - 1]
             _func = ('VAR1', 'VAR2', 'CONS', 'VARD')[func - 1]
 
-            self.w(":PAGE:CHAN:SMU{}:VNAM '{}';INAM '{}';MODE {};FUNC {};".
-                   format(smu_num, V_name, I_name, _mode, _func))
+            self.w_shadow(
+                ':PAGE:CHAN:SMU{}'.format(smu_num),
+                ":PAGE:CHAN:SMU{}:VNAM '{}';INAM '{}';MODE {};FUNC {};".
+                format(smu_num, V_name, I_name, _mode, _func))
         self.check_error()
 
+    @operation_method
     def _set_user_func(self, name, unit, definition):
         # TODO property, overridden by others?
-        self.w(":page:chan:ufun:def '{}','{}','{}'".
-               format(name, unit, definition))
+        self.w_shadow(':PAGE:CHAN:UFUN:DEF ' + name,
+                      ":page:chan:ufun:def '{}','{}','{}'".
+                      format(name, unit, definition))
         self.check_error()
 
+    @operation_method
     def _set_Y(self, Y1_name, Y1_log_scale=False,
                Y2_name=None, Y2_log_scale=False):
         # TODO property
@@ -120,16 +199,21 @@ class Agilent4156C(SourceMeter):
             self._dbg_print_skip_method()
         if self._use_us_commands:
             raise NotImplementedError
-        else:
-            self.w(":PAGE:DISP:GRAP:Y1:NAME '{}';".format(Y1_name))
+        with self.batch():
+            self.w_shadow(':PAGE:DISP:GRAP:Y1:NAME',
+                          ":PAGE:DISP:GRAP:Y1:NAME '{}';".format(Y1_name))
             if Y2_name is not None:
-                self.w(":PAGE:DISP:GRAP:Y2:NAME '{}';".format(Y2_name))
+                self.w_shadow(':PAGE:DISP:GRAP:Y2:NAME',
+                              ":PAGE:DISP:GRAP:Y2:NAME '{}';".format(Y2_name))
             if Y1_log_scale:
-                self.w(":PAGE:DISP:GRAP:Y1:SCAL LOG;")
+                self.w_shadow(':PAGE:DISP:GRAP:Y1:SCAL',
+                              ":PAGE:DISP:GRAP:Y1:SCAL LOG;")
             if Y2_log_scale:
-                self.w(":PAGE:DISP:GRAP:Y2:SCAL LOG;")
-        self.check_error()
+                self.w_shadow(':PAGE:DISP:GRAP:Y2:SCAL',
+                              ":PAGE:DISP:GRAP:Y2:SCAL LOG;")
+            self.check_error()
 
+    @operation_method
     def configure_display_limit(self, x_min, x_max,
                                 y1_min=1e-12, y1_max=1e-3,
                                 y2_min=1e3, y2_max=1e12):
@@ -141,125 +225,550 @@ class Agilent4156C(SourceMeter):
             print('debug: skip configure_display')
         if self._use_us_commands:
             raise NotImplementedError
-        else:
-            self.w(":PAGE:DISP:SET:GRAP:X:MIN {};".format(x_min))
-            self.w(":PAGE:DISP:SET:GRAP:X:MAX {};".format(x_max))
-            self.w(":PAGE:DISP:SET:GRAP:Y1:MIN {};".format(y1_min))
-            self.w(":PAGE:DISP:SET:GRAP:Y1:MAX {};".format(y1_max))
-            self.w(":PAGE:DISP:SET:GRAP:Y2:MIN {};".format(y2_min))
-            self.w(":PAGE:DISP:SET:GRAP:Y2:MAX {};".format(y2_max))
-        self.check_error()
-
+        with self.batch():
+            for axis, value in [('X:MIN', x_min), ('X:MAX', x_max),
+                                ('Y1:MIN', y1_min), ('Y1:MAX', y1_max),
+                                ('Y2:MIN', y2_min), ('Y2:MAX', y2_max)]:
+                key = ':PAGE:DISP:SET:GRAP:' + axis
+                self.w_shadow(key, '{} {};'.format(key, value))
+            self.check_error()
+
+    def _fetch(self, *names):
+        """
+        Read data of the names (e.g. 'V1', '@TIME') in one transfer.
+        Not measured points are 9.91e307.
+
+        >>> from instr.emulator import Agilent4156CEmulator
+        >>> a = Agilent4156C(rsrc=Agilent4156CEmulator(),
+        ...                  binary_transfer=True)
+        >>> vis, aborted = a.iv_sweep_double(0.1, v_points=3)
+        >>> a._fetch('V1', 'I1')
+        [array([0.  , 0.05, 0.1 , 0.1 , 0.05, 0.  ]), \
+array([0.e+00, 5.e-05, 1.e-04, 1.e-04, 5.e-05, 0.e+00])]
+
+        :rtype: list of np.ndarray
+        """
+        if self.binary_transfer:
+            return self._parse_data(self.q_raw(self._data_queries(names)))
+        return self._parse_data(self.q(self._data_queries(names)))
+
+    def _data_queries(self, names):
+        queries = ';'.join(":DATA? '{}'".format(name) for name in names)
+        if self.binary_transfer:
+            return ':FORM:DATA REAL,64;' + queries
+        return ':FORM:DATA ASC;' + queries
+
+    def _parse_data(self, resp):
+        """:param resp: response of _data_queries, str or bytes"""
+        if self.binary_transfer:
+            return parse_binary_blocks(resp, '>f8')
+        if isinstance(resp, bytes):
+            resp = resp.decode('latin-1')
+        return [np.asarray(data.split(','), np.float64)
+                for data in resp.strip().split(';')]
+
+    @operation_method
     def contact_test(self, time_interval_second=10e-3, reset=True,
                      applyV=1e-3, compI=10e-3, meas_time_second=60, points=0):
         """
-        Returns float[] times, float[] currents
-        :rtype: list of float, list of float
+        Returns times, currents
+        :rtype: np.ndarray, np.ndarray
         """
-        if reset:
-            self.w('*RST')
         if self._debug_mode:
             raise NotImplementedError
         if points == 0:
             points = int(meas_time_second / time_interval_second)
         # 8000: OK, 8500: "ERROR 7: DATA buffer full. Too many points."
-        points = min(8000, points)
+        points = min(self._data_points, points)
         if self._use_us_commands:
             raise NotImplementedError
-        else:
-            self.w(":PAGE:CHAN:MODE SAMP;")  # not in GPIB mannual damn
+        itime = self._itime(compI, 'MED')
+        expected = points * max(time_interval_second,
+                                self._integration_sec[itime] +
+                                self._point_overhead_sec)
+        with self.deadline(expected):
+            if reset:
+                self.w('*RST')
+                self._reset_shadow()
+            with self.batch():
+                self._configure_sampling(time_interval_second, points,
+                                         applyV, compI, meas_time_second)
+            self.w(":PAGE:SCON:SING")
+            self.q('*OPC?')
+            times, currents = self._fetch('@TIME',
+                                          'I{}'.format(self._src_smu))
+        return self._measured_samples(times, currents)
+
+    def _configure_sampling(self, time_interval_second, points, applyV,
+                            compI, display_sec):
+        """Sampling measurement of contact_test."""
+        # not in GPIB mannual damn
+        self.w_shadow(':PAGE:CHAN:MODE', ":PAGE:CHAN:MODE SAMP;")
         self._disable_all_units(self._gnd_smu, self._src_smu)
         self._configure_smu(self._gnd_smu, 3, 3)
         self._configure_smu(self._src_smu, 1, 3)
-        if self._use_us_commands:
-            raise NotImplementedError
-        else:
-            self.w(":PAGE:MEAS:SAMP:IINT {};POIN {};".
-                   format(time_interval_second, points))
-            self.w(":PAGE:MEAS:SAMP:CONS:SMU{} {};".
-                   format(self._src_smu, applyV))
-            self.w(":PAGE:MEAS:SAMP:CONS:SMU{}:COMP {};".
-                   format(self._src_smu, compI))
+        self.w_shadow(':PAGE:MEAS:SAMP:IINT',
+                      ":PAGE:MEAS:SAMP:IINT {};POIN {};".
+                      format(time_interval_second, points))
+        self.w_shadow(':PAGE:MEAS:SAMP:CONS',
+                      ":PAGE:MEAS:SAMP:CONS:SMU{} {};".
+                      format(self._src_smu, applyV))
+        self.w_shadow(':PAGE:MEAS:SAMP:CONS:COMP',
+                      ":PAGE:MEAS:SAMP:CONS:SMU{}:COMP {};".
+                      format(self._src_smu, compI))
         self._set_user_func('R', 'ohm', 'V{0}/I{0}'.format(self._src_smu))
         self._set_Y("I{}".format(self._src_smu), True, 'R', True)
-        self.configure_display_limit(0, meas_time_second, 1e-15, 1e-3, 1, 1000)
-        if self._use_us_commands:
+        self.configure_display_limit(0, display_sec, 1e-15, 1e-3, 1, 1000)
+        # MED unless profile is set
+        self.w_shadow(':PAGE:MEAS:MSET:ITIM', ":PAGE:MEAS:MSET:ITIM {};".
+                      format(self._itime(compI, 'MED')))
+
+    @staticmethod
+    def _measured_samples(times, currents):
+        times = times[times != 9.91e307]
+        currents = currents[currents != 9.91e307]
+        if len(times) != len(currents):
+            raise RuntimeError
+        return times, currents
+
+    def contact_monitor(self, duration_sec=None, time_interval_second=10e-3,
+                        applyV=1e-3, compI=10e-3, chunk_points=1000,
+                        history=None, reset=True):
+        """
+        The sampling of contact_test without its 8000 points limit: the
+        measurement is re-armed every chunk_points points for duration_sec,
+        or until the generator is closed.  The data of a chunk is queried in
+        the message re-arming the next one, so sampling pauses only for the
+        query.  Times continue across the chunks (the start of a chunk is
+        taken from the arrival of the previous chunk's data).
+
+        >>> from instr.emulator import Agilent4156CEmulator
+        >>> from instr.ring_buffer import RingBuffer
+        >>> a = Agilent4156C(rsrc=Agilent4156CEmulator())
+        >>> history = RingBuffer(250)
+        >>> chunks = list(a.contact_monitor(3, 10e-3, chunk_points=100,
+        ...                                 history=history))
+        >>> len(chunks), len(history), history.dropped
+        (3, 250, 50)
+        >>> bool((np.diff(np.concatenate(chunks)[:, 0]) > 0).all())
+        True
+
+        :param duration_sec: None: until the generator is closed
+        :param chunk_points: points per measurement (up to 8000)
+        :param history: instr.ring_buffer.RingBuffer which the points are
+                        also added to, e.g. the last hour for a plot
+        :return: generator of [(t, i), ...], t (s) from the first point
+        """
+        if self._debug_mode or self._use_us_commands:
             raise NotImplementedError
-        else:
-            self.w(":PAGE:MEAS:MSET:ITIM MED;")  # fixed
-            self.w(":PAGE:SCON:SING")
-            self.q('*OPC?')
-            resp = self.q(":FORM:DATA ASC;:DATA? '@TIME';")
-            times = [float(t) for t in resp.split(',') if float(t) != 9.91e307]
-            resp = self.q(":FORM:DATA ASC;:DATA? 'I{}';".format(self._src_smu))
-            currents = [float(I) for I in resp.split(',') if
-                        float(I) != 9.91e307]
-            if len(times) != len(currents):
-                raise RuntimeError
-            return times, currents
+        chunk_points = min(chunk_points, self._data_points)
+        itime = self._itime(compI, 'MED')
+        chunk_sec = chunk_points * max(time_interval_second,
+                                       self._integration_sec[itime] +
+                                       self._point_overhead_sec)
+        n_chunks = None if duration_sec is None else \
+            max(1, ceil(duration_sec / (chunk_points * time_interval_second)))
+        names = ['@TIME', 'I{}'.format(self._src_smu)]
+        with self.operation():
+            with self.deadline(chunk_sec):
+                if reset:
+                    self.w('*RST')
+                    self._reset_shadow()
+                with self.batch():
+                    self._configure_sampling(time_interval_second,
+                                             chunk_points, applyV, compI,
+                                             chunk_points *
+                                             time_interval_second)
+                self.w(':PAGE:SCON:SING')
+            running = True
+            k = 0
+            offset = 0.0
+            t_ref = None  # host time of the first point
+            try:
+                while True:
+                    last = n_chunks is not None and k + 1 >= n_chunks
+                    with self.deadline(chunk_sec):
+                        with self.batch():
+                            self.w('*WAI')
+                            self.w(self._data_queries(names))
+                            if not last:
+                                self.w(':PAGE:SCON:SING')
+                        times, currents = self._measured_samples(
+                            *self._parse_data(self.r_raw()))
+                    arrival = perf_counter()
+                    running = not last
+                    tis = np.array([times + offset, currents]).transpose()
+                    if history is not None:
+                        history.extend(tis)
+                    end = offset + (times[-1] if len(times) else 0.0) + \
+                        time_interval_second
+                    if t_ref is None:
+                        t_ref = arrival - end
+                    offset = max(end, arrival - t_ref)
+                    yield tis
+                    if last:
+                        return
+                    k += 1
+            finally:
+                if running:
+                    self.w(':PAGE:SCON:STOP')
 
     def iv_sweep(self, v_start, v_end, v_step=1e-3, v_points=None,
                  i_limit=1e-3, reset=True):
         raise NotImplementedError()
 
-    def iv_sweep_double(self, v_max, v_step=1e-3, v_points=None, i_limit=10e-3):
+    @operation_method
+    def iv_sweep_double(self, v_max, v_step=1e-3, v_points=None, i_limit=10e-3,
+                        abort_at_compliance=False):
         """
 
         :param v_points: in single direction
+        :param abort_at_compliance: stop at the first point at compliance
+                                    (sweep stop condition of the 4156C)
+        :rtype: SweepResult
         """
         if v_points is not None:
             v_step = self._v_points_to_step(0, v_max, v_points)
         else:
             v_points = self._v_step_to_points(0, v_max, v_step)
 
-        if v_points > 1001:
-            raise RuntimeError('Number of step exceeds 1001. '
-                               '(see the manual of 4156C)')
+        if v_points > self._sweep_points:
+            return self.iv_sweep_plan(
+                SweepPlan.doubles([v_max], v_points=v_points), i_limit,
+                abort_at_compliance)
 
         if self._debug_mode:
+            if abort_at_compliance:
+                return super().iv_sweep_plan(
+                    SweepPlan.doubles([v_max], v_points=v_points), i_limit,
+                    abort_at_compliance)
             return super().iv_sweep_double(v_max, v_step, v_points, i_limit)
 
-        self._disable_all_units(self._gnd_smu, self._src_smu)
-        self._configure_smu(self._gnd_smu, 3, 3)
-        self._configure_smu(self._src_smu, 1, 1)
-
         is_P = v_max > 0  # is positive sweep
         if not is_P:
             v_step = -v_step
 
         if self._use_us_commands:
             raise NotImplementedError
-        else:
-            self.w(":PAGE:MEAS:VAR1:MODE DOUB;")
-            self.w(":PAGE:MEAS:SWE:VAR1:STAR 0")
-            self.w(":PAGE:MEAS:VAR1:STOP {};".format(v_max))
-            self.w(":PAGE:MEAS:VAR1:STEP {};".format(v_step))
-            # TODO: hold time, deley time
-            # TODO: stop at abnormal
+        expected = 2 * v_points * (
+            self._integration_sec[self._itime(i_limit)] +
+            self._point_overhead_sec)
+        with self.deadline(expected):
+            with self.batch():
+                self._configure_sweep_channels()
+                self._configure_profile(i_limit)
+                self.w_shadow(':PAGE:MEAS:VAR1:MODE',
+                              ":PAGE:MEAS:VAR1:MODE DOUB;")
+                self.w_shadow(':PAGE:MEAS:VAR1:STAR',
+                              ":PAGE:MEAS:SWE:VAR1:STAR 0")
+                self.w_shadow(':PAGE:MEAS:VAR1:STOP',
+                              ":PAGE:MEAS:VAR1:STOP {};".format(v_max))
+                self.w_shadow(':PAGE:MEAS:VAR1:STEP',
+                              ":PAGE:MEAS:VAR1:STEP {};".format(v_step))
+                self.w_shadow(':PAGE:MEAS:VAR1:COMP',
+                              ':PAGE:MEAS:VAR1:COMP {};'.format(i_limit))
+                # TODO: hold time, deley time
+                self._configure_sweep_stop(abort_at_compliance)
+
+                self._configure_sweep_display(0 if is_P else v_max,
+                                              v_max if is_P else 0, is_P)
+            self.w(':PAGE:SCON:MEAS:SING')
+            self.q('*OPC?')
+            (vis,), aborted = self._fetch_vis(self._src_smu)
+        return SweepResult.compliance_stop(vis, aborted, abort_at_compliance)
 
-        self._set_user_func('R', 'ohm', 'V{0}/I{0}'.format(self._src_smu))
-        self._set_Y("I{}".format(self._src_smu), True, 'R', True)
-        self.configure_display_limit(0 if is_P else v_max,
-                                     v_max if is_P else 0,
+    def _configure_sweep_stop(self, at_compliance):
+        """Stop the sweep at compliance (the 4156C has no other stop)."""
+        self.w_shadow(':PAGE:MEAS:SST', ':PAGE:MEAS:SST {};'.format(
+            'COMP' if at_compliance else 'OFF'))
+
+    def _configure_sweep_channels(self, var1_smu=None, var1p_smu=None):
+        """
+        VAR1 SMU (default: bias_smu) and VAR1' SMU: V.
+        Ground SMU: common, constant.
+        """
+        if var1_smu is None:
+            var1_smu = self._src_smu
+        self.w_shadow(':PAGE:CHAN:MODE', ':PAGE:CHAN:MODE SWE;')
+        self._disable_all_units(self._gnd_smu, var1_smu, var1p_smu)
+        self._configure_smu(self._gnd_smu, 3, 3)
+        self._configure_smu(var1_smu, 1, 1)
+        if var1p_smu is not None:
+            self._configure_smu(var1p_smu, 1, 4)
+
+    def _configure_sweep_display(self, x_min, x_max, is_P=True, smu=None):
+        """Y1: |I| (log), Y2: R (log) of smu (default: bias_smu)."""
+        if smu is None:
+            smu = self._src_smu
+        self._set_user_func('R', 'ohm', 'V{0}/I{0}'.format(smu))
+        self._set_Y("I{}".format(smu), True, 'R', True)
+        self.configure_display_limit(x_min, x_max,
                                      1e-12 if is_P else -1e-3,
                                      1e-3 if is_P else -1e-12,
                                      1e3, 1e12)
-        self.w(':PAGE:SCON:MEAS:SING')
-        self.q('*OPC?')
-        resp = self.q(":FORM:DATA ASC;:DATA? 'V{}';".format(self._src_smu))
-        vs = np.asarray(resp.split(','), np.float64)
-        resp = self.q(":FORM:DATA ASC;:DATA? 'I{}';".format(self._src_smu))
-        Is = np.asarray(resp.split(','), np.float64)
-        vs = vs[vs != 9.91e307]
-        aborted = len(vs) != len(Is)
-        Is = Is[Is != 9.91e307]
-        if len(vs) != len(Is):
-            raise Exception
-        vis = np.array([vs, Is]).transpose()
-        return vis, aborted
-
-
-class TestAgilent4156C(unittest2.TestCase):
+
+    def _fetch_vis(self, *smus):
+        """:return: [vis of each SMU], is_aborted"""
+        return self._to_vis(self._fetch(*self._vis_names(smus)))
+
+    @staticmethod
+    def _vis_names(smus):
+        names = []
+        for smu in smus:
+            names += ['V{}'.format(smu), 'I{}'.format(smu)]
+        return names
+
+    @staticmethod
+    def _to_vis(data):
+        """
+        The points up to the first one not measured (9.91e307: the sweep
+        stopped), which ends appended measurements too.
+
+        :param data: fetched data of _vis_names
+        :return: [vis of each SMU], is_aborted
+        """
+        visl = []
+        aborted = False
+        for vs, Is in zip(data[::2], data[1::2]):
+            if len(vs) != len(Is):
+                raise RuntimeError('Fetched {} voltages and {} currents.'.
+                                   format(len(vs), len(Is)))
+            stopped = np.flatnonzero((vs == 9.91e307) | (Is == 9.91e307))
+            n = stopped[0] if len(stopped) else len(vs)
+            aborted = aborted or bool(n != len(vs))
+            visl.append(np.array([vs[:n], Is[:n]]).transpose())
+        return visl, aborted
+
+    @classmethod
+    def _plan_measurements(cls, runs):
+        """
+        VAR1 sweeps of the linear runs of a plan.  Runs longer than
+        _sweep_points are split.  A run followed by its reverse becomes one
+        double sweep.
+
+        >>> Agilent4156C._plan_measurements(
+        ...     [(0, 1, 11), (1, 0, 11), (0, -1, 11), (-1, 0, 6)])
+        [('DOUB', 0, 1, 11), ('SING', 0, -1, 11), ('SING', -1, 0, 6)]
+        >>> Agilent4156C._plan_measurements([(0, 1.5, 1501)])
+        [('SING', 0.0, 1.0, 1001), ('SING', 1.001, 1.5, 500)]
+
+        :param runs: [(start, stop, points), ...]
+        :return: [(mode, start, stop, points), ...]
+        """
+        runs = [piece for run in runs for piece in cls._split_run(*run)]
+        ret = []
+        i = 0
+        while i < len(runs):
+            start, stop, points = runs[i]
+            if i + 1 < len(runs) and runs[i + 1] == (stop, start, points):
+                ret.append(('DOUB', start, stop, points))
+                i += 2
+            else:
+                ret.append(('SING', start, stop, points))
+                i += 1
+        return ret
+
+    @classmethod
+    def _split_run(cls, start, stop, points):
+        """Consecutive runs of up to _sweep_points of a linear run."""
+        if points <= cls._sweep_points:
+            return [(start, stop, points)]
+        step = (stop - start) / (points - 1)
+        ret = []
+        for i in range(0, points, cls._sweep_points):
+            n = min(cls._sweep_points, points - i)
+            ret.append((round(start + i * step, 12),
+                        round(start + (i + n - 1) * step, 12), n))
+        return ret
+
+    @classmethod
+    def _segments(cls, measurements):
+        """
+        Consecutive measurements appended in the data buffer
+        (up to _data_points).
+
+        >>> Agilent4156C._segments([('DOUB', 0, 1, 1001)] * 5)
+        ... # doctest: +NORMALIZE_WHITESPACE
+        [[('DOUB', 0, 1, 1001), ('DOUB', 0, 1, 1001), ('DOUB', 0, 1, 1001)],
+         [('DOUB', 0, 1, 1001), ('DOUB', 0, 1, 1001)]]
+        """
+        segments = []
+        total = 0
+        for measurement in measurements:
+            mode, start, stop, points = measurement
+            n = 2 * points if mode == 'DOUB' else points
+            if not segments or total + n > cls._data_points:
+                segments.append([])
+                total = 0
+            segments[-1].append(measurement)
+            total += n
+        return segments
+
+    @operation_method
+    def iv_sweep_plan(self, plan, i_limit=10e-3, abort_at_compliance=False,
+                      abort_di=None):
+        """
+        Run the linear runs of the plan as VAR1 sweeps: the first one as a
+        single measurement, the others appended (:PAGE:SCON:MEAS:APP), all
+        in one batch.  The data of all the runs is read in one transfer.
+        Lists which are not piecewise linear (e.g. log_list) are run as
+        one measurement per step.
+        abort_at_compliance stops the running sweep in the instrument; the
+        appended ones still run (a shorted device stops them at their first
+        point) but their data is dropped.
+
+        >>> from instr.emulator import Agilent4156CEmulator
+        >>> a = Agilent4156C(rsrc=Agilent4156CEmulator())
+        >>> vis, aborted = a.iv_sweep_plan(SweepPlan.doubles([0.1, -0.1],
+        ...                                                  v_points=3))
+        >>> vis[:, 0]
+        array([ 0.  ,  0.05,  0.1 ,  0.1 ,  0.05,  0.  ,  0.  , -0.05, -0.1 ,
+               -0.1 , -0.05,  0.  ])
+
+        >>> from instr.dut import Short
+        >>> a._rsrc.dut = Short()
+        >>> a.iv_sweep_plan([0, 0.1, 0.2], 1e-3, abort_at_compliance=True)
+        SweepResult(vis=array([[0.   , 0.   ],
+               [0.1  , 0.001]]), aborted=True, reason='compliance')
+
+        :param plan: SweepPlan, or array-like voltages
+        :param i_limit: compliance of the source SMU
+        :param abort_at_compliance: stop at the first point at compliance
+        :param abort_di: not supported by the 4156C (ValueError)
+        :return: vis, is_aborted, with .reason
+        :rtype: SweepResult
+        """
+        if abort_di is not None:
+            raise ValueError('4156C stops sweeps only at compliance')
+        plan = SweepPlan.of(plan)
+        if self._debug_mode:
+            return super().iv_sweep_plan(plan, i_limit, abort_at_compliance)
+        (vis,), aborted = self._sweep_plan(plan, [self._src_smu], [i_limit],
+                                           abort_at_compliance)
+        return SweepResult.compliance_stop(vis, aborted, abort_at_compliance)
+
+    @operation_method
+    def iv_sweep_channels(self, plan, channels=None, i_limit=10e-3,
+                          abort_at_compliance=False):
+        """
+        Sweep the plan on two SMUs at once (VAR1 and VAR1' of ratio 1),
+        e.g. two devices sharing the ground SMU.  The 4156C has one VAR1'.
+
+        >>> from instr.emulator import Agilent4156CEmulator
+        >>> from instr.dut import Ohmic
+        >>> emu = Agilent4156CEmulator(duts={3: Ohmic(2e3)})
+        >>> a = Agilent4156C(rsrc=emu)
+        >>> (vis1, vis3), aborted = a.iv_sweep_channels([0, 0.1], (1, 3))
+        >>> vis1[:, 1] * 1e3, vis3[:, 1] * 1e3
+        (array([0. , 0.1]), array([0.  , 0.05]))
+
+        :param plan: SweepPlan, or array-like voltages
+        :param channels: (VAR1 SMU, VAR1' SMU).  Default: bias_smu and the
+                         first other SMU except gnd_smu.
+        :param i_limit: compliance, or compliances of the channels
+        :param abort_at_compliance: stop at the first point at compliance
+                                    of any channel
+        :return: [vis of each channel], is_aborted
+        """
+        if channels is None:
+            channels = (self._src_smu,
+                        min({1, 2, 3, 4} - {self._src_smu, self._gnd_smu}))
+        if not 1 <= len(channels) <= 2:
+            raise ValueError('1 or 2 channels (VAR1 and VAR1\')')
+        if self._gnd_smu in channels:
+            raise ValueError('gnd_smu cannot be swept')
+        i_limits = np.broadcast_to(i_limit, len(channels))
+        return self._sweep_plan(SweepPlan.of(plan), list(channels),
+                                list(i_limits), abort_at_compliance)
+
+    def _sweep_plan(self, plan, smus, i_limits, abort_at_compliance=False):
+        """
+        The measurements fitting in the data buffer are one segment.  The
+        data of a segment is queried in the message starting the next
+        segment, so it is read while the next segment is measured.  With
+        abort_at_compliance a segment is read and checked before the next
+        one is started instead, so the segments after a stopped one are not
+        run.
+
+        >>> from instr.emulator import Agilent4156CEmulator
+        >>> a = Agilent4156C(rsrc=Agilent4156CEmulator())
+        >>> vis, aborted = a.iv_sweep_double(1, v_points=2501)
+        >>> vis.shape, aborted, vis[2499:2503, 0]
+        ((5002, 2), False, array([0.9996, 1.    , 1.    , 0.9996]))
+
+        :param smus: VAR1 SMU [, VAR1' SMU]
+        :return: [vis of each SMU], is_aborted
+        """
+        if self._use_us_commands:
+            raise NotImplementedError
+        measurements = self._plan_measurements(plan.linear_runs())
+        vs = plan.voltages()
+        expected = len(vs) * (
+            self._integration_sec[self._itime(min(np.abs(i_limits)))] +
+            self._point_overhead_sec) + \
+            len(measurements) * self._measurement_overhead_sec
+        names = self._vis_names(smus)
+        visls = []  # [vis of each SMU] of each segment
+        with self.deadline(expected):
+            for k, segment in enumerate(self._segments(measurements)):
+                with self.batch():
+                    if k == 0:
+                        self._configure_sweep(vs, smus, i_limits,
+                                              abort_at_compliance)
+                    elif not abort_at_compliance:
+                        # The previous segment, read while this one runs
+                        self.w(self._data_queries(names))
+                    self._run_measurements(segment)
+                if abort_at_compliance:
+                    self.q('*OPC?')
+                    visl, aborted = self._fetch_vis(*smus)
+                    visls.append(visl)
+                    if aborted:
+                        break
+                elif k:
+                    visl, _ = self._to_vis(self._parse_data(self.r_raw()))
+                    visls.append(visl)
+            if not abort_at_compliance:
+                self.q('*OPC?')
+                visl, aborted = self._fetch_vis(*smus)
+                visls.append(visl)
+        return [np.concatenate(vis_segs) for vis_segs in zip(*visls)], \
+            aborted
+
+    def _configure_sweep(self, vs, smus, i_limits, abort_at_compliance):
+        """Settings of _sweep_plan except VAR1."""
+        self._configure_sweep_channels(*smus)
+        self._configure_profile(min(np.abs(i_limits)))
+        self.w_shadow(':PAGE:MEAS:VAR1:COMP',
+                      ':PAGE:MEAS:VAR1:COMP {};'.format(i_limits[0]))
+        if len(smus) > 1:
+            self.w_shadow(':PAGE:MEAS:VARD:RAT', ':PAGE:MEAS:VARD:RAT 1;')
+            self.w_shadow(':PAGE:MEAS:VARD:OFFS', ':PAGE:MEAS:VARD:OFFS 0;')
+            self.w_shadow(':PAGE:MEAS:VARD:COMP',
+                          ':PAGE:MEAS:VARD:COMP {};'.format(i_limits[1]))
+        self._configure_sweep_stop(abort_at_compliance)
+        self._configure_sweep_display(vs.min(), vs.max(),
+                                      vs.max() >= -vs.min(), smus[0])
+
+    def _run_measurements(self, measurements):
+        """VAR1 sweeps: the first one single, the others appended."""
+        for i, (mode, start, stop, points) in enumerate(measurements):
+            # Any nonzero step for a single point
+            step = (stop - start) / (points - 1) if points > 1 else 1
+            self.w_shadow(':PAGE:MEAS:VAR1:MODE',
+                          ':PAGE:MEAS:VAR1:MODE {};'.format(mode))
+            self.w_shadow(':PAGE:MEAS:VAR1:STAR',
+                          ':PAGE:MEAS:VAR1:STAR {};'.format(start))
+            self.w_shadow(':PAGE:MEAS:VAR1:STOP',
+                          ':PAGE:MEAS:VAR1:STOP {};'.format(stop))
+            self.w_shadow(':PAGE:MEAS:VAR1:STEP',
+                          ':PAGE:MEAS:VAR1:STEP {};'.format(step))
+            self.w(':PAGE:SCON:MEAS:APP' if i else ':PAGE:SCON:MEAS:SING')
+            # Wait for the sweep before changing the settings
+            self.w('*WAI')
+
+
+class TestAgilent4156C(unittest.TestCase):
     def test_10_properties(self):
         a.reset()
         a.integration_time = 'MED'
@@ -295,11 +804,13 @@ class TestAgilent4156C(unittest2.TestCase):
 
 
 if __name__ == '__main__':
+    import visa
+
     rm = visa.ResourceManager()
     a_rsrc = rm.open_resource('GPIB0::18::INSTR')
     a = Agilent4156C(use_us_commands=False, gnd_smu=2, bias_smu=1, rsrc=a_rsrc)
 
-    unittest2.main()
+    unittest.main()
 
     # a.contact_test()
     # a.double_sweep_from_zero(2, 1, 10e-3, 1e-3)
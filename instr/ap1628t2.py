@@ -1,9 +1,9 @@
 ﻿import datetime
 import time
+import unittest
 
 import numpy as np
 from progressbar import ProgressBar
-import unittest2
 
 from instr.base import BaseInstr
 
@@ -43,7 +43,7 @@ class AP1628T2(BaseInstr):
             return self._analog_value_debug
         resp = self.q('T1')  # 'A1D+00000,A2D+00000,A3D000,A4D000,A5D000,H0\r\n'
         ret = resp.split(',')[0]  # 'A1D+00000'
-        ret = int(ret[4:])
+        ret = int(ret[3:])
         return ret
 
     @_analog_value.setter
@@ -137,6 +137,10 @@ class AP1628T2(BaseInstr):
         pbar.finish()
         return ret
 
+    async def asweep(self, *args, **kwargs):
+        """Awaitable sweep."""
+        return await self.run_async(self.sweep, *args, **kwargs)
+
     def reset(self):
         # '*RST' is dengerous because it turn off the magnetic field abruptly.
         self.sweep(0, self._analog_step_max)
@@ -147,7 +151,7 @@ class AP1628T2(BaseInstr):
         raise NotImplementedError
 
 
-class TestAP1628t2(unittest2.TestCase):
+class TestAP1628t2(unittest.TestCase):
     def atest10_analog_value(self):
         ap.reset()
         print(ap._analog_value)
@@ -193,7 +197,7 @@ if __name__ == '__main__':
     ap = AP1628T2(None)
 
     try:
-        unittest2.main()
+        unittest.main()
     finally:
         ap.sweep(0)
     pass
@@ -1,17 +1,99 @@
-﻿import inspect
+﻿from contextlib import contextmanager
+from functools import partial, wraps
+import inspect
 from math import floor
 import re
+from time import perf_counter
 
 import numpy as np
-import visa
+
+from instr.sweep_plan import SweepPlan, SweepResult, abort_index, refine
+
+# visa.constants.VI_ERROR_TMO (pyvisa is imported by the caller who opens
+# the resource, not here)
+_VI_ERROR_TMO = -1073807339
+
+
+def parse_binary_blocks(raw, dtype):
+    """
+    Decode IEEE 488.2 binary blocks into arrays without intermediate
+    strings.  Definite length blocks ('#<n><length><data>') can be
+    separated by ';' or ','.  An indefinite length block ('#0<data>') runs
+    to the terminating newline.
+
+    >>> one_two = np.array([1.0, 2.0], '>f8').tobytes()
+    >>> parse_binary_blocks(b'#216' + one_two + b';#18' + one_two[8:] + b'\\n',
+    ...                     '>f8')
+    [array([1., 2.]), array([2.])]
+    >>> parse_binary_blocks(b'#0' + np.array([3.0], '<f8').tobytes() + b'\\n',
+    ...                     '<f8')
+    [array([3.])]
+
+    :type raw: bytes
+    :param dtype: e.g. '>f8' (REAL,64 big endian)
+    :return: native byte order arrays
+    :rtype: list of np.ndarray
+    """
+    dtype = np.dtype(dtype)
+    native = dtype.newbyteorder('=')
+    blocks = []
+    i = raw.find(b'#')
+    while i >= 0:
+        n = int(raw[i + 1:i + 2])
+        if n == 0:
+            data = raw[i + 2:]
+            if data.endswith(b'\n'):
+                data = data[:-1]
+            data = data[:len(data) // dtype.itemsize * dtype.itemsize]
+            blocks.append(np.frombuffer(data, dtype).astype(native))
+            break
+        length = int(raw[i + 2:i + 2 + n])
+        start = i + 2 + n
+        blocks.append(np.frombuffer(raw[start:start + length],
+                                    dtype).astype(native))
+        i = raw.find(b'#', start + length)
+    return blocks
+
+
+@contextmanager
+def _nullcontext():
+    yield
+
+
+def operation_method(method):
+    """Decorator: run the method in BaseInstr.operation()."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.operation():
+            return method(self, *args, **kwargs)
+    return wrapper
 
 
 class BaseInstr:
+    # Maximum length (bytes) of a message joined by batch().
+    # None: send the writes in a batch one by one.
+    _input_buffer_size = None
+    _batch_writes = None  # list of pending writes while in batch()
+    _batch_check = False  # check_error() was deferred in batch()
+    _error_check = 'call'  # see error_check
+    _op_checks = None  # check_error() deferred in each nested operation()
+    _stats = None  # BusStats if enabled
+    _stats_name = None
+    _async_lock = None  # (event loop, asyncio.Lock)
+    use_shadow = True  # see w_shadow
+    _shadow = None  # {setting key: last write_str}
+    _shadow_since_reset = False  # _shadow tracks everything since reset()
+    # Timeout in deadline(): expected duration * timeout_factor
+    # + timeout_margin_sec
+    timeout_factor = 2.0
+    timeout_margin_sec = 5.0
+
     def __init__(self, rsrc, idn=None, timeout_sec=5, reset=True):
         """
         >>> b = BaseInstr(None)
         debug mode (BaseInstr): skip BaseInstr.__init__.
 
+        >>> import visa
         >>> rm = visa.ResourceManager()
         ... # rm = visa.ResourceManager('C:\\Windows\\system32\\visa32.dll')
         >>> rm.list_resources()
@@ -21,7 +103,8 @@ class BaseInstr:
         >>> idn = 'LSCI,MODEL331S,333342,061404'
         >>> b = BaseInstr(rsrc, idn, reset=True)
 
-        :param rsrc: Instrument VISA resource
+        :param rsrc: Instrument VISA resource, or an emulator
+                     (see instr.emulator)
         :param timeout_sec: second
         :type timeout_sec: int
         :type reset: bool
@@ -91,12 +174,57 @@ class BaseInstr:
             self._dbg_print('q: return empty string.')
             res = ''
         else:
-            res = self._rsrc.query(query_str)
+            self._send_batch()
+            res = self._query(query_str)
+
+        if chkerr:
+            self.check_error()
+        return res
+
+    def q_raw(self, query_str, chkerr=False):
+        """
+        VISA query returning raw bytes, e.g. binary blocks.
+        (See parse_binary_blocks.)
+
+        >>> b = BaseInstr(None)
+        debug mode (BaseInstr): skip BaseInstr.__init__.
+
+        >>> b.q_raw(':DATA?')
+        debug mode (BaseInstr): q_raw: return empty bytes.
+        b''
+
+        :rtype: bytes
+        """
+        if self._debug_mode:
+            self._dbg_print('q_raw: return empty bytes.')
+            res = b''
+        else:
+            self._send_batch()
+            res = self._query_raw(query_str)
 
         if chkerr:
             self.check_error()
         return res
 
+    def r_raw(self):
+        """
+        Read the response of a query sent by w(), e.g. sent in one message
+        with the next commands so that they run while this reads.
+
+        >>> b = BaseInstr(None)
+        debug mode (BaseInstr): skip BaseInstr.__init__.
+        >>> b.r_raw()
+        debug mode (BaseInstr): r_raw: return empty bytes.
+        b''
+
+        :rtype: bytes
+        """
+        if self._debug_mode:
+            self._dbg_print('r_raw: return empty bytes.')
+            return b''
+        self._send_batch()
+        return self._read_raw()
+
     def w(self, write_str, chkerr=False):
         """
         Write.
@@ -110,16 +238,58 @@ class BaseInstr:
         """
         if self._debug_mode:
             self._dbg_print_skip_method()
+        elif self._batch_writes is not None:
+            self._batch_writes.append(write_str)
         else:
-            self._rsrc.write(write_str)
+            self._write(write_str)
 
         if chkerr:
             self.check_error()
 
-    # Abstract methods ---------------------------------------------------------
+    # Shadow state -------------------------------------------------------------
+    def w_shadow(self, key, write_str, chkerr=False):
+        """
+        w(write_str) unless the last write_str of the setting key is the
+        same, i.e. the instrument already has the setting.
+        The shadow is invalidated on reset, on an error and on an exception
+        in operation() or batch().  Call invalidate_shadow() after changing
+        a setting in another way (front panel, plain w()).
+
+        >>> from instr.ke2636a import Keithley2636A
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> k = Keithley2636A(Keithley2636AEmulator())
+        >>> k.w_shadow('smua.source.limiti', 'smua.source.limiti = 1e-3')
+        True
+        >>> k.w_shadow('smua.source.limiti', 'smua.source.limiti = 1e-3')
+        False
+
+        :return: True if written
+        """
+        if self._debug_mode or not self.use_shadow:
+            self.w(write_str, chkerr)
+            return True
+        if self._shadow is None:
+            self._shadow = {}
+        if self._shadow.get(key) == write_str:
+            return False
+        self.w(write_str, chkerr)
+        self._shadow[key] = write_str
+        return True
+
+    def invalidate_shadow(self):
+        """Forget the settings known to be in the instrument."""
+        self._shadow = {}
+        self._shadow_since_reset = False
+
+    def _reset_shadow(self):
+        """Call after the instrument has been reset."""
+        self._shadow = {}
+        self._shadow_since_reset = True
+
     def check_error(self):
         """
-        Call super if debug mode.
+        Raise RuntimeError if the instrument reports an error.
+        Deferred to the end of batch() if in batch().
 
         >>> b = BaseInstr(None)
         debug mode (BaseInstr): skip BaseInstr.__init__.
@@ -129,9 +299,344 @@ class BaseInstr:
         """
         if self._debug_mode:
             self._dbg_print_skip_method()
+        elif self._batch_writes is not None:
+            self._batch_check = True
+        elif self._op_checks and self._error_check == 'operation':
+            self._op_checks[-1] = True
+        elif self._op_checks and self._error_check == 'deferred':
+            self._op_checks[0] = True
+        else:
+            self._run_check(self._error_check == 'status')
+
+    def _run_check(self, probe):
+        """
+        _check_error(), only if _error_pending() if probe.
+        Timed as 'check_error' if stats are enabled.
+        """
+        t0 = perf_counter()
+        try:
+            if not probe or self._error_pending():
+                self._check_error()
+        except Exception:
+            self.invalidate_shadow()
+            raise
+        finally:
+            if self._stats is not None:
+                self._stats.record(self._stats_name, 'check_error',
+                                   'check_error', perf_counter() - t0)
+
+    @property
+    def error_check(self):
+        """
+        When check_error() queries the instrument.
+
+        'call': every call (default).
+        'status': every call, but query the error only if a cheap status
+                  read (_error_pending) signals an error.
+        'operation': once at the end of each operation (driver methods
+                     such as a sweep or a configuration step).
+        'deferred': once at the end of the outermost operation,
+                    e.g. the whole sweep.
+
+        >>> from instr.ke2636a import Keithley2636A
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> k = Keithley2636A(Keithley2636AEmulator())
+        >>> k.error_check = 'status'
+        >>> k.w('x = 1', True)
+        >>> k._rsrc.log[-1]
+        'print(errorqueue.count)'
+        >>> k.w('invalid', True)
+        Traceback (most recent call last):
+        ...
+        RuntimeError: Error on Keithley 2636A.
+
+        >>> k.error_check = 'deferred'
+        >>> with k.operation():
+        ...     k.w('x = 1', True)
+        ...     k.w('y = 2', True)
+        >>> list(k._rsrc.log)[-3:]
+        ['x = 1', 'y = 2', 'print(errorqueue.next())']
+        """
+        return self._error_check
+
+    @error_check.setter
+    def error_check(self, value):
+        if value not in ['call', 'status', 'operation', 'deferred']:
+            raise ValueError("error_check: 'call', 'status', 'operation' "
+                             "or 'deferred'")
+        self._error_check = value
+
+    @contextmanager
+    def operation(self):
+        """
+        Group instrument calls for the 'operation' and 'deferred'
+        error_check policies.  Nestable.  See also operation_method.
+        A resource shared through instr.daemon is held by this client for
+        the outermost operation; the shadow state is invalidated if another
+        client has written to it meanwhile.
+        """
+        if self._op_checks is None:
+            self._op_checks = []
+        hold = getattr(self._rsrc, 'hold', None) \
+            if not self._op_checks and not self._debug_mode else None
+        with hold() if hold is not None else _nullcontext() as foreign:
+            if foreign:
+                self.invalidate_shadow()
+            self._op_checks.append(False)
+            try:
+                yield
+            except Exception:
+                self.invalidate_shadow()
+                raise
+            finally:
+                deferred = self._op_checks.pop()
+            if deferred:
+                self._run_check(False)
+
+    # Deadline -----------------------------------------------------------------
+    @contextmanager
+    def deadline(self, expected_sec):
+        """
+        Time out the instrument calls in the block after the expected
+        duration with margin instead of the global timeout.  On a timeout,
+        recover() and raise TimeoutError.  Nestable: the innermost applies.
+
+        >>> from instr.ke2636a import Keithley2636A
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> k = Keithley2636A(Keithley2636AEmulator())
+        >>> k.timeout_margin_sec = 0.1
+        >>> k._rsrc.hang = True
+        >>> with k.deadline(0.05):
+        ...     k.q('print(x)')
+        Traceback (most recent call last):
+        ...
+        TimeoutError: Keithley2636A: no response in 0.2s (expected 0.05s)
+        >>> k._rsrc.timeout
+        600000
+
+        :param expected_sec: expected duration of the block
+        """
+        if self._debug_mode:
+            yield
+            return
+        timeout_sec = expected_sec * self.timeout_factor + \
+            self.timeout_margin_sec
+        timeout = self._rsrc.timeout
+        self._rsrc.timeout = timeout_sec * 1000  # millisec
+        try:
+            yield
+        except Exception as e:
+            # visa.VisaIOError
+            if getattr(e, 'error_code', None) != _VI_ERROR_TMO:
+                raise
+            self._rsrc.timeout = self.timeout_margin_sec * 1000
+            self.recover()
+            raise TimeoutError('{}: no response in {:.3g}s (expected {:.3g}s)'.
+                               format(self.__class__.__name__, timeout_sec,
+                                      expected_sec)) from e
+        finally:
+            self._rsrc.timeout = timeout
+
+    def recover(self):
+        """
+        Fast recovery from a timeout: device clear, clear the errors and
+        forget the shadow state so that the next operation configures the
+        instrument again.
+        """
+        if self._debug_mode:
+            self._dbg_print_skip_method()
+            return
+        self._rsrc.clear()
+        self._clear_errors()
+        self.invalidate_shadow()
+
+    def _clear_errors(self):
+        """Clear the error queue without checking."""
+        pass
+
+    # Batch --------------------------------------------------------------------
+    @contextmanager
+    def batch(self):
+        """
+        Collect writes and send them joined by ';' in messages no longer
+        than _input_buffer_size, and check error once at the end.
+        A query in the batch sends the collected writes before it.
+        The collected writes are discarded if an exception is raised.
+
+        >>> from instr.agilent4156c import Agilent4156C
+        >>> from instr.emulator import Agilent4156CEmulator
+        >>> a = Agilent4156C(rsrc=Agilent4156CEmulator())
+        >>> with a.batch():
+        ...     a.w(':PAGE:CHAN:SMU3:DIS', True)
+        ...     a.w(':PAGE:CHAN:SMU4:DIS;', True)
+        >>> list(a._rsrc.log)[-2:]
+        [':PAGE:CHAN:SMU3:DIS;:PAGE:CHAN:SMU4:DIS', 'SYST:ERR?']
+        """
+        if self._batch_writes is not None:  # nested
+            yield
+            return
+        self._batch_writes = []
+        self._batch_check = False
+        try:
+            yield
+            self._send_batch()
+        except Exception:
+            self.invalidate_shadow()
+            raise
+        finally:
+            self._batch_writes = None
+        if self._batch_check:
+            self.check_error()
+
+    def _batch_unit(self, write_str):
+        """A write as an element of a joined message."""
+        return write_str.strip().rstrip(';')
+
+    def _send_batch(self):
+        """Send the writes collected in batch() (if any)."""
+        if not self._batch_writes:
+            return
+        writes = self._batch_writes[:]
+        del self._batch_writes[:]
+        if self._input_buffer_size is None:
+            for write_str in writes:
+                self._write(write_str)
+            return
+        msg = ''
+        for unit in map(self._batch_unit, writes):
+            if msg and len(msg) + 1 + len(unit) <= self._input_buffer_size:
+                msg += ';' + unit
+            else:
+                if msg:
+                    self._write(msg)
+                msg = unit
+        if msg:
+            self._write(msg)
+
+    # Bus ----------------------------------------------------------------------
+    def _write(self, message):
+        if self._stats is None:
+            self._rsrc.write(message)
             return
+        t0 = perf_counter()
+        self._rsrc.write(message)
+        self._stats.record(self._stats_name, 'w', message,
+                           perf_counter() - t0, len(message))
+
+    def _query(self, message):
+        if self._stats is None:
+            return self._rsrc.query(message)
+        t0 = perf_counter()
+        resp = self._rsrc.query(message)
+        self._stats.record(self._stats_name, 'q', message,
+                           perf_counter() - t0, len(message), len(resp))
+        return resp
+
+    def _read_raw(self):
+        t0 = perf_counter()
+        resp = self._rsrc.read_raw()
+        if self._stats is not None:
+            self._stats.record(self._stats_name, 'r', '',
+                               perf_counter() - t0, 0, len(resp))
+        return resp
+
+    def _query_raw(self, message):
+        t0 = perf_counter()
+        # One request of a resource shared through instr.daemon
+        query_raw = getattr(self._rsrc, 'query_raw', None)
+        if query_raw is not None:
+            resp = query_raw(message)
         else:
-            raise NotImplementedError
+            self._rsrc.write(message)
+            resp = self._rsrc.read_raw()
+        if self._stats is not None:
+            self._stats.record(self._stats_name, 'q', message,
+                               perf_counter() - t0, len(message), len(resp))
+        return resp
+
+    def enable_stats(self, stats=None, name=None):
+        """
+        Record latency and bytes of every q and w, and the time of
+        check_error, per command prefix.
+
+        >>> from instr.ke2636a import Keithley2636A
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> k = Keithley2636A(Keithley2636AEmulator())
+        >>> vis, aborted = k.iv_sweep(0, 0.1, v_points=11)
+        >>> stats = k.enable_stats()
+        >>> vis, aborted = k.iv_sweep(0, 0.1, v_points=11)
+        >>> for row in stats.rows():
+        ...     print(row['kind'], row['command'], row['count'])
+        check_error check_error 1
+        q print(errorqueue.next) 1
+        r  1
+        w instr_SweepLin 1
+        >>> k.disable_stats()
+
+        :param stats: BusStats to share among instruments.  None: new one.
+        :param name: Instrument name in the stats.  None: class name.
+        :rtype: instr.bus_stats.BusStats
+        """
+        from instr.bus_stats import BusStats
+        self._stats = BusStats() if stats is None else stats
+        self._stats_name = self.__class__.__name__ if name is None else name
+        return self._stats
+
+    def disable_stats(self):
+        self._stats = None
+
+    # asyncio ------------------------------------------------------------------
+    async def run_async(self, method, *args, **kwargs):
+        """
+        Awaitable call of a blocking driver method.
+
+        The call runs in the default executor of the event loop while the
+        loop drives other instruments.  Calls on one instrument are
+        serialized; calls on different instruments run concurrently.
+
+        >>> import asyncio
+        >>> from instr.ke2636a import Keithley2636A
+        >>> from instr.lsci331 import LSCI331
+        >>> from instr.emulator import Keithley2636AEmulator, LSCI331Emulator
+        >>> ke = Keithley2636A(Keithley2636AEmulator())
+        >>> ls = LSCI331(LSCI331Emulator())
+        >>> async def main():
+        ...     return await asyncio.gather(ke.aiv_sweep(0, 0.1, v_points=11),
+        ...                                 ls.aread_temp_kelvin(),
+        ...                                 ke.aq('print(errorqueue.count)'))
+        >>> loop = asyncio.new_event_loop()
+        >>> (vis, aborted), temp, count = loop.run_until_complete(main())
+        >>> loop.close()
+        >>> vis.shape, temp, count
+        ((11, 2), 293.15, '0.00000e+00\\n')
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        if self._async_lock is None or self._async_lock[0] is not loop:
+            self._async_lock = (loop, asyncio.Lock())
+        async with self._async_lock[1]:
+            return await loop.run_in_executor(
+                None, partial(method, *args, **kwargs))
+
+    async def aq(self, query_str, chkerr=False):
+        """Awaitable q."""
+        return await self.run_async(self.q, query_str, chkerr)
+
+    async def aw(self, write_str, chkerr=False):
+        """Awaitable w."""
+        await self.run_async(self.w, write_str, chkerr)
+
+    # Abstract methods ---------------------------------------------------------
+    def _check_error(self):
+        """Query the error of the instrument and raise RuntimeError."""
+        raise NotImplementedError
+
+    def _error_pending(self):
+        """
+        Cheap check for the 'status' policy (e.g. status byte).
+        True if there may be an error.  Override if the instrument has one.
+        """
+        return True
 
     def reset(self):
         """
@@ -146,6 +651,69 @@ class BaseInstr:
 
 
 class SourceMeter(BaseInstr):
+    # Device under test simulated in debug mode (see instr.dut).
+    # None: 1kOhm with one noise sample per sweep.
+    dut = None
+    # |I| >= _compliance_ratio * i_limit: at compliance (abort_at_compliance)
+    _compliance_ratio = 0.99
+    # Measurement profiles (see profile): {name: {setting: value}}, the
+    # settings specific to each instrument
+    _profiles = {}
+    # profile = 'auto': the first of these profiles with |i_limit| >= current
+    _auto_profiles = (('fast', 1e-6), ('balanced', 1e-9), ('precise', 0.0))
+    _profile = None
+
+    @property
+    def profile(self):
+        """
+        Speed/accuracy trade-off of the following measurements: 'fast',
+        'balanced' or 'precise', mapped to the settings of each driver
+        (see its _profiles), e.g.
+
+        Keithley2400: integration time (0.01, 1, 10 PLC), autozero, current
+                      range (fixed at i_limit for 'fast') and display
+        Keithley2636A: the same except the display
+        Agilent4156C: integration time only (SHOR, MED, LONG)
+
+        'auto': by i_limit, e.g. 'fast' for mA and 'precise' for pA
+        None: leave the settings as they are (default)
+
+        >>> s = SourceMeter(None)
+        debug mode (SourceMeter): skip BaseInstr.__init__.
+        >>> s._profiles = {'fast': {}, 'balanced': {}, 'precise': {}}
+        >>> s.profile = 'auto'
+        >>> s._profile_name(1e-3), s._profile_name(-1e-8), s._profile_name(0)
+        ('fast', 'balanced', 'precise')
+        >>> s.profile = 'slow'
+        Traceback (most recent call last):
+        ...
+        ValueError: profile: None, 'auto', 'balanced', 'fast', 'precise'
+        """
+        return self._profile
+
+    @profile.setter
+    def profile(self, value):
+        allowed = [None]
+        if self._profiles:
+            allowed += ['auto'] + sorted(self._profiles)
+        if value not in allowed:
+            raise ValueError('profile: ' + ', '.join(map(repr, allowed)))
+        self._profile = value
+
+    def _profile_name(self, i_limit):
+        """Profile of a measurement at i_limit, None if not set."""
+        if self._profile != 'auto':
+            return self._profile
+        for name, current in self._auto_profiles:
+            if abs(i_limit) >= current:
+                return name
+        return self._auto_profiles[-1][0]
+
+    def _profile_settings(self, i_limit):
+        """:return: settings of _profiles, None if profile is not set"""
+        name = self._profile_name(i_limit)
+        return None if name is None else self._profiles[name]
+
     @staticmethod
     def _v_points_to_step(v_start, v_end, v_points):
         """
@@ -184,7 +752,7 @@ class SourceMeter(BaseInstr):
                  i_limit=1e-3):
         """
         Call super().iv_sweep if debug mode.
-        debug mode: Simulate 1kOhm resistance with noise ~1nA.
+        debug mode: Simulate dut, or 1kOhm resistance with noise ~1nA.
 
         >>> s = SourceMeter(None)
         debug mode (SourceMeter): skip BaseInstr.__init__.
@@ -208,6 +776,14 @@ class SourceMeter(BaseInstr):
         debug mode (SourceMeter): iv_sweep: Return dummy data.
         (array([[  0.00000000e+00,   1.62434536e-09]]), False)
 
+        >>> from instr.dut import Breakdown, Ohmic
+        >>> s.dut = Breakdown(Ohmic(1e3), v_bd=1.5, r_bd=10)
+        >>> s.iv_sweep(0, 2, v_points=3, i_limit=0.1)
+        debug mode (SourceMeter): iv_sweep: Return dummy data.
+        (array([[0.e+00, 0.e+00],
+               [1.e+00, 1.e-03],
+               [2.e+00, 1.e-01]]), False)
+
         :param i_limit: positive. (absolute value)
         :type v_start: float
         :type v_end: float
@@ -222,12 +798,16 @@ class SourceMeter(BaseInstr):
         if self._debug_mode:
             self._dbg_print('iv_sweep: Return dummy data.')
             vs = np.linspace(v_start, v_end, v_points)
-            Is = vs / 1000 + np.random.normal(0, 1e-9)
+            if self.dut is None:
+                Is = vs / 1000 + np.random.normal(0, 1e-9)
+            else:
+                Is = np.clip(self.dut(vs), -abs(i_limit), abs(i_limit))
             vis = np.array([vs, Is]).transpose()
             return vis, False
         else:
             raise NotImplementedError()
 
+    @operation_method
     def iv_sweep_double(self, v_max, v_step=1e-3, v_points=None,
                         i_limit=1e-3):
         """
@@ -271,11 +851,180 @@ class SourceMeter(BaseInstr):
         vis = np.concatenate((vis1, vis2))
         return vis, aborted
 
+    @operation_method
+    def iv_sweep_plan(self, plan, i_limit=1e-3, abort_at_compliance=False,
+                      abort_di=None):
+        """
+        Sweep all segments of plan, e.g. SweepPlan.linear([0, V, 0, -V, 0]).
+        Drivers with list sweeps run the plan as one instrument-side program
+        with one data transfer, and stop it in the instrument on the abort
+        conditions.  Implementation example: one iv_sweep per linear run of
+        the plan, checking the abort conditions after each.
+
+        >>> from instr.dut import Breakdown, Ohmic
+        >>> s = SourceMeter(None)
+        debug mode (SourceMeter): skip BaseInstr.__init__.
+        >>> s.dut = Ohmic(1e3)
+        >>> vis, aborted = s.iv_sweep_plan(SweepPlan.linear([0, 1, -1],
+        ...                                                 v_points=2))
+        debug mode (SourceMeter): iv_sweep_plan: Return dummy data.
+        >>> vis
+        array([[ 0.   ,  0.   ],
+               [ 1.   ,  0.001],
+               [-1.   , -0.001]])
+        >>> s.dut = Breakdown(Ohmic(1e3), v_bd=0.5, r_bd=10)
+        >>> result = s.iv_sweep_plan(np.linspace(0, 1, 11), i_limit=0.01,
+        ...                          abort_at_compliance=True)
+        debug mode (SourceMeter): iv_sweep_plan: Return dummy data.
+        >>> result.vis[-1], result.aborted, result.reason
+        (array([0.5 , 0.01]), True, 'compliance')
+
+        :param plan: SweepPlan, or array-like voltages
+        :param abort_at_compliance: stop at the first point at compliance
+        :param abort_di: stop at the first |I - I of the previous point|
+                         >= abort_di (A), e.g. breakdown
+        :return: [(v0, i0), (v1, i1), ...], is_aborted, with .reason
+        :rtype: SweepResult
+        """
+        plan = SweepPlan.of(plan)
+        i_stop = self._compliance_ratio * abs(i_limit) \
+            if abort_at_compliance else None
+        if self._debug_mode:
+            self._dbg_print('iv_sweep_plan: Return dummy data.')
+            vs = plan.voltages()
+            if self.dut is None:
+                Is = vs / 1000 + np.random.normal(0, 1e-9)
+            else:
+                Is = np.clip(self.dut(vs), -abs(i_limit), abs(i_limit))
+            vis = np.array([vs, Is]).transpose()
+            i, reason = abort_index(Is, i_stop, abort_di)
+            if i is None or i == len(vis) - 1:
+                return SweepResult(vis, False)
+            return SweepResult(vis[:i + 1], True, reason)
+        visl = []
+        aborted = False
+        reason = None
+        for v_start, v_end, v_points in plan.linear_runs():
+            vis, aborted = self.iv_sweep(v_start, v_end, v_points=v_points,
+                                         i_limit=i_limit)
+            visl.append(vis)
+            if aborted:
+                reason = 'unknown'
+                break
+            vis = np.concatenate(visl)
+            i, reason = abort_index(vis[:, 1], i_stop, abort_di)
+            if i is not None:
+                visl = [vis[:i + 1]]
+                aborted = i + 1 < len(plan.voltages())
+                reason = reason if aborted else None
+                break
+        vis = np.concatenate(visl) if visl else np.empty((0, 2))
+        return SweepResult(vis, aborted, reason)
+
+    @operation_method
+    def iv_sweep_adaptive(self, v_start, v_end, i_limit=1e-3, v_points=11,
+                          max_points=101, atol=1e-9, rtol=1e-2, min_step=0.0):
+        """
+        Sweep v_points points, then add points (one iv_sweep_plan per pass)
+        only where the curve bends (see sweep_plan.refine) until the
+        interpolation error is within atol + rtol * max|I| or max_points
+        are measured.  The passes revisit the voltage range: not for
+        devices with history (e.g. hysteresis).
+
+        >>> from instr.dut import Cubic, Ohmic
+        >>> s = SourceMeter(None)
+        debug mode (SourceMeter): skip BaseInstr.__init__.
+        >>> s._dbg_print = lambda *args, **kwargs: None
+        >>> s.dut = Ohmic(1e3)
+        >>> vis, aborted = s.iv_sweep_adaptive(0, 1)
+        >>> len(vis)
+        11
+        >>> s.dut = Cubic(1e-3, 0, 1e-2)
+        >>> vis, aborted = s.iv_sweep_adaptive(-1, 1, rtol=1e-3)
+        >>> 11 < len(vis) < 101, bool((np.diff(vis[:, 0]) > 0).all())
+        (True, True)
+
+        :param v_points: points of the first, uniform pass
+        :param max_points: point budget
+        :param min_step: do not split intervals narrower than 2 * min_step
+        :return: [(v, i), ...] ordered from v_start to v_end, is_aborted
+        :rtype: (np.ndarray, bool)
+        """
+        vis, aborted = self.iv_sweep_plan(
+            np.linspace(v_start, v_end, min(v_points, max_points)), i_limit)
+        while not aborted:
+            vs = refine(vis, max_points - len(vis), atol, rtol, min_step)
+            if not len(vs):
+                break
+            new, aborted = self.iv_sweep_plan(
+                vs if v_end >= v_start else vs[::-1], i_limit)
+            vis = np.concatenate((vis, new))
+        order = np.argsort(vis[:, 0], kind='stable')
+        if v_end < v_start:
+            order = order[::-1]
+        return vis[order], aborted
+
+    def iv_sweep_channels(self, plan, channels=None, i_limit=1e-3):
+        """
+        Sweep plan on several channels (SMUs) simultaneously, each on its
+        own device or pad.
+
+        :param plan: SweepPlan, or array-like voltages
+        :param channels: channel names of the driver
+        :param i_limit: compliance, or compliances of the channels
+        :return: [vis of each channel], is_aborted (of any channel)
+        """
+        raise NotImplementedError()
+
+    def iv_sweep_stream(self, plan, i_limit=1e-3, chunk_points=100):
+        """
+        Generator of chunks [(v, i), ...] of the sweep of plan, yielded while
+        the sweep runs on drivers reading the instrument buffer
+        incrementally, for live plotting, online fitting or early abort
+        (stop iterating and close() the generator).
+        The return value (vis_aborted = yield from ...) is is_aborted.
+        Implementation example: chunks of iv_sweep_plan after the sweep.
+
+        >>> from instr.dut import Ohmic
+        >>> s = SourceMeter(None)
+        debug mode (SourceMeter): skip BaseInstr.__init__.
+        >>> s.dut = Ohmic(1e3)
+        >>> for vis in s.iv_sweep_stream(np.linspace(0, 1, 5), chunk_points=2):
+        ...     print(vis[:, 0])
+        debug mode (SourceMeter): iv_sweep_plan: Return dummy data.
+        [0.   0.25]
+        [0.5  0.75]
+        [1.]
+
+        :param plan: SweepPlan, or array-like voltages
+        :param chunk_points: points per chunk (implementation example)
+        """
+        vis, aborted = self.iv_sweep_plan(plan, i_limit)
+        for i in range(0, len(vis), chunk_points):
+            yield vis[i:i + chunk_points]
+        return aborted
+
+    async def aiv_sweep(self, *args, **kwargs):
+        """Awaitable iv_sweep."""
+        return await self.run_async(self.iv_sweep, *args, **kwargs)
+
+    async def aiv_sweep_double(self, *args, **kwargs):
+        """Awaitable iv_sweep_double."""
+        return await self.run_async(self.iv_sweep_double, *args, **kwargs)
+
+    async def aiv_sweep_plan(self, *args, **kwargs):
+        """Awaitable iv_sweep_plan."""
+        return await self.run_async(self.iv_sweep_plan, *args, **kwargs)
+
 
 class TemperatureController(BaseInstr):
     def read_temp(self):
         raise NotImplementedError
 
+    async def aread_temp(self):
+        """Awaitable read_temp."""
+        return await self.run_async(self.read_temp)
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
@@ -0,0 +1,141 @@
+"""
+Latency and transfer statistics of instrument bus calls.
+
+Enable on each instrument with BaseInstr.enable_stats(); one BusStats can be
+shared by several instruments.
+
+>>> stats = BusStats()
+>>> stats.record('Agilent4156C', 'q', ':DATA? V1', 0.02, 10, 1000)
+>>> stats.record('Agilent4156C', 'q', ':DATA? I1', 0.04, 10, 1000)
+>>> row, = stats.rows()
+>>> row['command'], row['count'], row['total_s'], row['bytes_read']
+(':DATA?', 2, 0.06, 2000)
+"""
+import csv
+import json
+from math import floor, log10
+import re
+import threading
+
+_token = re.compile(r"[^\s(=;,']+")
+_numeric_tail = re.compile(r'[-+]\d+$|\d{2,}$')
+
+
+def command_prefix(message):
+    """
+    Command header without arguments.
+
+    >>> command_prefix(':PAGE:MEAS:VAR1:STOP 0.1;')
+    ':PAGE:MEAS:VAR1:STOP'
+    >>> command_prefix('SweepVLinMeasureI(smua, 0, 1, 0, 11)')
+    'SweepVLinMeasureI'
+    >>> command_prefix('print(errorqueue.next())')
+    'print(errorqueue.next)'
+    >>> command_prefix('A1D+00100')
+    'A1D'
+    """
+    message = message.strip()
+    match = _token.match(message)
+    if match is None:
+        return message
+    prefix = match.group()
+    if prefix == 'print' and message[match.end():].startswith('('):
+        return 'print({})'.format(command_prefix(message[match.end() + 1:]))
+    return _numeric_tail.sub('', prefix) or prefix
+
+
+class BusStats:
+    """
+    Count, time, bytes and a latency histogram for each
+    (instrument, kind, command prefix).
+    kind: 'w' (write), 'q' (query), 'r' (read of a response queried by a
+    write) or 'check_error' (whole check, including its queries, which are
+    also counted as 'q').
+    """
+    # Histogram: log-spaced bins from 1us to 1000s
+    bins_per_decade = 4
+    min_exp = -6
+    max_exp = 3
+
+    def __init__(self):
+        self._n_bins = (self.max_exp - self.min_exp) * self.bins_per_decade
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+
+    def record(self, instrument, kind, message, seconds,
+               bytes_written=0, bytes_read=0):
+        key = (instrument, kind, command_prefix(message))
+        if seconds > 0:
+            i = int(floor((log10(seconds) - self.min_exp) *
+                          self.bins_per_decade))
+            i = min(max(i, 0), self._n_bins - 1)
+        else:
+            i = 0
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [0, 0.0, seconds, seconds, 0, 0, [0] * self._n_bins]
+                self._entries[key] = entry
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = min(entry[2], seconds)
+            entry[3] = max(entry[3], seconds)
+            entry[4] += bytes_written
+            entry[5] += bytes_read
+            entry[6][i] += 1
+
+    def bin_edges(self):
+        """Edges (seconds) of the histogram bins.  len: n_bins + 1"""
+        return [10 ** (self.min_exp + i / self.bins_per_decade)
+                for i in range(self._n_bins + 1)]
+
+    def _percentile(self, hist, count, q):
+        """Upper edge of the bin containing the q-quantile."""
+        edges = self.bin_edges()
+        cum = 0
+        for i, n in enumerate(hist):
+            cum += n
+            if cum >= q * count:
+                return edges[i + 1]
+        return edges[-1]
+
+    def rows(self, histogram=False):
+        """
+        :return: list of dict, sorted by (instrument, kind, command)
+        """
+        with self._lock:
+            items = sorted((k, v[:6] + [list(v[6])])
+                           for k, v in self._entries.items())
+        ret = []
+        for (instrument, kind, command), entry in items:
+            count, total, t_min, t_max, n_w, n_r, hist = entry
+            row = {'instrument': instrument, 'kind': kind,
+                   'command': command, 'count': count,
+                   'total_s': total, 'mean_s': total / count,
+                   'min_s': t_min, 'max_s': t_max,
+                   'p50_s': self._percentile(hist, count, 0.5),
+                   'p90_s': self._percentile(hist, count, 0.9),
+                   'bytes_written': n_w, 'bytes_read': n_r}
+            if histogram:
+                row['histogram'] = hist
+            ret.append(row)
+        return ret
+
+    def to_csv(self, path):
+        rows = self.rows()
+        fields = ['instrument', 'kind', 'command', 'count', 'total_s',
+                  'mean_s', 'min_s', 'max_s', 'p50_s', 'p90_s',
+                  'bytes_written', 'bytes_read']
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'bin_edges_s': self.bin_edges(),
+                       'rows': self.rows(histogram=True)}, f, indent=1)
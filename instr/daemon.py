@@ -0,0 +1,373 @@
+"""
+Long-lived local daemon owning the VISA sessions.
+
+Scripts normally create a visa.ResourceManager, scan the bus with
+list_resources() and reset every instrument on connection.  The daemon does
+the scan and *IDN? once and keeps the sessions open; clients attach over a
+localhost socket and get resources usable as rsrc of the drivers:
+
+    $ python -m instr.daemon          # or: python -m instr.daemon --emulate
+
+    rm = resource_manager()  # the daemon, or visa.ResourceManager()
+    rsrc = rm.open_resource('GPIB0::18::INSTR')
+    agi = Agilent4156C(rsrc=rsrc, reset=not getattr(rsrc, 'shared', False))
+
+Each request runs under the lock of its session, so a query (query, or
+query_raw for BaseInstr.q_raw) of one client is not split by the requests
+of other clients.  A response read by a separate request (BaseInstr.r_raw
+after w) is not protected that way: BaseInstr.operation() holds the session
+(RemoteResource.hold()) for a whole sweep or move.
+
+The clients authenticate with a random key of the user in AUTHKEY_FILE
+(readable only by the user), created by the daemon; the messages are
+pickled, so a client can run code in the daemon.
+
+>>> from instr.emulator import EmulatorResourceManager, LSCI331Emulator
+>>> from instr.lsci331 import LSCI331
+>>> key = os.urandom(32)
+>>> d = InstrumentDaemon(EmulatorResourceManager(
+...     {'GPIB0::12::INSTR': LSCI331Emulator()}), ('localhost', 0), key)
+>>> d.start()
+>>> rm = DaemonResourceManager(d.address, key)
+>>> rm.list_resources()
+('GPIB0::12::INSTR',)
+>>> rsrc = rm.open_resource('GPIB0::12::INSTR')
+>>> rsrc.shared
+False
+>>> LSCI331(rsrc).read_temp_kelvin()
+293.15
+>>> rsrc2 = DaemonResourceManager(d.address, key).open_resource(
+...     'GPIB0::12::INSTR')
+>>> rsrc2.shared, rsrc2.query('*IDN?') == rsrc.query('*IDN?')
+(True, True)
+>>> rsrc2.query_raw('KRDG? A').strip()
+b'+293.150'
+>>> rm.close(); rsrc2.close(); d.shutdown()
+"""
+import argparse
+from contextlib import contextmanager
+from multiprocessing.connection import Client, Listener
+import os
+import threading
+
+DEFAULT_ADDRESS = ('localhost', 18861)
+AUTHKEY_FILE = os.path.join(os.path.expanduser('~'), '.instr_daemon_authkey')
+
+# Methods of a VISA resource a client may call; query_raw: write + read_raw
+_rsrc_methods = {'write', 'read', 'read_raw', 'query', 'query_raw', 'clear',
+                 'read_stb'}
+
+
+def read_authkey(create=False, path=AUTHKEY_FILE):
+    """
+    Key of the daemon connections: INSTR_DAEMON_AUTHKEY if set, else the
+    content of path.
+
+    :param create: write a random key to path (mode 0600) if it is missing
+    :rtype: bytes
+    """
+    key = os.environ.get('INSTR_DAEMON_AUTHKEY')
+    if key:
+        return key.encode()
+    if create:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(os.urandom(32).hex())
+    try:
+        with open(path) as f:
+            key = f.read().strip()
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        raise RuntimeError('No key of the daemon in {} (created by '
+                           'python -m instr.daemon).'.format(path))
+    if os.name == 'posix' and mode & 0o077:
+        raise RuntimeError('{} must be readable only by the user '
+                           '(chmod 600).'.format(path))
+    if not key:
+        raise RuntimeError('Empty key in {}.'.format(path))
+    return key.encode()
+
+
+class _Session:
+    """One open VISA resource, shared by the clients."""
+    def __init__(self, rsrc):
+        self.rsrc = rsrc
+        self.idn = None
+        self.n_opened = 0
+        self.last_writer = None  # connection which wrote last
+        self._cond = threading.Condition()
+        self._owner = None  # connection holding the session
+        self._depth = 0
+
+    def acquire(self, owner):
+        with self._cond:
+            while self._owner not in (None, owner):
+                self._cond.wait()
+            self._owner = owner
+            self._depth += 1
+
+    def release(self, owner):
+        with self._cond:
+            if self._owner is not owner:
+                return
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+    def release_all(self, owner):
+        with self._cond:
+            if self._owner is owner:
+                self._owner = None
+                self._depth = 0
+                self._cond.notify_all()
+
+
+class InstrumentDaemon:
+    """
+    Serve the resources of rm (visa.ResourceManager() if None) to local
+    clients.  list_resources() and *IDN? are cached.
+    """
+    def __init__(self, rm=None, address=DEFAULT_ADDRESS, authkey=None):
+        """:param authkey: None: read_authkey(create=True)"""
+        if authkey is None:
+            authkey = read_authkey(create=True)
+        if rm is None:
+            import visa
+            rm = visa.ResourceManager()
+        self._rm = rm
+        self._listener = Listener(address, authkey=authkey)
+        self.address = self._listener.address
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._resources = None
+        self._closed = False
+
+    def start(self):
+        """Serve in a daemon thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def serve_forever(self):
+        while not self._closed:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                if self._closed:
+                    return
+                continue
+            threading.Thread(target=self._serve, args=(conn,),
+                             daemon=True).start()
+
+    def shutdown(self):
+        self._closed = True
+        self._listener.close()
+
+    def list_resources(self, refresh=False):
+        with self._lock:
+            if self._resources is None or refresh:
+                self._resources = tuple(self._rm.list_resources())
+            return self._resources
+
+    def _session(self, name):
+        with self._lock:
+            session = self._sessions.get(name)
+            if session is None:
+                session = _Session(self._rm.open_resource(name))
+                self._sessions[name] = session
+            return session
+
+    def _serve(self, conn):
+        owner = object()
+        held = set()
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    ret = ('ok', self._handle(owner, held, *request))
+                except Exception as e:
+                    ret = ('error', e)
+                try:
+                    conn.send(ret)
+                except Exception as e:  # unpicklable
+                    conn.send(('error', RuntimeError(repr(e))))
+        finally:
+            for session in held:
+                session.release_all(owner)
+            conn.close()
+
+    def _handle(self, owner, held, op, name=None, *args):
+        if op == 'list_resources':
+            return self.list_resources(*args)
+        session = self._session(name)
+        if op == 'open':
+            with self._lock:
+                session.n_opened += 1
+                return session.n_opened > 1
+        if op == 'hold':
+            session.acquire(owner)
+            held.add(session)
+            return session.last_writer not in (None, owner)
+        if op == 'release':
+            session.release(owner)
+            return None
+        if op != 'call':
+            raise ValueError('Unknown request: {}'.format(op))
+        timeout, method, *args = args
+        if method not in _rsrc_methods:
+            raise ValueError('Not a resource method: {}'.format(method))
+        session.acquire(owner)
+        try:
+            if method == 'query' and args[0].strip() == '*IDN?':
+                if session.idn is None:
+                    session.rsrc.timeout = timeout
+                    session.idn = session.rsrc.query(*args)
+                return session.idn
+            session.rsrc.timeout = timeout
+            if method in ('write', 'query', 'query_raw', 'clear'):
+                session.last_writer = owner
+            if method == 'query_raw':
+                session.rsrc.write(*args)
+                return session.rsrc.read_raw()
+            return getattr(session.rsrc, method)(*args)
+        finally:
+            session.release(owner)
+
+
+class RemoteResource:
+    """
+    VISA resource served by the daemon.
+    shared: another client opened the resource before; the instrument is
+    probably configured already, so drivers can be built with reset=False.
+    """
+    def __init__(self, conn, conn_lock, name, shared):
+        self._conn = conn
+        self._conn_lock = conn_lock
+        self.resource_name = name
+        self.shared = shared
+        self.timeout = 2000  # millisec
+
+    def _call(self, method, *args):
+        return _request(self._conn, self._conn_lock, 'call',
+                        self.resource_name, self.timeout, method, *args)
+
+    def write(self, message):
+        return self._call('write', message)
+
+    def read(self):
+        return self._call('read')
+
+    def read_raw(self):
+        return self._call('read_raw')
+
+    def query(self, message):
+        return self._call('query', message)
+
+    def query_raw(self, message):
+        """write and read_raw in one request (see BaseInstr.q_raw)."""
+        return self._call('query_raw', message)
+
+    def clear(self):
+        return self._call('clear')
+
+    def read_stb(self):
+        return self._call('read_stb')
+
+    @contextmanager
+    def hold(self):
+        """
+        Keep other clients off the session.  Nestable.
+        Yields True if another client has written to the session since this
+        client wrote last.
+        """
+        foreign = _request(self._conn, self._conn_lock, 'hold',
+                           self.resource_name)
+        try:
+            yield foreign
+        finally:
+            _request(self._conn, self._conn_lock, 'release',
+                     self.resource_name)
+
+    def close(self):
+        """The session stays open in the daemon."""
+        pass
+
+
+class DaemonResourceManager:
+    """visa.ResourceManager-like client of InstrumentDaemon."""
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        """:param authkey: None: read_authkey()"""
+        if authkey is None:
+            authkey = read_authkey()
+        self._conn = Client(address, authkey=authkey)
+        self._conn_lock = threading.Lock()
+
+    def list_resources(self, refresh=False):
+        return _request(self._conn, self._conn_lock, 'list_resources', None,
+                        refresh)
+
+    def open_resource(self, name):
+        shared = _request(self._conn, self._conn_lock, 'open', name)
+        return RemoteResource(self._conn, self._conn_lock, name, shared)
+
+    def close(self):
+        self._conn.close()
+
+
+def _request(conn, conn_lock, *request):
+    with conn_lock:
+        conn.send(request)
+        status, ret = conn.recv()
+    if status == 'error':
+        raise ret
+    return ret
+
+
+def resource_manager(address=DEFAULT_ADDRESS):
+    """
+    DaemonResourceManager if the daemon is running, else
+    visa.ResourceManager().
+    """
+    if 'INSTR_DAEMON_AUTHKEY' in os.environ or os.path.exists(AUTHKEY_FILE):
+        try:
+            return DaemonResourceManager(address)
+        except ConnectionRefusedError:
+            pass
+    # else the daemon has never run for this user
+    import visa
+    return visa.ResourceManager()
+
+
+def _emulated_rm():
+    from instr import emulator
+    return emulator.EmulatorResourceManager({
+        'GPIB0::1::INSTR': emulator.Sci9700Emulator(),
+        'GPIB0::3::INSTR': emulator.AP1628T2Emulator(),
+        'GPIB0::7::INSTR': emulator.SussPA300Emulator(),
+        'GPIB0::12::INSTR': emulator.LSCI331Emulator(),
+        'GPIB0::18::INSTR': emulator.Agilent4156CEmulator(),
+        'GPIB0::26::INSTR': emulator.Keithley2636AEmulator(),
+        'GPIB0::27::INSTR': emulator.Keithley2400Emulator(),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument('--emulate', action='store_true',
+                        help='serve instr.emulator instruments')
+    args = parser.parse_args()
+    d = InstrumentDaemon(_emulated_rm() if args.emulate else None,
+                         (DEFAULT_ADDRESS[0], args.port))
+    print('Serving on {}:{}'.format(*d.address))
+    d.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
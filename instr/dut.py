@@ -0,0 +1,245 @@
+"""
+Vectorized device-under-test models: I(V) for SourceMeter debug mode
+(SourceMeter.dut) and for the source meter emulators (instr.emulator).
+
+Parameters broadcast with the voltages, so one model with parameter arrays of
+shape (n_dies, 1) computes a whole wafer at once (see WaferModel).
+
+>>> Ohmic(1e3)([0.0, 0.1, 0.2])
+array([0.    , 0.0001, 0.0002])
+>>> Cubic(1e-3, 0, 1e-2)([1.0, -1.0])
+array([ 0.011, -0.011])
+>>> Ohmic(np.array([[1e3], [2e3]]))([0.1, 0.2])
+array([[1.e-04, 2.e-04],
+       [5.e-05, 1.e-04]])
+"""
+import numpy as np
+
+
+class DUT:
+    """
+    :param noise: standard deviation (A) of gaussian noise added to each point
+    :param seed: seed of the noise
+    """
+    def __init__(self, noise=0.0, seed=None):
+        self.noise = noise
+        self.rng = np.random.RandomState(seed)
+
+    def __call__(self, vs):
+        """
+        :param vs: voltages (V)
+        :return: currents (A), shape broadcast(parameters, vs)
+        :rtype: np.ndarray
+        """
+        Is = self.current(np.asarray(vs, np.float64))
+        if self.noise:
+            Is = Is + self.rng.normal(0, self.noise, np.shape(Is))
+        return Is
+
+    def current(self, vs):
+        raise NotImplementedError
+
+    def reset(self):
+        """Forget the history of stateful models."""
+        pass
+
+
+class Ohmic(DUT):
+    def __init__(self, r=1e3, **kwargs):
+        """:param r: resistance (Ohm)"""
+        super().__init__(**kwargs)
+        self.r = r
+
+    def current(self, vs):
+        return vs / self.r
+
+
+class Cubic(DUT):
+    """
+    I = c1 V + c2 V^2 + c3 V^3, the model of lib.algorithms.fit_R3
+    (e.g. tunnel junctions).
+    """
+    def __init__(self, c1=1e-3, c2=0.0, c3=1e-4, **kwargs):
+        super().__init__(**kwargs)
+        self.c1 = c1
+        self.c2 = c2
+        self.c3 = c3
+
+    def current(self, vs):
+        return vs * (self.c1 + vs * (self.c2 + vs * self.c3))
+
+
+class Open(DUT):
+    def __init__(self, r_leak=np.inf, **kwargs):
+        """:param r_leak: leak resistance (Ohm)"""
+        super().__init__(**kwargs)
+        self.r_leak = r_leak
+
+    def current(self, vs):
+        return vs / self.r_leak
+
+
+class Short(Ohmic):
+    def __init__(self, r=1.0, **kwargs):
+        super().__init__(r, **kwargs)
+
+
+class Breakdown(DUT):
+    """
+    The model below |V| = v_bd.  The device breaks irreversibly at v_bd and
+    becomes a short of r_bd, also in later calls until reset().
+
+    >>> bd = Breakdown(Ohmic(1e3), 1.0, r_bd=10.0)
+    >>> bd([0.5, 1.0, 0.5])
+    array([0.0005, 0.1   , 0.05  ])
+    >>> bd([0.5])
+    array([0.05])
+    """
+    def __init__(self, model=None, v_bd=1.0, r_bd=10.0, **kwargs):
+        super().__init__(**kwargs)
+        self.model = Ohmic() if model is None else model
+        self.v_bd = v_bd
+        self.r_bd = r_bd
+        self.broken = False
+
+    def current(self, vs):
+        over = np.abs(vs) >= self.v_bd
+        broken = np.logical_or(np.maximum.accumulate(over, axis=-1),
+                               self.broken)
+        self.broken = broken[..., -1] if broken.size else self.broken
+        return np.where(broken, vs / self.r_bd, self.model.current(vs))
+
+    def reset(self):
+        self.broken = False
+
+
+class Hysteretic(DUT):
+    """
+    Bipolar resistive switch: r_off -> r_on at V >= v_set,
+    r_on -> r_off at V <= v_reset.  The state carries over calls.
+
+    >>> sw = Hysteretic(r_off=1e4, r_on=1e2, v_set=1.0, v_reset=-1.0)
+    >>> sw([0.5, 1.0, 0.5, -0.5, -1.0, -0.5])
+    array([ 5.e-05,  1.e-02,  5.e-03, -5.e-03, -1.e-04, -5.e-05])
+    """
+    def __init__(self, r_off=1e5, r_on=1e3, v_set=1.0, v_reset=-1.0,
+                 on=False, **kwargs):
+        super().__init__(**kwargs)
+        self.r_off = r_off
+        self.r_on = r_on
+        self.v_set = v_set
+        self.v_reset = v_reset
+        self.on = on
+
+    def current(self, vs):
+        vs, v_set, v_reset = np.broadcast_arrays(vs, self.v_set, self.v_reset)
+        # Index of the last set/reset event up to each point; -1: none
+        idx = np.arange(vs.shape[-1])
+        event = np.where((vs >= v_set) | (vs <= v_reset), idx, -1)
+        last = np.maximum.accumulate(event, axis=-1)
+        on_at_event = np.take_along_axis(vs >= v_set, np.maximum(last, 0),
+                                         axis=-1)
+        on = np.where(last >= 0, on_at_event, self.on)
+        if on.size:
+            self.on = on[..., -1]
+        return vs / np.where(on, self.r_on, self.r_off)
+
+    def reset(self):
+        self.on = False
+
+
+class WaferModel:
+    """
+    Per-die parameters of a model over a wafer: lognormal die-to-die spread,
+    a radial gradient and randomly placed open/short dies.
+
+    >>> w = WaferModel(Ohmic, {'r': 1e3}, spread=0.1, seed=0)
+    >>> XYs = [(X, Y) for X in range(-10, 11) for Y in range(-10, 11)]
+    >>> Is = w.synthesize(XYs, np.linspace(0, 1, 101))
+    >>> Is.shape
+    (441, 101)
+    >>> r = w.parameters(XYs)['r']
+    >>> bool(800 < np.median(r) < 1250)
+    True
+    >>> dut = w.model_at(0, 0)  # the same die as in parameters()
+    >>> type(dut).__name__, dut.r == float(r[XYs.index((0, 0))])
+    ('Ohmic', True)
+    """
+    def __init__(self, model, params, spread=0.05, radial=0.0, radius=10.0,
+                 open_rate=0.0, short_rate=0.0, noise=0.0, seed=None):
+        """
+        :param model: DUT class, e.g. Ohmic
+        :param params: {parameter name: value at the wafer center}
+        :param spread: sigma of log(parameter) among dies
+        :param radial: relative change of the parameters at the radius
+        :param radius: die coordinate distance of the wafer edge
+        :param open_rate: fraction of open dies
+        :param short_rate: fraction of short dies
+        :param noise: standard deviation (A) of measurement noise
+        """
+        self.model = model
+        self.params = dict(params)
+        self.spread = spread
+        self.radial = radial
+        self.radius = radius
+        self.open_rate = open_rate
+        self.short_rate = short_rate
+        self.noise = noise
+        self.seed = seed
+
+    def parameters(self, XYs):
+        """
+        :return: {parameter name: array of len(XYs)}, 'defect':
+                 0 normal, 1 open, 2 short
+        """
+        XYs = np.asarray(XYs, np.float64).reshape(-1, 2)
+        names = sorted(self.params)
+        # Drawn per die, so a die gets the same parameters in any XYs
+        defect_draw = np.empty(len(XYs))
+        gauss = np.empty((len(XYs), len(names)))
+        for i, (X, Y) in enumerate(XYs):
+            seed = None if self.seed is None else \
+                hash((self.seed, int(X), int(Y))) % 2 ** 32
+            rng = np.random.RandomState(seed)
+            defect_draw[i] = rng.random_sample()
+            gauss[i] = rng.standard_normal(len(names))
+        r = np.hypot(XYs[:, 0], XYs[:, 1]) / self.radius
+        ret = {}
+        for i, name in enumerate(names):
+            ret[name] = self.params[name] * (1 + self.radial * r ** 2) * \
+                np.exp(self.spread * gauss[:, i])
+        defect = np.zeros(len(XYs), int)
+        defect[defect_draw < self.open_rate] = 1
+        defect[(defect_draw >= self.open_rate) &
+               (defect_draw < self.open_rate + self.short_rate)] = 2
+        ret['defect'] = defect
+        return ret
+
+    def model_at(self, X, Y):
+        """:rtype: DUT"""
+        params = self.parameters([(X, Y)])
+        defect = params.pop('defect')[0]
+        if defect == 1:
+            return Open(noise=self.noise)
+        if defect == 2:
+            return Short(noise=self.noise)
+        return self.model(noise=self.noise,
+                          **{k: float(v[0]) for k, v in params.items()})
+
+    def synthesize(self, XYs, vs):
+        """
+        Currents of all dies at once.
+        :return: shape (len(XYs), len(vs))
+        """
+        params = self.parameters(XYs)
+        defect = params.pop('defect')
+        model = self.model(**{k: v[:, None] for k, v in params.items()})
+        vs = np.asarray(vs, np.float64)
+        Is = np.broadcast_to(model.current(vs), (len(defect), len(vs))).copy()
+        Is[defect == 1] = 0.0
+        Is[defect == 2] = vs / Short().r
+        if self.noise:
+            Is += np.random.RandomState(self.seed).normal(0, self.noise,
+                                                          Is.shape)
+        return Is
+
@@ -0,0 +1,1036 @@
+"""
+VISA-level emulators of the instruments in instr/.
+
+An emulator behaves like a pyvisa resource (write, read, read_raw, query,
+clear, read_stb, timeout) and speaks the command set the corresponding
+driver sends, so it can be passed to the driver as rsrc:
+
+>>> from instr.agilent4156c import Agilent4156C
+>>> agi = Agilent4156C(rsrc=Agilent4156CEmulator())
+>>> vis, aborted = agi.iv_sweep_double(0.1, v_points=11)
+>>> vis.shape, aborted
+((22, 2), False)
+>>> float(vis[10, 1])  # 0.1V / 1kOhm
+0.0001
+
+Bus costs:
+    latency: seconds per written message.
+    latencies: {command prefix: seconds}, overrides latency.
+    transfer_rate: bytes per second (None: infinite).
+Physical durations (sweeps, chuck moves, ...) are multiplied by time_scale.
+0 (default) makes them instantaneous, 1 emulates real time.
+Set hang = True to emulate a hung instrument.
+"""
+from collections import deque
+import math
+import re
+import time
+
+import numpy as np
+
+from instr.dut import Ohmic
+from instr.sweep_plan import abort_index
+
+
+def _split_top_level(message, sep=';'):
+    """
+    Split message at sep outside quotes and parentheses.
+
+    >>> _split_top_level(":A 'x;y';B 1")
+    [":A 'x;y'", 'B 1']
+    >>> _split_top_level('f(a; b); c')
+    ['f(a; b)', 'c']
+    """
+    units = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, ch in enumerate(message):
+        if quote is not None:
+            if ch == quote:
+                quote = None
+        elif ch in '\'"':
+            quote = ch
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == sep and depth == 0:
+            units.append(message[start:i].strip())
+            start = i + 1
+    units.append(message[start:].strip())
+    return [u for u in units if u]
+
+
+def _lua_top_level(source):
+    """
+    Statements of a Lua chunk outside blocks (function, if, for, while, do,
+    repeat), checking that the blocks are closed.  Strings and comments
+    are not parsed.
+
+    >>> _lua_top_level('function f(x)\\n  if x then y = 1 end\\nend\\nz = 2')
+    ['z = 2']
+    >>> _lua_top_level('function f(x)\\n  if x then y = 1\\nend')
+    Traceback (most recent call last):
+    ...
+    ValueError: line 3: 'end' expected near <eof>
+
+    :raise ValueError: message as of the Lua compiler
+    """
+    top = []
+    depth = 0
+    lines = source.splitlines()
+    for n, line in enumerate(lines, 1):
+        code = re.sub(r'--.*$', '', re.sub(r'"[^"]*"|\'[^\']*\'', '""', line))
+        start = depth
+        for word in re.findall(r'[A-Za-z_]\w*', code):
+            if word in ('function', 'if', 'do', 'repeat'):
+                depth += 1
+            elif word in ('end', 'until'):
+                depth -= 1
+            if depth < 0:
+                raise ValueError("line {}: '<eof>' expected near '{}'".
+                                 format(n, word))
+        if start == 0 and depth == 0 and code.strip():
+            top.append(code.strip())
+    if depth:
+        raise ValueError("line {}: 'end' expected near <eof>".
+                         format(len(lines)))
+    return top
+
+
+def _scpi_units(message):
+    """
+    (header, argument) of each unit of a SCPI message, headers in upper case
+    and made absolute (a header without ':' is relative to the previous one).
+
+    >>> list(_scpi_units(':SOUR:VOLT:STAR 0;STOP 1;*OPC?'))
+    [(':SOUR:VOLT:STAR', '0'), (':SOUR:VOLT:STOP', '1'), ('*OPC?', '')]
+    """
+    path = ':'
+    for unit in _split_top_level(message):
+        header, _, arg = unit.partition(' ')
+        header = header.upper()
+        if not header.startswith('*'):
+            if not header.startswith(':'):
+                header = path + header
+            path = header[:header.rfind(':') + 1]
+        yield header, arg.strip()
+
+
+class EmulatedResource:
+    """
+    Base class of the emulators.
+
+    Subclasses implement _execute(message) -> list of responses (str or
+    bytes, without termination).  Responses are read in order; a read with
+    no pending response times out like a real instrument.
+    """
+    idn = ''
+    termination = '\n'
+    response_separator = None  # None: one message per response
+
+    def __init__(self, latency=0.0, latencies=None, transfer_rate=None,
+                 time_scale=0.0):
+        self.timeout = 2000  # millisec (same unit as pyvisa)
+        self.latency = latency
+        self.latencies = {} if latencies is None else latencies
+        self.transfer_rate = transfer_rate
+        self.time_scale = time_scale
+        self._output = []
+        self._busy_until = 0.0
+        self._errors = []
+        self._esr = 0  # standard event status register
+        self.log = deque(maxlen=1000)  # written messages
+        self.hang = False  # True: never respond (also after clear())
+
+    # pyvisa resource interface ------------------------------------------------
+    def write(self, message):
+        self.log.append(message)
+        self._bus_delay(self._latency_of(message), len(message))
+        resps = self._execute(message.strip())
+        resps = [r.encode('latin-1') if isinstance(r, str) else r
+                 for r in resps if r is not None]
+        if not resps:
+            return
+        term = self.termination.encode('latin-1')
+        if self.response_separator is None:
+            self._output += [r + term for r in resps]
+        else:
+            sep = self.response_separator.encode('latin-1')
+            self._output.append(sep.join(resps) + term)
+
+    def read_raw(self):
+        wait = self._busy_until - time.monotonic()
+        if self.hang or not self._output or wait > self.timeout / 1000:
+            time.sleep(self.timeout / 1000)
+            self._raise_timeout()
+        if wait > 0:
+            time.sleep(wait)
+        resp = self._output.pop(0)
+        self._bus_delay(0.0, len(resp))
+        return resp
+
+    def read(self):
+        return self.read_raw().decode('latin-1')
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def clear(self):
+        """Device clear: abort the running operation and the output."""
+        self._output = []
+        self._busy_until = 0.0
+
+    def read_stb(self):
+        return 0
+
+    def close(self):
+        pass
+
+    # Helpers ------------------------------------------------------------------
+    def _latency_of(self, message):
+        for prefix, sec in self.latencies.items():
+            if message.startswith(prefix):
+                return sec
+        return self.latency
+
+    def _bus_delay(self, latency, nbytes):
+        sec = latency
+        if self.transfer_rate:
+            sec += nbytes / self.transfer_rate
+        if sec > 0:
+            time.sleep(sec)
+
+    def _occupy(self, seconds):
+        """Keep the instrument busy (e.g. sweeping) for seconds."""
+        now = time.monotonic()
+        self._busy_until = max(now, self._busy_until) + \
+            seconds * self.time_scale
+
+    def _error(self, code, message):
+        """Push an error to the queue and set the IEEE 488.2 ESR bit."""
+        self._errors.append((code, message))
+        # -1xx: command, -2xx: execution, -3xx: device, -4xx: query error
+        self._esr |= {1: 32, 2: 16, 3: 8, 4: 4}.get(-code // 100, 8)
+
+    @staticmethod
+    def _raise_timeout():
+        import visa
+        raise visa.VisaIOError(visa.constants.VI_ERROR_TMO)
+
+    def _execute(self, message):
+        raise NotImplementedError
+
+
+class _SourceMeterEmulator(EmulatedResource):
+    def __init__(self, dut=None, duts=None, noise=0.0, seed=None, **kwargs):
+        """
+        :param dut: Device under test (see instr.dut), or any vectorized
+                    function of voltage (V) returning current (A).
+                    None: Ohmic(1e3).
+        :param duts: {channel: dut} of channels with another device.
+                     channel: SMU number (4156C) or 'smua'/'smub' (2636A)
+        :param noise: standard deviation (A) of the measurement noise at an
+                      integration time of 1 PLC, scaled by 1 / sqrt(NPLC)
+        :param seed: seed of the noise
+        """
+        super().__init__(**kwargs)
+        self.dut = Ohmic(1e3) if dut is None else dut
+        self.duts = {} if duts is None else duts
+        self.noise = noise
+        self.rng = np.random.RandomState(seed)
+
+    def _measure(self, vs, i_limit, channel=None, nplc=1.0):
+        dut = self.duts.get(channel, self.dut)
+        Is = np.asarray(dut(np.asarray(vs, np.float64)), np.float64)
+        if self.noise:
+            Is = Is + self.rng.normal(0, self.noise / np.sqrt(nplc),
+                                      np.shape(Is))
+        return np.clip(Is, -abs(i_limit), abs(i_limit))
+
+
+class Agilent4156CEmulator(_SourceMeterEmulator):
+    """
+    SCPI subset used by Agilent4156C.
+
+    Settings are stored by full header (e.g. ':PAGE:CHAN:SMU1:MODE').
+    """
+    idn = 'HEWLETT-PACKARD,4156C,0,03.08:01.05:01.00'
+    response_separator = ';'
+    _fill = 9.91e307
+    _integration_sec = {'SHOR': 0.64e-3, 'MED': 20e-3, 'LONG': 320e-3}
+    _sweep_points = 1001
+    _data_points = 8000
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._rst()
+
+    def _rst(self):
+        self._settings = {}
+        self._data = {}
+        self._format = 'ASC'
+
+    def _setting(self, *headers, default=None):
+        for header in headers:
+            if header in self._settings:
+                return self._settings[header]
+        return default
+
+    def _execute(self, message):
+        return [self._handle(header, arg)
+                for header, arg in _scpi_units(message)]
+
+    def _handle(self, header, arg):
+        if header == '*IDN?':
+            return self.idn
+        elif header == '*RST':
+            self._rst()
+        elif header == '*CLS':
+            self._errors = []
+            self._esr = 0
+        elif header == '*OPC?':
+            return '1'
+        elif header == '*WAI':
+            pass  # commands are executed in order
+        elif header == '*ESR?':
+            esr, self._esr = self._esr, 0
+            return '+{}'.format(esr)
+        elif header == ':SYST:ERR?':
+            if not self._errors:
+                return '+0,"No error"'
+            return '{:+d},"{}"'.format(*self._errors.pop(0))
+        elif header == ':FORM:DATA':
+            self._format = arg.upper()
+        elif header == ':DATA?':
+            return self._format_data(self._data.get(arg.strip('\'"').upper()))
+        elif header in (':PAGE:SCON:SING', ':PAGE:SCON:MEAS:SING'):
+            self._single()
+        elif header in (':PAGE:SCON:APP', ':PAGE:SCON:MEAS:APP'):
+            self._single(append=True)
+        elif header == ':PAGE:SCON:STOP':
+            self._busy_until = 0.0
+        elif header.endswith('?'):
+            value = self._settings.get(header[:-1])
+            if value is None:
+                self._error(-113, 'Undefined header')
+            return value
+        elif header.startswith(':PAGE:CHAN:SMU'):
+            smu = header[:len(':PAGE:CHAN:SMU1')]
+            if header.endswith(':DIS'):
+                for key in [k for k in self._settings if k.startswith(smu)]:
+                    del self._settings[key]
+            else:
+                self._settings.pop(smu + ':DIS', None)
+            self._settings[header] = arg
+        else:
+            self._settings[header] = arg
+        return None
+
+    def _format_data(self, values):
+        if values is None:
+            self._error(-222, 'Data out of range')
+            return ''
+        if self._format.replace(' ', '') == 'REAL,64':
+            data = np.asarray(values, '>f8').tobytes()
+            length = str(len(data))
+            return '#{}{}'.format(len(length), length).encode() + data
+        return ','.join('{:+.5E}'.format(x) for x in values)
+
+    def _smus(self):
+        """[(smu_num, mode, func, v_name, i_name), ...] of enabled SMUs."""
+        ret = []
+        for n in (1, 2, 3, 4):
+            pre = ':PAGE:CHAN:SMU{}:'.format(n)
+            if pre + 'DIS' in self._settings:
+                continue
+            ret.append((n, self._setting(pre + 'MODE', default='COMM'),
+                        self._setting(pre + 'FUNC', default='CONS'),
+                        self._setting(pre + 'VNAM', default="'V{}'".format(n))
+                        .strip('\'"').upper(),
+                        self._setting(pre + 'INAM', default="'I{}'".format(n))
+                        .strip('\'"').upper()))
+        return ret
+
+    def _single(self, append=False):
+        """
+        :param append: Append the data to the previous measurement
+                       (sweep mode).
+        """
+        previous = self._data
+        self._data = {}
+        itime = self._integration_sec.get(
+            self._setting(':PAGE:MEAS:MSET:ITIM', default='SHOR'), 0.64e-3)
+        nplc = itime / self._integration_sec['MED']  # MED: 1 PLC
+        if self._setting(':PAGE:CHAN:MODE', default='SWE') == 'SAMP':
+            points = int(float(self._setting(':PAGE:MEAS:SAMP:POIN',
+                                             default='101')))
+            interval = float(self._setting(':PAGE:MEAS:SAMP:IINT',
+                                           default='2e-3'))
+            self._data['@TIME'] = np.arange(points) * interval
+            for n, mode, func, v_name, i_name in self._smus():
+                v = float(self._setting(
+                    ':PAGE:MEAS:SAMP:CONS:SMU{}'.format(n), default='0'))
+                comp = float(self._setting(
+                    ':PAGE:MEAS:SAMP:CONS:SMU{}:COMP'.format(n),
+                    default='0.1'))
+                vs = np.full(points, v if mode == 'V' else 0.0)
+                self._data[v_name] = vs
+                self._data[i_name] = self._measure(vs, comp, n, nplc)
+            self._occupy(points * max(interval, itime))
+            return
+
+        start = float(self._setting(':PAGE:MEAS:SWE:VAR1:STAR',
+                                    ':PAGE:MEAS:VAR1:STAR', default='0'))
+        stop = float(self._setting(':PAGE:MEAS:SWE:VAR1:STOP',
+                                   ':PAGE:MEAS:VAR1:STOP', default='1'))
+        step = float(self._setting(':PAGE:MEAS:SWE:VAR1:STEP',
+                                   ':PAGE:MEAS:VAR1:STEP', default='0.01'))
+        comp = float(self._setting(':PAGE:MEAS:SWE:VAR1:COMP',
+                                   ':PAGE:MEAS:VAR1:COMP', default='0.1'))
+        points = int(math.floor(round(abs((stop - start) / step), 9))) + 1
+        if points > self._sweep_points:
+            self._error(-222, 'Too many sweep steps')
+            return
+        vs = start + np.sign(stop - start) * abs(step) * np.arange(points)
+        if self._setting(':PAGE:MEAS:SWE:VAR1:MODE',
+                         ':PAGE:MEAS:VAR1:MODE', default='SING') == 'DOUB':
+            vs = np.concatenate((vs, vs[::-1]))
+        at_comp = np.zeros(len(vs), bool)
+        for n, mode, func, v_name, i_name in self._smus():
+            if func == 'VAR1' and mode == 'V':
+                self._data[v_name] = vs
+                self._data[i_name] = self._measure(vs, comp, n, nplc)
+                at_comp |= np.abs(self._data[i_name]) >= abs(comp)
+            elif func == 'VARD' and mode == 'V':
+                vds = vs * float(self._setting(':PAGE:MEAS:VARD:RAT',
+                                               default='1')) + \
+                    float(self._setting(':PAGE:MEAS:VARD:OFFS', default='0'))
+                vard_comp = float(self._setting(':PAGE:MEAS:VARD:COMP',
+                                                default='0.1'))
+                self._data[v_name] = vds
+                self._data[i_name] = self._measure(vds, vard_comp, n, nplc)
+                at_comp |= np.abs(self._data[i_name]) >= abs(vard_comp)
+            else:
+                self._data[v_name] = np.zeros(len(vs))
+                self._data[i_name] = np.zeros(len(vs))
+        measured = len(vs)
+        # Sweep stop condition: the points after compliance are not measured
+        if self._setting(':PAGE:MEAS:SWE:SST', ':PAGE:MEAS:SST',
+                         default='OFF').upper().startswith('COMP') and \
+                at_comp.any():
+            measured = int(np.argmax(at_comp)) + 1
+            for values in self._data.values():
+                values[measured:] = self._fill
+        if append:
+            for name, values in previous.items():
+                if name in self._data:
+                    self._data[name] = np.concatenate((values,
+                                                       self._data[name]))
+        if any(len(values) > self._data_points
+               for values in self._data.values()):
+            self._error(-225, 'DATA buffer full. Too many points.')
+            self._data = previous
+            return
+        self._occupy(measured * itime)
+
+
+class Keithley2636AEmulator(_SourceMeterEmulator):
+    """
+    TSP subset used by Keithley2636A: reset(), attribute assignments,
+    number tables, SweepVLinMeasureI, SweepVListMeasureI, list sweeps of
+    the trigger model (running in the background), printbuffer and
+    print(errorqueue...).  Functions defined by the driver (function NAME(
+    ... end, or in a named script loaded by loadscript ... endscript and
+    run by NAME.run()) are emulated by _tsp_NAME and must be defined
+    before a call.
+    """
+    idn = 'Keithley Instruments Inc., Model 2636A, 1234567, 2.1.6'
+    _assign = re.compile(r'^([\w.\[\]]+)\s*=\s*(.+)$')
+    _call = re.compile(r'^([\w.]+)\((.*)\)$')
+    _extend = re.compile(r'^for _, v in ipairs\(\{(.*)\}\) do '
+                         r'table\.insert\((\w+), v\) end$')
+    _function = re.compile(r'^function (\w+)\(.*\bend$')
+    _script_function = re.compile(r'^function (\w+)\(', re.M)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._functions = set()  # survive reset() as in the instrument
+        self._scripts = {}  # {name: source}
+        self._loading = None  # [name, lines] between loadscript, endscript
+        self._reset()
+
+    def _reset(self, smu=None):
+        smus = ('smua', 'smub') if smu is None else (smu,)
+        if smu is None:
+            self._vars = {}
+            self._running = {}
+        self._vars.update({'format.data': 'format.ASCII',
+                           'format.byteorder': 'format.LITTLEENDIAN'})
+        for s in smus:
+            self._vars.update({s + '.source.limiti': 0.1,
+                               s + '.measure.nplc': 1.0,
+                               s + '.nvbuffer1.collectsourcevalues': 0.0,
+                               s + '.trigger.count': 1.0})
+            self._running.pop(s, None)
+            for attr in ('readings', 'sourcevalues', 'timestamps'):
+                self._vars['{}.nvbuffer1.{}'.format(s, attr)] = np.array([])
+
+    def _execute(self, message):
+        if self._loading is not None:
+            if message == 'endscript':
+                name, lines = self._loading
+                self._loading = None
+                try:
+                    _lua_top_level('\n'.join(lines))
+                except ValueError as e:
+                    self._error(-285, 'TSP Syntax error at {}'.format(e))
+                else:
+                    self._scripts[name] = '\n'.join(lines)
+            else:
+                self._loading[1].append(message)
+            return []
+        if message.startswith('loadscript '):
+            self._loading = [message.split()[1], []]
+            return []
+        resps = []
+        for stmt in _split_top_level(message):
+            if stmt == '*IDN?':
+                resps.append(self.idn)
+                continue
+            elif stmt in ('reset()', '*RST'):
+                self._reset()
+                continue
+            elif stmt == '*CLS':
+                self._errors = []
+                self._esr = 0
+                continue
+            match = self._function.match(stmt)
+            if match:
+                self._functions.add(match.group(1))
+                continue
+            match = self._extend.match(stmt)
+            if match:
+                name = match.group(2)
+                self._vars[name] = np.append(
+                    self._vars.get(name, np.array([])),
+                    self._eval('{' + match.group(1) + '}'))
+                continue
+            match = self._assign.match(stmt)
+            if match and '(' not in match.group(1):
+                self._vars[match.group(1)] = self._eval(match.group(2))
+                continue
+            match = self._call.match(stmt)
+            if match is None:
+                self._error(-285, 'TSP Syntax error at line 1: '
+                                  "unexpected symbol near '{}'".format(stmt))
+                continue
+            func, args = match.group(1), _split_top_level(match.group(2), ',')
+            if func.endswith('.run') and func[:-4] in self._scripts:
+                source = self._scripts[func[:-4]]
+                self._functions.update(self._script_function.findall(source))
+                # Top-level assignments, e.g. a flag set at the end
+                resps += self._execute(';'.join(
+                    stmt for stmt in _lua_top_level(source)
+                    if self._assign.match(stmt)))
+                continue
+            handler = getattr(self, '_tsp_' + func.replace('.', '_'), None)
+            if func.startswith('instr_') and func not in self._functions:
+                handler = None
+            smu, _, method = func.partition('.')
+            if handler is None and smu in ('smua', 'smub'):
+                handler = getattr(self, '_tsp_smu_' + method.replace('.', '_'),
+                                  None)
+                args.insert(0, smu)
+            if handler is None:
+                self._error(-286, 'TSP Runtime error at line 1: '
+                                  "attempt to call '{}'".format(func))
+                continue
+            resps.append(handler(*args))
+        return resps
+
+    def _eval(self, expr):
+        expr = expr.strip()
+        try:
+            return float(expr)
+        except ValueError:
+            pass
+        if expr in self._vars:
+            return self._vars[expr]
+        if expr.endswith('.n') and expr[:-2] + '.readings' in self._vars:
+            return float(self._n_done(expr.split('.')[0]))
+        if expr.startswith('{') and expr.endswith('}'):
+            return np.array([float(x) for x in expr[1:-1].split(',')
+                             if x.strip()])
+        return expr
+
+    def _measure_smu(self, smu, vs):
+        return self._measure(vs, self._vars[smu + '.source.limiti'], smu,
+                             self._vars[smu + '.measure.nplc'])
+
+    def _tsp_print(self, expr):
+        if expr == 'errorqueue.next()':
+            if not self._errors:
+                return '0.00000e+00\tQueue Is Empty\t0.00000e+00'
+            code, msg = self._errors.pop(0)
+            return '{:.5e}\t{}\t{:.5e}'.format(code, msg, 20)
+        elif expr == 'errorqueue.count':
+            return '{:.5e}'.format(len(self._errors))
+        elif expr in ('smua.measure.i()', 'smub.measure.i()'):
+            smu = expr[:4]
+            return '{:.5e}'.format(float(self._measure_smu(
+                smu, [self._level(smu)])[0]))
+        value = self._eval(expr)
+        if isinstance(value, float):
+            return '{:.5e}'.format(value)
+        return str(value)
+
+    def _tsp_errorqueue_clear(self):
+        self._errors = []
+
+    def _tsp_smu_reset(self, smu):
+        self._reset(smu)
+
+    def _tsp_smu_nvbuffer1_clear(self, smu):
+        for attr in ('readings', 'sourcevalues', 'timestamps'):
+            self._vars['{}.nvbuffer1.{}'.format(smu, attr)] = np.array([])
+        self._running.pop(smu, None)
+
+    def _tsp_smu_trigger_source_listv(self, smu, vlist):
+        self._vars[smu + '.trigger.source.listv'] = self._eval(vlist)
+
+    def _tsp_smu_trigger_measure_i(self, smu, buf):
+        self._vars[smu + '.trigger.measure.i'] = buf.strip()
+
+    def _tsp_smu_trigger_initiate(self, smu):
+        """Start the sweep in the background; the points become readable
+        as time passes (time_scale)."""
+        points = int(self._vars[smu + '.trigger.count'])
+        if self._vars.get(smu + '.trigger.source.action') == \
+                smu + '.DISABLE':
+            vs = np.full(points, self._level(smu))
+        else:
+            vs = self._vars.get(smu + '.trigger.source.listv', np.array([]))
+        if len(vs) < points:
+            self._error(-286, 'TSP Runtime error: source list too short')
+            return
+        # Measurements paced by a timer: trigger.timer[N].EVENT_ID
+        stimulus = str(self._vars.get(smu + '.trigger.measure.stimulus', 0))
+        interval = 0.0
+        if stimulus.endswith('.EVENT_ID'):
+            interval = float(self._vars.get(
+                stimulus[:-len('.EVENT_ID')] + '.delay', 0.0))
+        self._sweep(smu, vs[:points], self._vars.get(smu + '.measure.delay',
+                                                     0.0), background=True,
+                    interval=interval)
+
+    def _level(self, smu):
+        """Source voltage; 0 if the output is off."""
+        output = self._vars.get(smu + '.source.output', 0.0)
+        if output not in (1.0, smu + '.OUTPUT_ON'):
+            return 0.0
+        return float(self._vars.get(smu + '.source.levelv', 0.0))
+
+    def _tsp_waitcomplete(self):
+        """Busy until the background sweeps finish."""
+        now = time.monotonic()
+        for smu, (t0, point_sec) in self._running.items():
+            end = t0 + point_sec * len(self._vars[smu + '.nvbuffer1.readings'])
+            self._busy_until = max(self._busy_until, end, now)
+        self._running = {}
+
+    def _tsp_smu_abort(self, smu):
+        n = self._n_done(smu)
+        for attr in ('readings', 'sourcevalues', 'timestamps'):
+            key = '{}.nvbuffer1.{}'.format(smu, attr)
+            self._vars[key] = self._vars[key][:n]
+        self._running.pop(smu, None)
+
+    def _n_done(self, smu):
+        """Number of points in nvbuffer1 measured by now."""
+        n = len(self._vars[smu + '.nvbuffer1.readings'])
+        if smu not in self._running:
+            return n
+        t0, point_sec = self._running[smu]
+        if point_sec <= 0:
+            return n
+        return min(n, int((time.monotonic() - t0) / point_sec))
+
+    def _tsp_SweepVLinMeasureI(self, smu, start, stop, stime, points):
+        points = int(float(points))
+        self._sweep(smu, np.linspace(float(start), float(stop), points),
+                    stime)
+
+    def _tsp_SweepVListMeasureI(self, smu, vlist, stime, points):
+        points = int(float(points))
+        vs = self._eval(vlist)
+        if not isinstance(vs, np.ndarray) or len(vs) < points:
+            self._error(-286, 'TSP Runtime error: bad argument #2')
+            return
+        self._sweep(smu, vs[:points], stime)
+
+    def _tsp_instr_SweepVListAbort(self, smu, vlist, stime, points, istop,
+                                   distop):
+        """Keithley2636A._sweep_script_tsp"""
+        points = int(float(points))
+        vs = self._eval(vlist)
+        if not isinstance(vs, np.ndarray) or len(vs) < points:
+            self._error(-286, 'TSP Runtime error: bad argument #2')
+            return
+        Is = self._measure_smu(smu, vs[:points])
+        i, _ = abort_index(Is, float(istop), float(distop))
+        stop = points if i is None else i + 1
+        self._sweep(smu, vs[:stop], stime, Is=Is[:stop])
+
+    def _tsp_instr_PrintVI(self, smu, binary):
+        """Keithley2636A._sweep_script_tsp"""
+        if binary == 'true':
+            self._vars['format.data'] = 'format.REAL64'
+            self._vars['format.byteorder'] = 'format.LITTLEENDIAN'
+        buf = smu + '.nvbuffer1'
+        resp = self._tsp_printbuffer('1', buf + '.n', buf + '.sourcevalues',
+                                     buf + '.readings')
+        self._vars['format.data'] = 'format.ASCII'
+        return resp
+
+    def _tsp_instr_SweepLin(self, smu, vstart, vend, stime, points, binary):
+        self._tsp_SweepVLinMeasureI(smu, vstart, vend, stime, points)
+        return self._tsp_instr_PrintVI(smu, binary)
+
+    def _instr_error(self, message):
+        """instr_Try of Keithley2636A._sweep_script_tsp on an error."""
+        for smu in ('smua', 'smub'):
+            self._vars[smu + '.source.output'] = smu + '.OUTPUT_OFF'
+        self._vars['format.data'] = 'format.ASCII'
+        return 'instr_error: ' + message
+
+    def _tsp_instr_SweepList(self, smu, vlist, stime, points, istop, distop,
+                             binary):
+        vs = self._eval(vlist)
+        if not isinstance(vs, np.ndarray) or len(vs) < int(float(points)):
+            return self._instr_error(
+                "bad argument #2 to 'SweepVListMeasureI'")
+        if float(istop) > 0 or float(distop) > 0:
+            self._tsp_instr_SweepVListAbort(smu, vlist, stime, points, istop,
+                                            distop)
+        else:
+            self._tsp_SweepVListMeasureI(smu, vlist, stime, points)
+        return self._tsp_instr_PrintVI(smu, binary)
+
+    def _tsp_instr_SweepDouble(self, smu, vmax, stime, points, istop, distop,
+                               binary):
+        vs = np.linspace(0, float(vmax), int(float(points)))
+        vs = np.concatenate((vs, vs[::-1]))
+        Is = self._measure_smu(smu, vs)
+        i, _ = abort_index(Is, float(istop), float(distop))
+        stop = len(vs) if i is None else i + 1
+        self._sweep(smu, vs[:stop], stime, Is=Is[:stop])
+        return self._tsp_instr_PrintVI(smu, binary)
+
+    def _sweep(self, smu, vs, stime, background=False, interval=0.0,
+               Is=None):
+        """
+        Source vs and measure into nvbuffer1 (as KISweep functions).
+        :param background: Do not keep the instrument busy (trigger model).
+        :param interval: minimum seconds between the points (timer)
+        :param Is: already measured currents
+        """
+        points = len(vs)
+        try:
+            stime = float(stime)
+        except (TypeError, ValueError):  # e.g. smua.DELAY_AUTO
+            stime = 0.0
+        if Is is None:
+            Is = self._measure_smu(smu, vs)
+        point_sec = max(stime + self._vars[smu + '.measure.nplc'] / 60,
+                        interval)
+        self._vars[smu + '.nvbuffer1.readings'] = Is
+        if self._vars[smu + '.nvbuffer1.collectsourcevalues']:
+            self._vars[smu + '.nvbuffer1.sourcevalues'] = vs
+        self._vars[smu + '.nvbuffer1.timestamps'] = \
+            np.arange(points) * point_sec
+        if background:
+            self._running[smu] = (time.monotonic(),
+                                  point_sec * self.time_scale)
+        else:
+            self._running.pop(smu, None)
+            self._occupy(points * point_sec)
+
+    def _tsp_printbuffer(self, start, end, *buffers):
+        start, end = int(self._eval(start)), int(self._eval(end))
+        columns = [self._vars.get(b.strip(), np.array([]))[start - 1:end]
+                   for b in buffers]
+        if any(len(col) < end - start + 1 for col in columns) or \
+                end > self._n_done(buffers[0].strip().split('.')[0]):
+            self._error(-286, 'TSP Runtime error: index out of range')
+            return ''
+        values = np.column_stack(columns).ravel()
+        if self._vars['format.data'] == 'format.REAL64':
+            order = '<' if self._vars['format.byteorder'] == \
+                'format.LITTLEENDIAN' else '>'
+            return b'#0' + values.astype(order + 'f8').tobytes()
+        return ', '.join('{:.5e}'.format(x) for x in values)
+
+
+class Keithley2400Emulator(_SourceMeterEmulator):
+    """
+    SCPI subset used by Keithley2400: sweeps (linear staircase and source
+    list) measured into the trace buffer on :INIT, with the sweep abort on
+    compliance, and :TRAC:DATA? in ASCII or REAL,32.
+
+    Settings are stored by the header as written (e.g. ':SOUR:VOLT:STAR').
+    """
+    idn = 'KEITHLEY INSTRUMENTS INC.,MODEL 2400,1234567,C30   Mar 17 2006'
+    response_separator = ';'
+    _buffer_points = 2500
+    _list_points = 100
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._rst()
+
+    def _rst(self):
+        self._settings = {':SOUR:VOLT:MODE': 'FIX', ':SOUR:DEL': '0',
+                          ':SENS:CURR:PROT': '105e-6', ':SENS:CURR:NPLC': '1',
+                          ':SOUR:SWE:CAB': 'NEV', ':TRIG:COUN': '1',
+                          ':TRAC:POIN': '100', ':TRAC:FEED': 'SENS',
+                          ':TRAC:FEED:CONT': 'NEV', ':FORM:DATA': 'ASC',
+                          ':FORM:BORD': 'NORM'}
+        self._list = np.array([])
+        self._trace = np.array([])
+
+    def _execute(self, message):
+        return [self._handle(header, arg)
+                for header, arg in _scpi_units(message)]
+
+    def _handle(self, header, arg):
+        if header == '*IDN?':
+            return self.idn
+        elif header == '*RST':
+            self._rst()
+        elif header == '*CLS':
+            self._errors = []
+            self._esr = 0
+        elif header == '*OPC?':
+            return '1'
+        elif header == '*ESR?':
+            esr, self._esr = self._esr, 0
+            return str(esr)
+        elif header == ':SYST:ERR?':
+            if not self._errors:
+                return '0,"No error"'
+            return '{},"{}"'.format(*self._errors.pop(0))
+        elif header in (':SOUR:LIST:VOLT', ':SOUR:LIST:VOLT:APP'):
+            values = np.array([float(x) for x in arg.split(',')])
+            if header.endswith(':APP'):
+                values = np.append(self._list, values)
+            if len(values) - len(self._list) * header.endswith(':APP') > \
+                    self._list_points or len(values) > self._buffer_points:
+                self._error(-223, 'Too much data')
+            else:
+                self._list = values
+        elif header == ':TRAC:CLE':
+            self._trace = np.array([])
+        elif header == ':TRAC:DATA?':
+            return self._format_data(self._trace)
+        elif header == ':INIT':
+            self._init()
+        elif header.endswith('?'):
+            value = self._settings.get(header[:-1])
+            if value is None:
+                self._error(-113, 'Undefined header')
+            return value
+        else:
+            self._settings[header] = arg
+        return None
+
+    def _format_data(self, values):
+        if self._settings[':FORM:DATA'].replace(' ', '') == 'REAL,32':
+            order = '<' if self._settings[':FORM:BORD'] == 'SWAP' else '>'
+            return b'#0' + np.asarray(values, order + 'f4').tobytes()
+        return ','.join('{:+.6E}'.format(x) for x in values)
+
+    def _init(self):
+        """Run the sweep; the readings go to the trace buffer."""
+        points = int(float(self._settings[':TRIG:COUN']))
+        mode = self._settings[':SOUR:VOLT:MODE']
+        if mode == 'SWE':
+            vs = np.linspace(float(self._settings[':SOUR:VOLT:STAR']),
+                             float(self._settings[':SOUR:VOLT:STOP']),
+                             int(float(self._settings[':SOUR:SWE:POIN'])))
+        elif mode == 'LIST':
+            vs = self._list
+        else:
+            vs = np.full(points, float(self._settings.get(':SOUR:VOLT',
+                                                          '0')))
+        if points > len(vs):
+            self._error(-221, 'Settings conflict')
+            return
+        vs = vs[:points]
+        comp = float(self._settings[':SENS:CURR:PROT'])
+        nplc = float(self._settings[':SENS:CURR:NPLC'])
+        Is = self._measure(vs, comp, nplc=nplc)
+        if self._settings[':SOUR:SWE:CAB'] == 'EARL':
+            at_comp = np.flatnonzero(np.abs(Is) >= comp)
+            if len(at_comp):
+                vs, Is = vs[:at_comp[0] + 1], Is[:at_comp[0] + 1]
+        if self._settings[':TRAC:FEED:CONT'] == 'NEXT':
+            n = int(float(self._settings[':TRAC:POIN']))
+            self._trace = np.column_stack((vs, Is)).ravel()[:2 * n]
+            if len(vs) >= n:
+                self._settings[':TRAC:FEED:CONT'] = 'NEV'
+        self._occupy(len(vs) * (float(self._settings[':SOUR:DEL']) +
+                                nplc / 60))
+
+
+class SussPA300Emulator(EmulatedResource):
+    """
+    ProberBench commands used by SussPA300.
+
+    The chuck position is kept in center ('C') coordinates.  Home ('H') and
+    zero ('Z') coordinates are fixed offsets from it.
+    """
+    idn = 'Suss MicroTec Test Systems GmbH,ProberBench PC,0,0'
+    _offsets = {'H': (-9669.5, -2349.5), 'C': (0.0, 0.0),
+                'Z': (157600.0, 155000.0)}
+
+    def __init__(self, xyz=(0.0, 0.0, 11000.0), speed_per_velocity=25.0,
+                 **kwargs):
+        """
+        :param xyz: Initial chuck position (center coordinate, um).
+        :param speed_per_velocity: um/s at velocity 1.
+                                   (velocity 1 -> about 4s/100um)
+        """
+        super().__init__(**kwargs)
+        self.xyz = tuple(map(float, xyz))
+        self.speed_per_velocity = speed_per_velocity
+
+    def _execute(self, message):
+        cmd, *args = message.split()
+        if cmd == '*IDN?':
+            return [self.idn]
+        elif cmd == 'ReadSystemStatus':
+            return ['0: PA300PS_ 5 1 1 1 0 0 0 0 0']
+        elif cmd == 'ReadChuckPosition' and len(args) == 3 and \
+                args[1] in self._offsets:
+            return ['0: {:.1f} {:.1f} {:.1f}'.format(*self._xyz_in(args[1]))]
+        elif cmd == 'MoveChuck' and len(args) == 5 and \
+                args[2] in self._offsets:
+            dx, dy = self._offsets[args[2]]
+            x, y = float(args[0]) - dx, float(args[1]) - dy
+            self._move((x, y, self.xyz[2]), float(args[4]))
+            return ['0: {:.1f} {:.1f}'.format(*self._xyz_in(args[2])[:2])]
+        elif cmd == 'MoveChuckZ' and len(args) == 4:
+            self._move(self.xyz[:2] + (float(args[0]),), float(args[3]))
+            return ['0: {:.1f}'.format(self.xyz[2])]
+        return ['701: Invalid command']
+
+    def _xyz_in(self, coord):
+        dx, dy = self._offsets[coord]
+        return self.xyz[0] + dx, self.xyz[1] + dy, self.xyz[2]
+
+    def _move(self, xyz, velocity):
+        distance = math.sqrt(sum((a - b) ** 2 for a, b in zip(self.xyz, xyz)))
+        self._occupy(distance / (velocity * self.speed_per_velocity))
+        self.xyz = xyz
+
+
+class AP1628T2Emulator(EmulatedResource):
+    """
+    Takasago AP-1628T commands 'A1D' (set analog value) and 'T1' (read).
+    Reproduces the bug: -1 is read as 65535.
+    """
+    idn = 'TAKASAGO,AP-1628T,00000,Ver2.30Rev1.06'
+    termination = '\r\n'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.analog_value = 0
+
+    def _execute(self, message):
+        if message == '*IDN?':
+            return [self.idn]
+        elif message == '*RST':
+            self.analog_value = 0
+            return ['']
+        elif message == 'T1':
+            value = 65535 if self.analog_value == -1 else self.analog_value
+            return ['A1D{:+06d},A2D+00000,A3D000,A4D000,A5D000,H0'.
+                    format(value)]
+        elif message.startswith('A1D'):
+            self.analog_value = int(message[3:])
+            return []
+        return ['E1']
+
+
+class Sci9700Emulator(EmulatedResource):
+    """Scientific Instruments Model 9700.  Reaches the set point at once."""
+    idn = 'Scientific Instruments,9700,0,1.00'
+
+    def __init__(self, temp=20.0, **kwargs):
+        super().__init__(**kwargs)
+        self.temps = {'A': temp, 'B': temp}
+        self.set_point = temp
+
+    def _execute(self, message):
+        cmd, _, arg = message.partition(' ')
+        if cmd == '*IDN?':
+            return [self.idn]
+        elif cmd in ('TA?', 'TB?'):
+            return ['T{} {:07.3f}'.format(cmd[1], self.temps[cmd[1]])]
+        elif cmd == 'HTR?':
+            return ['HTR 00.00']
+        elif cmd == 'STA?':
+            return ['STA {:07.3f},00.00,1,0,1,1,2'.format(self.set_point)]
+        elif cmd == 'SET':
+            self.set_point = float(arg)
+            self.temps['A'] = self.temps['B'] = self.set_point
+            return []
+        return ['ERR']
+
+
+class LSCI331Emulator(EmulatedResource):
+    """Lake Shore 331 temperature controller."""
+    idn = 'LSCI,MODEL331S,333342,061404'
+    termination = '\r\n'
+
+    def __init__(self, temp_kelvin=293.15, **kwargs):
+        super().__init__(**kwargs)
+        self.temps = {'A': temp_kelvin, 'B': temp_kelvin}
+
+    def _execute(self, message):
+        cmd, _, arg = message.partition(' ')
+        if cmd == '*IDN?':
+            return [self.idn]
+        elif cmd in ('*RST', '*CLS'):
+            return ['']
+        elif cmd == 'KRDG?':
+            return ['{:+08.3f}'.format(self.temps[arg])]
+        elif cmd == 'CRDG?':
+            return ['{:+08.3f}'.format(self.temps[arg] - 273.15)]
+        elif cmd == 'SRDG?':
+            return ['{:+08.3f}'.format(1000 - self.temps[arg])]
+        return []
+
+
+class EmulatorResourceManager:
+    """
+    Stand-in for visa.ResourceManager.
+
+    >>> rm = EmulatorResourceManager({'GPIB0::12::INSTR': LSCI331Emulator()})
+    >>> rm.list_resources()
+    ('GPIB0::12::INSTR',)
+    >>> rm.open_resource('GPIB0::12::INSTR').query('KRDG? A')
+    '+293.150\\r\\n'
+    """
+    def __init__(self, resources):
+        """:param resources: {resource name: emulator}"""
+        self._resources = dict(resources)
+
+    def list_resources(self):
+        return tuple(self._resources)
+
+    def open_resource(self, name):
+        return self._resources[name]
@@ -1,53 +1,278 @@
-from instr.base import SourceMeter
-
-
 """
 Keithley 2400
 
-Issue: Output remains 'ON' if self._switch_output('OFF') is not called
-explicitly.
-def __del__(self): self._switch_output('OFF')
-doesn't work.
+Sweeps run in the source memory of the instrument: a linear staircase
+(:SOUR:VOLT:MODE SWE) or a source list (:SOUR:VOLT:MODE LIST) measured into
+the trace buffer by one :INIT, then read in one :TRAC:DATA? transfer.
+The output is turned off after each sweep (auto output-off,
+:SOUR:CLE:AUTO ON).  User's manual: section 9 (data store), 10 (sweep
+operation).
 """
+import unittest
+
+import numpy as np
+
+from instr.base import SourceMeter, operation_method, parse_binary_blocks
+from instr.sweep_plan import SweepPlan, SweepResult
 
 
 class Keithley2400(SourceMeter):
-    def __init__(self, **kwargs):
-        super().__init__(idn='KEITHLEY INSTRUMENTS.*24', **kwargs)
-        self.reset()
+    _input_buffer_size = 1024
+    # For the expected duration of a sweep (see deadline): seconds of 1 PLC
+    # at 50Hz; :SENS:CURR:NPLC 1 (reset default) unless profile is set
+    _nplc_sec = 1 / 50
+    _point_overhead_sec = 2e-3
+    # Readings of the trace buffer; values of a source list message
+    _buffer_points = 2500
+    _list_points = 100
+    # See SourceMeter.profile
+    _profiles = {
+        'fast': {'nplc': 0.01, 'autozero': 'ONCE', 'autorange': False,
+                 'display': False},
+        'balanced': {'nplc': 1, 'autozero': 'ON', 'autorange': True,
+                     'display': True},
+        'precise': {'nplc': 10, 'autozero': 'ON', 'autorange': True,
+                    'display': True},
+    }
+
+    def __init__(self, rsrc=None, timeout_sec=600, reset=True,
+                 binary_transfer=False):
+        """
+        :param binary_transfer: Read the trace buffer in REAL,32 (7
+                                significant digits) instead of ASCII.
+        """
+        idn = 'KEITHLEY INSTRUMENTS INC.,MODEL 24'
+        super().__init__(rsrc, idn, timeout_sec, reset)
+        self.binary_transfer = binary_transfer
+
+    def _check_error(self):
+        tmp = self.q(':SYST:ERR?')
+        if int(tmp.split(',')[0]) != 0:
+            raise RuntimeError('Error on Keithley 2400.')
+
+    def _error_pending(self):
+        # QYE, DDE, EXE and CME bits of the standard event status register
+        return bool(int(self.q('*ESR?')) & 0b111100)
 
-    def check_error(self):
+    def _clear_errors(self):
+        self._write('*CLS')
+
+    @operation_method
+    def reset(self):
+        """
+        >>> k = Keithley2400()
+        debug mode (Keithley2400): skip BaseInstr.__init__.
+        >>> k.reset()
+        debug mode (Keithley2400): skip reset.
+        debug mode (Keithley2400): skip check_error.
+        """
         if self._debug_mode:
-            self._dbg_print_skip_method()
+            super().reset()
             return
+        with self.batch():
+            self.w('*RST')
+            self.w('*CLS')
+            self.check_error()
+        self._reset_shadow()
+
+    def _read_trace(self):
+        """
+        Read the trace buffer in one transfer.
+
+        >>> from instr.emulator import Keithley2400Emulator
+        >>> k = Keithley2400(Keithley2400Emulator(), binary_transfer=True)
+        >>> vis, aborted = k.iv_sweep(0, 0.1, v_points=3, i_limit=1e-3)
+        >>> k._read_trace()[:, 0]
+        array([0.  , 0.05, 0.1 ])
+
+        :return: [(v0, i0), (v1, i1), ...]
+        :rtype: np.ndarray
+        """
+        if self.binary_transfer:
+            raw = self.q_raw(':FORM:DATA REAL,32;:FORM:BORD SWAP;'
+                             ':TRAC:DATA?')
+            values, = parse_binary_blocks(raw, '<f4')
+            values = values.astype(np.float64)
         else:
-            resp = self.q(':SYST:ERR?')
-            if resp != '0,"No error"\n':
-                raise RuntimeError('Error on Keithley 2400.')
+            resp = self.q(':FORM:DATA ASC;:TRAC:DATA?')
+            values = np.asarray(resp.split(','), np.float64)
+        return values.reshape(-1, 2)
 
-    def reset(self):
-        if self._debug_mode:
-            self._dbg_print_skip_method()
+    def _load_list(self, vs):
+        """
+        :SOUR:LIST:VOLT, then :SOUR:LIST:VOLT:APP, of up to _list_points
+        values each, in messages no longer than _input_buffer_size.
+        """
+        items = ['{:.7g}'.format(v) for v in vs]
+        head = ':SOUR:LIST:VOLT '
+        while items:
+            room = self._input_buffer_size - len(head)
+            n = 0
+            length = 0
+            while n < min(len(items), self._list_points) and \
+                    length + len(items[n]) + 1 <= room:
+                length += len(items[n]) + 1
+                n += 1
+            self.w(head + ','.join(items[:n]))
+            del items[:n]
+            head = ':SOUR:LIST:VOLT:APP '
+
+    def _configure_profile(self, i_limit):
+        """Integration time, autozero, current range and display of profile."""
+        settings = self._profile_settings(i_limit)
+        if settings is None:
             return
-        self.w('reset()')
-        self.check_error()
+        self.w_shadow(':SENS:CURR:NPLC',
+                      ':SENS:CURR:NPLC {}'.format(settings['nplc']))
+        self.w_shadow(':SYST:AZER:STAT',
+                      ':SYST:AZER:STAT {}'.format(settings['autozero']))
+        self.w_shadow(':SENS:CURR:RANG:AUTO', ':SENS:CURR:RANG:AUTO {}'.format(
+            'ON' if settings['autorange'] else 'OFF'))
+        if not settings['autorange']:
+            self.w_shadow(':SENS:CURR:RANG',
+                          ':SENS:CURR:RANG {}'.format(abs(i_limit)))
+        self.w_shadow(':DISP:ENAB', ':DISP:ENAB {}'.format(
+            'ON' if settings['display'] else 'OFF'))
+
+    def _sweep(self, vs, i_limit, settle_time, reset, abort_at_compliance):
+        """
+        Source vs (a linear staircase if possible, else a source list),
+        measure into the trace buffer and read it.
+
+        :return: vis, is_aborted
+        """
+        points = len(vs)
+        if points > self._buffer_points:
+            raise RuntimeError('Number of points exceeds {}. '
+                               '(trace buffer of 2400)'.
+                               format(self._buffer_points))
+        runs = SweepPlan([vs]).linear_runs()
+        settings = self._profile_settings(i_limit)
+        nplc = 1 if settings is None else settings['nplc']
+        expected = points * (settle_time + nplc * self._nplc_sec +
+                             self._point_overhead_sec)
+        with self.deadline(expected):
+            if reset and not (self.use_shadow and self._shadow_since_reset):
+                self.reset()
+            with self.batch():
+                self.w_shadow(':SOUR:FUNC', ':SOUR:FUNC VOLT')
+                self.w_shadow(':SENS:FUNC:CONC', ':SENS:FUNC:CONC OFF')
+                self.w_shadow(':SENS:FUNC', ":SENS:FUNC 'CURR'")
+                self.w_shadow(':SENS:CURR:PROT',
+                              ':SENS:CURR:PROT {}'.format(abs(i_limit)))
+                self.w_shadow(':SOUR:DEL', ':SOUR:DEL {}'.format(settle_time))
+                self.w_shadow(':SOUR:CLE:AUTO', ':SOUR:CLE:AUTO ON')
+                self.w_shadow(':SOUR:SWE:CAB', ':SOUR:SWE:CAB {}'.format(
+                    'EARL' if abort_at_compliance else 'NEV'))
+                self.w_shadow(':FORM:ELEM', ':FORM:ELEM VOLT,CURR')
+                self._configure_profile(i_limit)
+                if len(runs) == 1 and points > 1:
+                    v_start, v_end, _ = runs[0]
+                    self.w_shadow(':SOUR:VOLT:MODE', ':SOUR:VOLT:MODE SWE')
+                    self.w_shadow(':SOUR:SWE:SPAC', ':SOUR:SWE:SPAC LIN')
+                    self.w_shadow(':SOUR:VOLT:STAR',
+                                  ':SOUR:VOLT:STAR {}'.format(v_start))
+                    self.w_shadow(':SOUR:VOLT:STOP',
+                                  ':SOUR:VOLT:STOP {}'.format(v_end))
+                    self.w_shadow(':SOUR:SWE:POIN',
+                                  ':SOUR:SWE:POIN {}'.format(points))
+                else:
+                    self.w_shadow(':SOUR:VOLT:MODE', ':SOUR:VOLT:MODE LIST')
+                    self._load_list(vs)
+                self.w_shadow(':TRIG:COUN', ':TRIG:COUN {}'.format(points))
+                self.w(':TRAC:CLE')
+                self.w_shadow(':TRAC:POIN', ':TRAC:POIN {}'.format(points))
+                self.w_shadow(':TRAC:FEED', ':TRAC:FEED SENS')
+                # Back to NEV when the buffer is full
+                self.w(':TRAC:FEED:CONT NEXT')
+                self.w(':INIT', True)
+            self.q('*OPC?')
+            vis = self._read_trace()
+        return vis, len(vis) != points
+
+    @operation_method
+    def iv_sweep(self, v_start=0.0, v_end=10e-3, v_step=1e-3,
+                 v_points=None, i_limit=1e-3, settle_time=0.0, reset=True):
+        """
+        >>> from instr.emulator import Keithley2400Emulator
+        >>> k = Keithley2400(Keithley2400Emulator())
+        >>> vis, aborted = k.iv_sweep(0, 0.1, v_points=3)
+        >>> vis[:, 1] * 1e3, aborted
+        (array([0.  , 0.05, 0.1 ]), False)
+
+        :param settle_time: source delay (s)
+        :param reset: reset() unless all settings since the last reset are
+                      known (see w_shadow)
+        :return: vis, is_aborted
+        """
+        if v_points is None:
+            v_points = self._v_step_to_points(v_start, v_end, v_step)
+        if self._debug_mode:
+            return super().iv_sweep(v_start, v_end, v_step, v_points, i_limit)
+        return self._sweep(np.linspace(v_start, v_end, v_points), i_limit,
+                           settle_time, reset, False)
+
+    @operation_method
+    def iv_sweep_double(self, v_max, v_step=1e-3, v_points=None,
+                        i_limit=1e-3, settle_time=0.0, reset=True,
+                        abort_at_compliance=False):
+        plan = SweepPlan.doubles([v_max], v_step, v_points)
+        return self.iv_sweep_plan(plan, i_limit, settle_time, reset,
+                                  abort_at_compliance)
 
-    def iv_sweep(self, v_start, v_end, v_step=1e-3, v_points=None,
-                 i_limit=1e-3):
-        self.reset()
-        self.w(':SENS:FUNC:CONC OFF')
-        self.w(':SENS:CURR:PROT {}'.format(i_limit))  # TODO: format
-        self.w(':SOUR:VOLT:START {}'.format(v_start))
-        self.w(':SOUR:VOLT:STOP {}'.format(v_end))
+    @operation_method
+    def iv_sweep_plan(self, plan, i_limit=1e-3, settle_time=0.0, reset=True,
+                      abort_at_compliance=False, abort_di=None):
+        """
+        Sweep the whole plan as one source list (up to 2500 points) and
+        read it in one transfer.
+
+        >>> from instr.emulator import Keithley2400Emulator
+        >>> from instr.dut import Short
+        >>> k = Keithley2400(Keithley2400Emulator())
+        >>> vis, aborted = k.iv_sweep_plan(SweepPlan.linear([0, 0.1, -0.1],
+        ...                                                 v_points=3))
+        >>> vis[:, 0]
+        array([ 0.  ,  0.05,  0.1 ,  0.  , -0.1 ])
+        >>> k._rsrc.dut = Short()
+        >>> result = k.iv_sweep_plan([0, 0.1, 0.2], 1e-3,
+        ...                          abort_at_compliance=True)
+        >>> len(result.vis), result.aborted, result.reason
+        (2, True, 'compliance')
+
+        :param plan: SweepPlan, or array-like voltages
+        :param abort_at_compliance: stop at the first point at compliance
+                                    (:SOUR:SWE:CAB EARL)
+        :param abort_di: not supported by the 2400 (ValueError)
+        :return: vis, is_aborted, with .reason
+        :rtype: SweepResult
+        """
+        if abort_di is not None:
+            raise ValueError('2400 stops sweeps only at compliance')
+        plan = SweepPlan.of(plan)
+        if self._debug_mode:
+            return super().iv_sweep_plan(plan, i_limit, abort_at_compliance)
+        vis, aborted = self._sweep(plan.voltages(), i_limit, settle_time,
+                                   reset, abort_at_compliance)
+        return SweepResult.compliance_stop(vis, aborted, abort_at_compliance)
+
+
+class TestKeithley2400(unittest.TestCase):
+    def test_iv_sweep(self):
+        ke24.reset()
+        vis, aborted = ke24.iv_sweep(0, 0.1)
+        self.assertEqual(vis.shape, (101, 2))
+        self.assertFalse(aborted)
+
+        vis, aborted = ke24.iv_sweep_double(0.1, v_points=11)
+        self.assertEqual(vis.shape, (22, 2))
 
-        self.w('')
-        self.w('OUTPUT ON')
-        resp = self.q(':READ?')
 
 if __name__ == '__main__':
     import visa
 
     rm = visa.ResourceManager()
     ke24_rsrc = rm.open_resource('GPIB0::27::INSTR')
-    ke24 = Keithley2400(debug_mode=False, instr_rsrc=ke24_rsrc)
-    ke24.iv_sweep(0, 0.1)
+    ke24 = Keithley2400(ke24_rsrc)
+
+    unittest.main()
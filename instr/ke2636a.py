@@ -1,14 +1,121 @@
-﻿import numpy as np
-import unittest2
+﻿from time import perf_counter, sleep
+import unittest
 
-from instr.base import SourceMeter
+import numpy as np
+
+from instr.base import SourceMeter, operation_method, parse_binary_blocks
+from instr.sweep_plan import SweepPlan, SweepResult, abort_index
+
+# Sweep functions uploaded once per session as the named script
+# instr_sweeps (see Keithley2636A._load_script).  instr_Sweep* run a sweep
+# and print nvbuffer1 (sourcevalues, readings), in REAL64 if binary, so a
+# sweep is one message and one read.
+# instr_SweepVListAbort: list sweep like SweepVListMeasureI, stopping after
+# the first point with |I| >= istop or |dI| >= distop (0: disabled).
+# instr_Try: an error in a sweep turns both outputs off and prints
+# "instr_error: <message>" instead of the data (see _script_sweep).
+# instr_sweeps_loaded is set last (see _load_script).
+_sweep_script_tsp = """
+function instr_SweepVListAbort(smu, vlist, stime, points, istop, distop)
+  smu.nvbuffer1.clear()
+  smu.source.func = smu.OUTPUT_DCVOLTS
+  smu.source.levelv = vlist[1]
+  smu.source.output = smu.OUTPUT_ON
+  local prev = nil
+  for i = 1, points do
+    smu.source.levelv = vlist[i]
+    delay(stime)
+    local I = smu.measure.i(smu.nvbuffer1)
+    if istop > 0 and math.abs(I) >= istop then break end
+    if distop > 0 and prev ~= nil and math.abs(I - prev) >= distop then
+      break
+    end
+    prev = I
+  end
+  smu.source.output = smu.OUTPUT_OFF
+end
+function instr_PrintVI(smu, binary)
+  if binary then
+    format.data = format.REAL64
+    format.byteorder = format.LITTLEENDIAN
+  end
+  printbuffer(1, smu.nvbuffer1.n, smu.nvbuffer1.sourcevalues,
+              smu.nvbuffer1.readings)
+  format.data = format.ASCII
+end
+function instr_Try(f)
+  local ok, err = pcall(f)
+  if not ok then
+    smua.source.output = smua.OUTPUT_OFF
+    smub.source.output = smub.OUTPUT_OFF
+    format.data = format.ASCII
+    print("instr_error: " .. tostring(err))
+  end
+end
+function instr_RunList(smu, vlist, stime, points, istop, distop)
+  if istop > 0 or distop > 0 then
+    instr_SweepVListAbort(smu, vlist, stime, points, istop, distop)
+  else
+    SweepVListMeasureI(smu, vlist, stime, points)
+  end
+end
+function instr_SweepLin(smu, vstart, vend, stime, points, binary)
+  instr_Try(function()
+    SweepVLinMeasureI(smu, vstart, vend, stime, points)
+    instr_PrintVI(smu, binary)
+  end)
+end
+function instr_SweepList(smu, vlist, stime, points, istop, distop, binary)
+  instr_Try(function()
+    instr_RunList(smu, vlist, stime, points, istop, distop)
+    instr_PrintVI(smu, binary)
+  end)
+end
+function instr_SweepDouble(smu, vmax, stime, points, istop, distop, binary)
+  instr_Try(function()
+    local vlist = {}
+    for i = 1, points do
+      vlist[i] = vmax * (i - 1) / (points - 1)
+      vlist[2 * points + 1 - i] = vlist[i]
+    end
+    instr_RunList(smu, vlist, stime, 2 * points, istop, distop)
+    instr_PrintVI(smu, binary)
+  end)
+end
+instr_sweeps_loaded = true
+"""
 
 
 class Keithley2636A(SourceMeter):
-    def __init__(self, rsrc=None, timeout_sec=600, reset=True):
+    _input_buffer_size = 1024
+    # For the expected duration of a sweep (see deadline): seconds of 1 PLC
+    # at 50Hz; measure.nplc = 1 (reset default) unless profile is set
+    _nplc_sec = 1 / 50
+    _point_overhead_sec = 1e-3
+    # Readings of nvbuffer1 with timestamps
+    _buffer_points = 60000
+    # instr_sweeps is known to be in the instrument (see _load_script)
+    _script_loaded = False
+    _sweep_script = _sweep_script_tsp
+    # See SourceMeter.profile.  The front panel is left as it is.
+    _profiles = {
+        'fast': {'nplc': 0.01, 'autozero': 'AUTOZERO_ONCE',
+                 'autorange': False},
+        'balanced': {'nplc': 1, 'autozero': 'AUTOZERO_AUTO',
+                     'autorange': True},
+        'precise': {'nplc': 10, 'autozero': 'AUTOZERO_AUTO',
+                    'autorange': True},
+    }
+
+    def __init__(self, rsrc=None, timeout_sec=600, reset=True,
+                 binary_transfer=False):
+        """
+        :param binary_transfer: Read buffers in REAL64 instead of ASCII.
+        """
         self._smu = 'a'
         idn = 'Keithley Instruments Inc., Model 2636A'
         super().__init__(rsrc, idn, timeout_sec, reset)
+        self.binary_transfer = binary_transfer
 
     @property
     def smu(self):
@@ -20,67 +127,595 @@ class Keithley2636A(SourceMeter):
             raise ValueError
         self._smu = value
 
-    def check_error(self):
-        if self._debug_mode:
-            super().check_error()
+    def _check_error(self):
         tmp = self.q('print(errorqueue.next())')
         if tmp != '0.00000e+00\tQueue Is Empty\t0.00000e+00\n':
             raise RuntimeError('Error on Keithley 2636A.')
 
+    def _error_pending(self):
+        return float(self.q('print(errorqueue.count)')) > 0
+
+    def _clear_errors(self):
+        self._write('errorqueue.clear()')
+
+    @operation_method
     def reset(self):
         self.w('reset()', True)
+        self._reset_shadow()
         # self.w('smua.reset(); smub.reset()', True)
 
+    def _point_sec(self, settle_time, i_limit):
+        """Expected seconds per point of a sweep (see deadline)."""
+        settings = self._profile_settings(i_limit)
+        nplc = 1 if settings is None else settings['nplc']
+        return settle_time + nplc * self._nplc_sec + self._point_overhead_sec
+
+    def _configure_profile(self, smu, i_limit):
+        """
+        Integration time, autozero and current range of profile.
+        :param smu: 'smua' or 'smub'
+        """
+        settings = self._profile_settings(i_limit)
+        if settings is None:
+            return
+        autorange = 'AUTORANGE_ON' if settings['autorange'] else \
+            'AUTORANGE_OFF'
+        for key, value in (('measure.nplc', settings['nplc']),
+                           ('measure.autozero',
+                            '{}.{}'.format(smu, settings['autozero'])),
+                           ('measure.autorangei',
+                            '{}.{}'.format(smu, autorange))):
+            key = '{}.{}'.format(smu, key)
+            self.w_shadow(key, '{} = {}'.format(key, value))
+        if not settings['autorange']:
+            key = smu + '.measure.rangei'
+            self.w_shadow(key, '{} = {}'.format(key, abs(i_limit)))
+
+    def invalidate_shadow(self):
+        super().invalidate_shadow()
+        self._script_loaded = False
+
+    def _trigger_model_changed(self):
+        """
+        Call after configuring the trigger model (timers, stimuli), which is
+        not in the shadow: the next sweep with reset=True resets first.
+        """
+        self._shadow_since_reset = False
+
+    def _source_voltage(self, smu, voltage):
+        """
+        DC voltage source at voltage.  Always written: the sweeps (the
+        instr_sweeps functions, the trigger model) change source.func and
+        source.levelv behind the shadow.
+        """
+        self.w('{0}.source.func = {0}.OUTPUT_DCVOLTS'.format(smu))
+        self.w('{}.source.levelv = {}'.format(smu, voltage))
+
+    def _load_script(self):
+        """
+        Upload _sweep_script_tsp as the named script instr_sweeps and run
+        it to define the functions, once per session.  The functions
+        survive reset(); they are uploaded again after invalidate_shadow()
+        (e.g. after a timeout or another client), when the instrument is
+        not known to have them.  A script which does not load (e.g. a
+        syntax error) raises RuntimeError.
+
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> k = Keithley2636A(Keithley2636AEmulator())
+        >>> k._sweep_script = _sweep_script_tsp.replace('end', '', 1)
+        >>> k._load_script()  # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        RuntimeError: Error on Keithley 2636A...
+        """
+        if self._script_loaded:
+            return
+        self.w('loadscript instr_sweeps')
+        for line in self._sweep_script.strip().splitlines():
+            self.w(line)
+        self.w('endscript')
+        self.w('instr_sweeps.run()', True)
+        if self.q('print(instr_sweeps_loaded)').strip() != 'true':
+            raise RuntimeError('instr_sweeps did not load.')
+        self._script_loaded = True
+
+    def _parse_buffer(self, resp, columns):
+        """printbuffer output (ASCII, or REAL64 if binary_transfer)."""
+        if self.binary_transfer:
+            values, = parse_binary_blocks(resp, '<f8')
+        else:
+            if isinstance(resp, bytes):
+                resp = resp.decode('latin-1')
+            values = np.asarray(resp.split(','), np.float64)
+        return values.reshape(-1, columns)
+
+    def _read_buffer(self, *attrs, start=1, end=None, smu=None):
+        """
+        Read all points of nvbuffer1 attributes in one transfer.
+
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> k = Keithley2636A(Keithley2636AEmulator(), binary_transfer=True)
+        >>> vis, aborted = k.iv_sweep(0, 0.1, v_points=3, i_limit=1e-3)
+        >>> k._read_buffer('sourcevalues', 'readings')
+        array([[0.e+00, 0.e+00],
+               [5.e-02, 5.e-05],
+               [1.e-01, 1.e-04]])
+
+        :param attrs: e.g. 'sourcevalues', 'readings', 'timestamps'
+        :param start: first point, from 1
+        :param end: last point (None: all)
+        :param smu: 'a' or 'b' (None: self.smu)
+        :return: column i: attrs[i]
+        :rtype: np.ndarray
+        """
+        buf = 'smu{}.nvbuffer1'.format(self.smu if smu is None else smu)
+        prnt = 'printbuffer({}, {}, {})'.format(
+            start, buf + '.n' if end is None else end,
+            ', '.join('{}.{}'.format(buf, attr) for attr in attrs))
+        if self.binary_transfer:
+            resp = self.q_raw('format.data = format.REAL64; '
+                              'format.byteorder = format.LITTLEENDIAN; ' +
+                              prnt + '; format.data = format.ASCII', True)
+        else:
+            resp = self.q(prnt, True)
+        return self._parse_buffer(resp, len(attrs))
+
+    def _script_sweep(self, func, args, points, i_limit, settle_time, reset,
+                      vlist=None):
+        """
+        Run an instr_Sweep* function of instr_sweeps in one message with
+        the settings (and the source list) and read nvbuffer1 it prints.
+        An error in the sweep: RuntimeError with the message of the
+        instrument.  An error in the message leaves it unanswered:
+        TimeoutError.
+
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> k = Keithley2636A(Keithley2636AEmulator())
+        >>> k._script_sweep('instr_SweepList', ('nil', 0, 3, 0, 0), 3, 1e-3,
+        ...                 0, True)  # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        RuntimeError: instr_SweepList: instr_error: ...bad argument #2...
+
+        :param args: arguments after smu, except binary
+        :param points: number of points of the sweep
+        :param vlist: voltages for instr_vlist
+        :return: vis
+        """
+        smu = 'smu' + self.smu
+        with self.deadline(points * self._point_sec(settle_time, i_limit)):
+            if reset and not (self.use_shadow and self._shadow_since_reset):
+                self.reset()
+            self._load_script()
+            with self.batch():
+                lim = smu + '.source.limiti'
+                self.w_shadow(lim, '{} = {}'.format(lim, i_limit))
+                col = smu + '.nvbuffer1.collectsourcevalues'
+                self.w_shadow(col, col + ' = 1')
+                self._configure_profile(smu, i_limit)
+                if vlist is not None:
+                    self._load_list('instr_vlist', vlist)
+                self.w('{}({})'.format(func, ', '.join(
+                    [smu] + [str(arg) for arg in args] +
+                    ['true' if self.binary_transfer else 'false'])))
+            resp = self.r_raw()
+            if resp.startswith(b'instr_error'):
+                raise RuntimeError('{}: {}'.format(
+                    func, resp.decode('latin-1').strip()))
+            vis = self._parse_buffer(resp, 2)
+            self.check_error()
+        return vis
+
+    @staticmethod
+    def _sweep_result(vis, points, i_stop, abort_di):
+        """:rtype: SweepResult"""
+        if len(vis) == points:
+            return SweepResult(vis, False)
+        i, reason = abort_index(vis[:, 1], i_stop, abort_di)
+        return SweepResult(vis, True, reason or 'unknown')
+
+    @operation_method
     def iv_sweep(self, v_start=0.0, v_end=10e-3, v_step=1e-3,
                  v_points=None, i_limit=1e-6, settle_time=0.0, reset=True):
         """
+        SweepVLinMeasureI in instr_SweepLin: one message and one read.
         Reference manual 3-31
         TODO: when aborted?
 
+        :param reset: reset() unless all settings since the last reset are
+                      known (see w_shadow)
         :return: vis, is_aborted
         """
-        if reset:
-            self.reset()
-
         if v_points is None:
             v_points = self._v_step_to_points(v_start, v_end, v_step)
+        vis = self._script_sweep('instr_SweepLin',
+                                 (v_start, v_end, settle_time, v_points),
+                                 v_points, i_limit, settle_time, reset)
+        aborted = len(vis) != v_points
+        return vis, aborted
+
+    @operation_method
+    def iv_sweep_double(self, v_max, v_step=1e-3, v_points=None,
+                        i_limit=1e-3, settle_time=0.0, reset=True,
+                        abort_at_compliance=False, abort_di=None):
+        """
+        0V -> v_max -> 0V generated in the instrument (instr_SweepDouble):
+        one message and one read.
+
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> k = Keithley2636A(Keithley2636AEmulator())
+        >>> vis, aborted = k.iv_sweep_double(0.1, v_points=3)
+        >>> vis[:, 0]
+        array([0.  , 0.05, 0.1 , 0.1 , 0.05, 0.  ])
 
-        lim = 'smu{}.source.limiti = {}'.format(self.smu, i_limit)
-        self.w(lim, True)
-
-        meas = 'SweepVLinMeasureI(smu{}, {}, {}, {}, {})'. \
-            format(self.smu, v_start, v_end, settle_time, v_points)
-        self.w(meas, True)
-
-        prnt = 'printbuffer(1, {}, smu{}.nvbuffer1.readings)'. \
-            format(v_points, self.smu)
-        resp = self.q(prnt, True)
-        Is = resp.split(', ')
-        Is = np.asarray(Is, np.float64)
-        if len(Is) != v_points:
-            aborted = True
-            v_points = len(Is)
+        :param v_points: in single direction
+        :param abort_at_compliance: see iv_sweep_plan
+        :param abort_di: see iv_sweep_plan
+        :rtype: SweepResult
+        """
+        if v_points is None:
+            v_points = self._v_step_to_points(0, v_max, v_step)
+        if v_points < 2:
+            plan = SweepPlan.doubles([v_max], v_points=v_points)
+            return self.iv_sweep_plan(plan, i_limit, settle_time, reset,
+                                      abort_at_compliance, abort_di)
+        i_stop = self._compliance_ratio * abs(i_limit) \
+            if abort_at_compliance else None
+        vis = self._script_sweep(
+            'instr_SweepDouble', (v_max, settle_time, v_points, i_stop or 0,
+                                  abort_di or 0),
+            2 * v_points, i_limit, settle_time, reset)
+        return self._sweep_result(vis, 2 * v_points, i_stop, abort_di)
+
+    def _load_list(self, name, values):
+        """
+        Define the Lua table name = {values...} in messages no longer than
+        _input_buffer_size.
+        """
+        items = ['{!r}'.format(float(x)) for x in values]
+        first = True
+        while first or items:
+            if first:
+                head, tail = name + ' = {', '}'
+            else:
+                head = 'for _, v in ipairs({'
+                tail = '}) do table.insert(' + name + ', v) end'
+            room = self._input_buffer_size - len(head) - len(tail)
+            n = 0
+            length = 0
+            while n < len(items) and length + len(items[n]) + 2 <= room:
+                length += len(items[n]) + 2
+                n += 1
+            self.w(head + ', '.join(items[:n]) + tail)
+            del items[:n]
+            first = False
+
+    @operation_method
+    def iv_sweep_plan(self, plan, i_limit=1e-6, settle_time=0.0, reset=True,
+                      abort_at_compliance=False, abort_di=None):
+        """
+        Sweep the whole plan with one SweepVListMeasureI (instr_SweepList)
+        and read it in one transfer.  Reference manual 3-31
+        With an abort condition, the plan runs in instr_SweepVListAbort,
+        which stops in the instrument right after the point.
+
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> k = Keithley2636A(Keithley2636AEmulator())
+        >>> plan = SweepPlan.linear([0, 0.1, 0, -0.1, 0], v_points=3)
+        >>> vis, aborted = k.iv_sweep_plan(plan, i_limit=1e-3)
+        >>> k._rsrc.log.clear()
+        >>> vis, aborted = k.iv_sweep_plan(plan, i_limit=1e-3)
+        >>> aborted, len(k._rsrc.log)  # program and sweep, error check
+        (False, 2)
+        >>> vis[:, 1] * 1e3
+        array([ 0.  ,  0.05,  0.1 ,  0.05,  0.  , -0.05, -0.1 , -0.05,  0.  ])
+
+        >>> from instr.dut import Breakdown, Ohmic
+        >>> k._rsrc.dut = Breakdown(Ohmic(1e3), v_bd=0.5, r_bd=100)
+        >>> result = k.iv_sweep_plan(np.linspace(0, 1, 11), i_limit=1e-2,
+        ...                          abort_di=1e-3)
+        >>> len(result.vis), result.aborted, result.reason
+        (6, True, 'jump')
+
+        :param plan: SweepPlan, or array-like voltages
+        :param reset: see iv_sweep
+        :param abort_at_compliance: stop at the first point at compliance
+        :param abort_di: stop at the first |I - I of the previous point|
+                         >= abort_di (A), e.g. breakdown
+        :return: vis, is_aborted, with .reason
+        :rtype: SweepResult
+        """
+        vs = SweepPlan.of(plan).voltages()
+        i_stop = self._compliance_ratio * abs(i_limit) \
+            if abort_at_compliance else None
+        vis = self._script_sweep(
+            'instr_SweepList', ('instr_vlist', settle_time, len(vs),
+                                i_stop or 0, abort_di or 0),
+            len(vs), i_limit, settle_time, reset, vs)
+        return self._sweep_result(vis, len(vs), i_stop, abort_di)
+
+    def iv_sweep_stream(self, plan, i_limit=1e-6, settle_time=0.0,
+                        reset=True, poll_sec=0.05):
+        """
+        Sweep the plan in the background with the trigger model and yield
+        the points read from nvbuffer1 as they are measured.  Closing the
+        generator early aborts the sweep.  The output is turned off at the
+        end.  Reference manual 3-33 (trigger model)
+
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> k = Keithley2636A(Keithley2636AEmulator(time_scale=1))
+        >>> stream = k.iv_sweep_stream(np.linspace(0, 1, 31), i_limit=1e-3,
+        ...                            poll_sec=0.1)
+        >>> chunks = list(stream)
+        >>> len(chunks) > 1, sum(map(len, chunks))
+        (True, 31)
+
+        :param plan: SweepPlan, or array-like voltages
+        :param reset: see iv_sweep
+        :param poll_sec: interval of polling nvbuffer1.n
+        :return: generator of [(v, i), ...]; returns is_aborted
+        """
+        vs = SweepPlan.of(plan).voltages()
+        smu = 'smu' + self.smu
+        point_sec = self._point_sec(settle_time, i_limit)
+        with self.operation(), self.deadline(len(vs) * point_sec):
+            if reset and not (self.use_shadow and self._shadow_since_reset):
+                self.reset()
+            with self.batch():
+                self._setup_list_sweep(smu, vs, i_limit, settle_time)
+                self.w(smu + '.trigger.initiate()', True)
+            aborted = yield from self._stream_buffer(
+                smu, len(vs), ('sourcevalues', 'readings'), point_sec,
+                poll_sec)
+        return aborted
+
+    def _stream_buffer(self, smu, points, attrs, point_sec, poll_sec):
+        """
+        Yield the new points of nvbuffer1 until points are read, while the
+        trigger model runs.  Aborts the trigger model if closed early and
+        turns the output off at the end.
+        :param point_sec: expected seconds per point; no new point in
+                          point_sec * timeout_factor + timeout_margin_sec:
+                          TimeoutError
+        :return: generator of arrays (columns: attrs); returns is_aborted
+        """
+        stall_sec = point_sec * self.timeout_factor + self.timeout_margin_sec
+        n_read = 0
+        progress = perf_counter()
+        try:
+            while n_read < points:
+                n = int(float(self.q('print({}.nvbuffer1.n)'.format(smu))))
+                if n > n_read:
+                    values = self._read_buffer(*attrs, start=n_read + 1,
+                                               end=n, smu=smu[-1])
+                    n_read = n
+                    yield values
+                    progress = perf_counter()
+                elif perf_counter() - progress > stall_sec:
+                    self.recover()
+                    raise TimeoutError('{}: no new point in {:.3g}s'.format(
+                        self.__class__.__name__, stall_sec))
+                else:
+                    sleep(poll_sec)
+        finally:
+            if n_read < points:
+                self.w(smu + '.abort()')
+            self.w('{0}.source.output = {0}.OUTPUT_OFF'.format(smu), True)
+        return n_read != points
+
+    def _setup_list_sweep(self, smu, vs, i_limit, settle_time,
+                          table='instr_vlist'):
+        """
+        Trigger model list sweep of vs measuring into nvbuffer1, ready to
+        smuX.trigger.initiate().  Turns the output on.
+        :param smu: 'smua' or 'smub'
+        """
+        lim = smu + '.source.limiti'
+        self.w_shadow(lim, '{} = {}'.format(lim, i_limit), True)
+        col = smu + '.nvbuffer1.collectsourcevalues'
+        self.w_shadow(col, col + ' = 1')
+        delay = smu + '.measure.delay'
+        self.w_shadow(delay, '{} = {}'.format(delay, settle_time))
+        self._configure_profile(smu, i_limit)
+        self.w(smu + '.nvbuffer1.clear()')
+        self._load_list(table, vs)
+        self.w('{}.trigger.source.listv({})'.format(smu, table))
+        self.w('{0}.trigger.source.action = {0}.ENABLE'.format(smu))
+        self.w('{}.trigger.measure.stimulus = 0'.format(smu))
+        self.w('{0}.trigger.measure.action = {0}.ENABLE'.format(smu))
+        self.w('{0}.trigger.measure.i({0}.nvbuffer1)'.format(smu))
+        self.w('{}.trigger.count = {}'.format(smu, len(vs)))
+        self._trigger_model_changed()
+        self.w('{0}.source.output = {0}.OUTPUT_ON'.format(smu))
+
+    @operation_method
+    def iv_sweep_channels(self, plan, channels=('a', 'b'), i_limit=1e-6,
+                          settle_time=0.0, reset=True):
+        """
+        Sweep SMU A and B simultaneously, e.g. on two devices.  Both sweeps
+        are started in one message and read after waitcomplete().
+
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> from instr.dut import Ohmic
+        >>> k = Keithley2636A(Keithley2636AEmulator(duts={'smub': Ohmic(2e3)}))
+        >>> (vis_a, vis_b), aborted = k.iv_sweep_channels(
+        ...     [[0, 0.1], [0, 0.2, 0.4]], i_limit=1e-3)
+        >>> vis_a[:, 1] * 1e3, vis_b[:, 1] * 1e3, aborted
+        (array([0. , 0.1]), array([0. , 0.1, 0.2]), False)
+
+        :param plan: SweepPlan or array-like voltages for all the channels,
+                     or a list of them, one for each channel
+        :param channels: smu names ('a', 'b')
+        :param i_limit: compliance, or compliances of the channels
+        :param reset: see iv_sweep
+        :return: [vis of each channel], is_aborted
+        """
+        if isinstance(plan, list) and len(plan) == len(channels) and \
+                all(isinstance(p, SweepPlan) or np.ndim(p) == 1
+                    for p in plan):
+            plans = plan
         else:
-            aborted = False
-        vs = np.linspace(v_start, v_end, v_points)
+            plans = [plan] * len(channels)
+        vsl = [SweepPlan.of(p).voltages() for p in plans]
+        i_limits = np.broadcast_to(i_limit, len(channels))
+        point_sec = max(self._point_sec(settle_time, lim) for lim in i_limits)
+        expected = max(map(len, vsl)) * point_sec
+        with self.deadline(expected):
+            if reset and not (self.use_shadow and self._shadow_since_reset):
+                self.reset()
+            with self.batch():
+                for ch, vs, lim in zip(channels, vsl, i_limits):
+                    self._setup_list_sweep('smu' + ch, vs, lim, settle_time,
+                                           'instr_vlist_' + ch)
+                for ch in channels:
+                    self.w('smu{}.trigger.initiate()'.format(ch))
+                self.w('waitcomplete()', True)
+            visl = [self._read_buffer('sourcevalues', 'readings', smu=ch)
+                    for ch in channels]
+            with self.batch():
+                for ch in channels:
+                    self.w('smu{0}.source.output = smu{0}.OUTPUT_OFF'.
+                           format(ch), True)
+        aborted = any(len(vis) != len(vs) for vis, vs in zip(visl, vsl))
+        return visl, aborted
 
-        vis = np.array([vs, Is]).transpose()
-        return vis, aborted
+    # Time sampling ------------------------------------------------------------
+    def time_sampling_stream(self, duration_sec=1.0, interval_sec=None,
+                             voltage=10e-3, i_limit=1e-3, nplc=1.0,
+                             reset=True, poll_sec=0.05):
+        """
+        Source voltage and measure the current for duration_sec into
+        nvbuffer1 with the instrument timestamps (trigger model, paced by
+        trigger.timer[1]), yielding the points read in bulk while sampling.
+        Closing the generator early aborts the sampling.  The output is
+        turned off at the end.
 
-    def iv_sweep_double(self, v_max, v_step=1e-3, v_points=None,
-                        i_limit=1e-3, settle_time=0.0, reset=True):
-        vis1, aborted = self.iv_sweep(0, v_max, v_step,
-                                      v_points, i_limit, settle_time, reset)
-        if aborted:
-            return vis1, aborted
-        vis2, aborted = self.iv_sweep(v_max, 0, v_step,
-                                      v_points, i_limit, settle_time, reset)
+        >>> from instr.emulator import Keithley2636AEmulator
+        >>> k = Keithley2636A(Keithley2636AEmulator())
+        >>> tIs = k.time_sampling(0.1, interval_sec=1e-3, nplc=0.01)  # 1kHz
+        >>> tIs.shape, float(tIs[1, 0]), float(tIs[0, 1])
+        ((100, 2), 0.001, 1e-05)
+
+        :param interval_sec: None: as fast as nplc allows
+        :param nplc: integration time (power line cycles).  e.g. 0.01 for
+                     kHz sampling
+        :param reset: see iv_sweep
+        :return: generator of [(t, i), ...], t (s) from the first point;
+                 returns is_aborted
+        """
+        point_sec = interval_sec if interval_sec is not None else \
+            nplc * self._nplc_sec + self._point_overhead_sec
+        points = max(1, int(round(duration_sec / point_sec)))
+        if points > self._buffer_points:
+            raise ValueError('More than {} points.'.
+                             format(self._buffer_points))
+        if self._debug_mode:
+            self._dbg_print('time_sampling_stream: Return dummy data.')
+            ts = np.arange(points) * point_sec
+            if self.dut is None:
+                Is = voltage / 1000 + np.random.normal(0, 1e-9, points)
+            else:
+                Is = np.clip(self.dut(np.full(points, voltage)),
+                             -abs(i_limit), abs(i_limit))
+            yield np.array([ts, Is]).transpose()
+            return False
+
+        smu = 'smu' + self.smu
+        with self.operation(), self.deadline(points * point_sec):
+            if reset and not (self.use_shadow and self._shadow_since_reset):
+                self.reset()
+            with self.batch():
+                self._source_voltage(smu, voltage)
+                for key, value in (('source.limiti', i_limit),
+                                   ('measure.nplc', nplc),
+                                   ('measure.delay', 0),
+                                   ('nvbuffer1.collecttimestamps', 1)):
+                    key = '{}.{}'.format(smu, key)
+                    self.w_shadow(key, '{} = {}'.format(key, value))
+                self.w(smu + '.nvbuffer1.clear()')
+                self.w('{0}.trigger.source.action = {0}.DISABLE'.format(smu))
+                self.w('{0}.trigger.measure.action = {0}.ENABLE'.format(smu))
+                self.w('{0}.trigger.measure.i({0}.nvbuffer1)'.format(smu))
+                self.w('{}.trigger.count = {}'.format(smu, points))
+                if interval_sec is None:
+                    self.w('{}.trigger.measure.stimulus = 0'.format(smu))
+                else:
+                    # First point on arm, then every interval_sec
+                    self.w('trigger.timer[1].delay = {}'.format(interval_sec))
+                    self.w('trigger.timer[1].count = {}'.format(points - 1))
+                    self.w('trigger.timer[1].passthrough = true')
+                    self.w('trigger.timer[1].stimulus = '
+                           '{}.trigger.ARMED_EVENT_ID'.format(smu))
+                    self.w('{}.trigger.measure.stimulus = '
+                           'trigger.timer[1].EVENT_ID'.format(smu))
+                self._trigger_model_changed()
+                self.w('{0}.source.output = {0}.OUTPUT_ON'.format(smu))
+                self.w(smu + '.trigger.initiate()', True)
+            stream = self._stream_buffer(smu, points,
+                                         ('timestamps', 'readings'),
+                                         point_sec, poll_sec)
+            t0 = None
+            try:
+                while True:
+                    try:
+                        tis = next(stream)
+                    except StopIteration as e:
+                        return e.value
+                    if t0 is None:
+                        t0 = tis[0, 0]
+                    tis[:, 0] -= t0
+                    yield tis
+            finally:
+                stream.close()
+
+    def time_sampling(self, duration_sec=1.0, interval_sec=None,
+                      voltage=10e-3, i_limit=1e-3, nplc=1.0, reset=True):
+        """
+        All points of time_sampling_stream.
+        :return: [(t, i), ...]
+        :rtype: np.ndarray
+        """
+        chunks = list(self.time_sampling_stream(
+            duration_sec, interval_sec, voltage, i_limit, nplc, reset))
+        return np.concatenate(chunks) if chunks else np.empty((0, 2))
+
+    # Single reads -------------------------------------------------------------
+    @operation_method
+    def read_single_on(self, voltage=10e-3, i_limit=1e-3, nplc=1.0):
+        """Source voltage with the output on for read_single_read()."""
+        smu = 'smu' + self.smu
+        with self.batch():
+            self._source_voltage(smu, voltage)
+            for key, value in (('source.limiti', i_limit),
+                               ('measure.nplc', nplc)):
+                key = '{}.{}'.format(smu, key)
+                self.w_shadow(key, '{} = {}'.format(key, value))
+            self.w('{0}.source.output = {0}.OUTPUT_ON'.format(smu), True)
+
+    def read_single_read(self):
+        """
+        One current reading (one query per point; see time_sampling for
+        fast sampling).
+        :rtype: float
+        """
+        if self._debug_mode:
+            self._dbg_print('read_single_read: Return dummy data.')
+            return 1e-5 + np.random.normal(0, 1e-9)
+        return float(self.q('print(smu{}.measure.i())'.format(self.smu)))
+
+    def read_single_off(self):
+        self.w('smu{0}.source.output = smu{0}.OUTPUT_OFF'.format(self.smu),
+               True)
 
-        ret = np.concatenate((vis1, vis2))
-        return ret, aborted
+    @operation_method
+    def off(self):
+        """Turn the output of both SMUs off."""
+        with self.batch():
+            for smu in ('smua', 'smub'):
+                self.w('{0}.source.output = {0}.OUTPUT_OFF'.format(smu), True)
 
 
-class TestKeithley2636A(unittest2.TestCase):
+class TestKeithley2636A(unittest.TestCase):
     def test_iv_sweep(self):
         import matplotlib.pyplot as plt
         ke2636a.reset()
@@ -125,6 +760,6 @@ if __name__ == '__main__':
     ke2636a_rsrc = rm.open_resource('TCPIP::169.254.000.001::INSTR')
     ke2636a = Keithley2636A(ke2636a_rsrc)
 
-    unittest2.main()
+    unittest.main()
 
     pass
@@ -22,6 +22,10 @@ class LSCI331(BaseInstr):
             return -1111.1
         else:
             return float(self.q(unit + 'RDG? ' + input_))
+
+    async def aread_temp_kelvin(self, input_='A', unit='K'):
+        """Awaitable read_temp_kelvin."""
+        return await self.run_async(self.read_temp_kelvin, input_, unit)
             
         
 
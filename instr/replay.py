@@ -0,0 +1,254 @@
+"""
+Record instrument traffic and replay it without the instruments.
+
+RecordingResource wraps the rsrc passed to a driver and writes every call
+(write, query, read, ...) with its response and duration to a gzipped JSON
+lines file.  ReplayResource serves the responses back in the same order,
+instantly (speed=None), at the recorded speed (speed=1) or faster
+(speed=10: 10 times faster).  The driver must send the same messages.
+
+>>> import os, tempfile
+>>> from instr.emulator import Keithley2636AEmulator
+>>> from instr.ke2636a import Keithley2636A
+>>> path = os.path.join(tempfile.mkdtemp(), 'ke.jsonl.gz')
+>>> rec = RecordingResource(Keithley2636AEmulator(), path)
+>>> vis, aborted = Keithley2636A(rec).iv_sweep(0, 0.1, v_points=3)
+>>> rec.close()
+>>> rep = ReplayResource(path)
+>>> vis2, aborted = Keithley2636A(rep).iv_sweep(0, 0.1, v_points=3)
+>>> bool((vis == vis2).all()), rep.remaining()
+(True, 0)
+>>> try:
+...     Keithley2636A(ReplayResource(path)).iv_sweep(0, 0.2, v_points=3)
+... except ReplayError as e:
+...     print(e)  # doctest: +ELLIPSIS
+Call 75: expected write '...0.1, 0.0, 3, false)', got write '...0.2, ...'
+
+A resource of instr.daemon answers BaseInstr.q_raw in one query_raw call,
+which is recorded and replayed as well:
+
+>>> from instr.daemon import DaemonResourceManager, InstrumentDaemon
+>>> from instr.emulator import EmulatorResourceManager
+>>> key = os.urandom(32)
+>>> d = InstrumentDaemon(EmulatorResourceManager(
+...     {'GPIB0::26::INSTR': Keithley2636AEmulator()}), ('localhost', 0), key)
+>>> d.start()
+>>> rm = DaemonResourceManager(d.address, key)
+>>> rec = RecordingResource(rm.open_resource('GPIB0::26::INSTR'), path)
+>>> k = Keithley2636A(rec, binary_transfer=True)
+>>> vis, aborted = k.iv_sweep(0, 0.1, v_points=3)
+>>> vis = k._read_buffer('sourcevalues', 'readings')
+>>> rec.close(); rm.close(); d.shutdown()
+>>> sorted({call[1] for call in load(path)})
+['query', 'query_raw', 'read_raw', 'write']
+>>> rep = ReplayResource(path)
+>>> k = Keithley2636A(rep, binary_transfer=True)
+>>> vis2, aborted = k.iv_sweep(0, 0.1, v_points=3)
+>>> vis2 = k._read_buffer('sourcevalues', 'readings')
+>>> bool((vis == vis2).all()), rep.remaining()
+(True, 0)
+"""
+import argparse
+import atexit
+import base64
+from collections import Counter
+import gzip
+import json
+from time import perf_counter, sleep
+
+
+class ReplayError(RuntimeError):
+    pass
+
+
+def _encode(response):
+    if isinstance(response, bytes):
+        return {'b64': base64.b64encode(response).decode('ascii')}
+    return response
+
+
+def _decode(response):
+    if isinstance(response, dict):
+        if 'b64' in response:
+            return base64.b64decode(response['b64'])
+        if 'visa_error' in response:
+            import visa
+            raise visa.VisaIOError(response['visa_error'])
+        raise RuntimeError(response['error'])
+    return response
+
+
+class RecordingResource:
+    """
+    Pass-through VISA resource recording each call as
+    [start (s), method, message, response, duration (s)].
+    The record is closed at exit if close() is not called.
+    """
+    def __init__(self, rsrc, path):
+        self._rsrc = rsrc
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._t0 = perf_counter()
+        atexit.register(self.close)
+
+    def __getattr__(self, name):
+        # timeout, hold, resource_name, ...
+        if name == '_rsrc':
+            raise AttributeError(name)
+        attr = getattr(self._rsrc, name)
+        if name == 'query_raw':  # instr.daemon.RemoteResource
+            return self._query_raw
+        return attr
+
+    def __setattr__(self, name, value):
+        if name == 'timeout':
+            self._rsrc.timeout = value
+        else:
+            super().__setattr__(name, value)
+
+    def _call(self, method, *args):
+        t = perf_counter()
+        try:
+            response = getattr(self._rsrc, method)(*args)
+            encoded = _encode(response)
+        except Exception as e:
+            code = getattr(e, 'error_code', None)
+            response = None
+            encoded = {'error': repr(e)} if code is None else \
+                {'visa_error': code}
+            raise
+        finally:
+            duration = perf_counter() - t
+            message = args[0] if args else None
+            json.dump([round(t - self._t0, 6), method, message, encoded,
+                       round(duration, 6)], self._file,
+                      separators=(',', ':'))
+            self._file.write('\n')
+        return response
+
+    def write(self, message):
+        return self._call('write', message)
+
+    def read(self):
+        return self._call('read')
+
+    def read_raw(self):
+        return self._call('read_raw')
+
+    def query(self, message):
+        return self._call('query', message)
+
+    def clear(self):
+        return self._call('clear')
+
+    def read_stb(self):
+        return self._call('read_stb')
+
+    def _query_raw(self, message):
+        return self._call('query_raw', message)
+
+    def close(self):
+        """Close the record.  The wrapped resource stays open."""
+        self._file.close()
+
+
+def load(path):
+    """:return: list of [start, method, message, response, duration]"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+class ReplayResource:
+    """
+    VISA resource answering from a record.
+    :param speed: None: no wait.  1: wait the recorded duration of each call.
+                  10: 10 times faster.
+    :param strict: Raise ReplayError if a method or message differs from the
+                   record.
+    """
+    def __init__(self, path, speed=None, strict=True):
+        self._calls = load(path)
+        self._i = 0
+        self.speed = speed
+        self.strict = strict
+        self.timeout = 2000  # millisec, not used
+
+    def __getattr__(self, name):
+        # query_raw only if recorded, as drivers call it if it exists
+        if name == 'query_raw' and \
+                any(call[1] == 'query_raw' for call in self._calls):
+            return self._query_raw
+        raise AttributeError(name)
+
+    def remaining(self):
+        return len(self._calls) - self._i
+
+    def _call(self, method, message=None):
+        if self._i >= len(self._calls):
+            raise ReplayError('Call {}: end of the record, got {} {!r}'.
+                              format(self._i, method, message))
+        start, rec_method, rec_message, response, duration = \
+            self._calls[self._i]
+        if self.strict and (method, message) != (rec_method, rec_message):
+            raise ReplayError('Call {}: expected {} {!r}, got {} {!r}'.format(
+                self._i, rec_method, rec_message, method, message))
+        self._i += 1
+        if self.speed:
+            sleep(duration / self.speed)
+        return _decode(response)
+
+    def write(self, message):
+        return self._call('write', message)
+
+    def read(self):
+        return self._call('read')
+
+    def read_raw(self):
+        return self._call('read_raw')
+
+    def query(self, message):
+        return self._call('query', message)
+
+    def clear(self):
+        return self._call('clear')
+
+    def read_stb(self):
+        return self._call('read_stb')
+
+    def _query_raw(self, message):
+        return self._call('query_raw', message)
+
+    def close(self):
+        pass
+
+
+def summary(path):
+    """
+    Number of calls and bus time per method and command prefix.
+    :rtype: list of (method, prefix, count, seconds), by seconds descending
+    """
+    from instr.bus_stats import command_prefix
+    counts = Counter()
+    seconds = Counter()
+    for start, method, message, response, duration in load(path):
+        key = (method, '' if message is None else command_prefix(message))
+        counts[key] += 1
+        seconds[key] += duration
+    return sorted(((method, prefix, counts[method, prefix], sec)
+                   for (method, prefix), sec in seconds.items()),
+                  key=lambda row: -row[3])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Summarize a record of instr.replay.RecordingResource.')
+    parser.add_argument('path')
+    args = parser.parse_args()
+    rows = summary(args.path)
+    for method, prefix, count, sec in rows:
+        print('{:>9.3f}s {:>6} {:<9} {}'.format(sec, count, method, prefix))
+    print('{:>9.3f}s {:>6} total'.format(sum(row[3] for row in rows),
+                                         sum(row[2] for row in rows)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Fixed-capacity buffer of the latest rows of a long measurement, e.g. the
+points of Agilent4156C.contact_monitor over hours.
+
+>>> rb = RingBuffer(3)
+>>> rb.extend([[0.0, 1.0], [1.0, 2.0]])
+>>> rb.extend([[2.0, 3.0], [3.0, 4.0]])
+>>> rb.array()
+array([[1., 2.],
+       [2., 3.],
+       [3., 4.]])
+>>> len(rb), rb.dropped
+(3, 1)
+"""
+import numpy as np
+
+
+class RingBuffer:
+    """
+    :param capacity: rows kept; older rows are overwritten
+    :param columns: e.g. 2 for (t, i)
+    """
+    def __init__(self, capacity, columns=2, dtype=np.float64):
+        if capacity < 1:
+            raise ValueError('capacity must be positive.')
+        self._data = np.empty((capacity, columns), dtype)
+        self._start = 0  # index of the oldest row
+        self._len = 0
+        self.dropped = 0  # rows overwritten so far
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def extend(self, rows):
+        rows = np.asarray(rows).reshape(-1, self._data.shape[1])
+        cap = self.capacity
+        overflow = max(0, self._len + len(rows) - cap)
+        self.dropped += overflow
+        if len(rows) >= cap:
+            self._data[:] = rows[-cap:]
+            self._start = 0
+            self._len = cap
+            return
+        end = (self._start + self._len) % cap
+        first = min(len(rows), cap - end)
+        self._data[end:end + first] = rows[:first]
+        self._data[:len(rows) - first] = rows[first:]
+        self._start = (self._start + overflow) % cap
+        self._len = min(cap, self._len + len(rows))
+
+    def array(self):
+        """
+        Copy of the rows, oldest first.
+        :rtype: np.ndarray
+        """
+        idx = (self._start + np.arange(self._len)) % self.capacity
+        return self._data[idx]
@@ -1,8 +1,9 @@
 ﻿import math
+import unittest
 
-import unittest2
+import numpy as np
 
-from instr.base import BaseInstr
+from instr.base import BaseInstr, operation_method
 
 """
 Unit of length: um
@@ -13,6 +14,11 @@ Coordinate mode
 
 
 class SussPA300(BaseInstr):
+    # velocity 1 -> about 4s/100um; for the expected duration of moves
+    _um_per_sec_per_velocity = 25.0
+    # Allowed difference (um) of the read position from the local model
+    _position_tolerance = 1.0
+
     def __init__(self, rsrc=None, timeout_sec=15, reset=True):
         idn = 'Suss MicroTec Test Systems GmbH,ProberBench PC,0,0'
         # 30,000um = 3cm
@@ -22,6 +28,14 @@ class SussPA300(BaseInstr):
         self._z_align = self._z_contact - 100
         self._z_separate = self._z_contact - 300
         self._safe_move_separate_threshold_distance = 3000
+        # Local model of the chuck (see _position): offsets of 'H' and 'Z'
+        # from 'C' (constant for a session) and the position ('C') after
+        # the last confirmed move.  None: read from the prober.
+        self._offsets = None
+        self._xyz = None
+        # Moves before check_error() reads the position from the prober
+        self.position_check_moves = 20
+        self._moves_unchecked = 0
         super().__init__(rsrc, idn, timeout_sec, reset)
         if self._debug_mode:
             # self._xy_home_deprecated = (0.0, 0.0)
@@ -32,18 +46,28 @@ class SussPA300(BaseInstr):
                                          'Z': (157600.0, 155000.0)}
             self._z_debug = 11000.0
 
-    def check_error(self):
-        if self._debug_mode:
-            super().check_error()
-            return
+    def _check_error(self):
         # Response example: '0: PA300PS_ 5 1 1 1 0 0 0 0 0'
         stat = self.q('ReadSystemStatus')
         if stat.split(':')[0] != '0':
             raise RuntimeError('Error in SUSS. (non-zero status code)')
-        x, y, z = self.read_xyz('C')
+        if self._moves_unchecked >= self.position_check_moves:
+            self._verify_position()
+        x, y, z = self._position('C')
         if self._exceeds_limit('C', x, y, z):
             raise RuntimeError('Over xyz limit.')
 
+    def _error_pending(self):
+        """Only the status code.  (The xyz limit is not checked.)"""
+        return self.q('ReadSystemStatus').split(':')[0] != '0'
+
+    def invalidate_shadow(self):
+        """Also forget the local model of the chuck."""
+        super().invalidate_shadow()
+        self._offsets = None
+        self._xyz = None
+
+    @operation_method
     def reset(self):
         if self._debug_mode:
             super().reset()
@@ -99,16 +123,85 @@ class SussPA300(BaseInstr):
         if self._debug_mode:
             x, y = map(sum, zip([self._x_home_debug, self._y_home_debug],
                                 self._xy_offset_from_home[coordinate]))
-            return x, y, self._z_debug
+            xyz = x, y, self._z_debug
+        else:
+            # Y: micron.
+            res = self.q('ReadChuckPosition Y {} D'.format(coordinate)).\
+                split()
+            # "0: 0.0 -0.5 -300.08" -> ["0:", "0.0", "-0.5", "-300.08"]
+            xyz = tuple(map(float, res[1:]))
+        if self._offsets is not None:
+            self._xyz = self._convert_coord(coordinate, 'C', *xyz)
+            self._moves_unchecked = 0
+        return xyz
+
+    def _load_offsets(self):
+        """Read the position in all the coordinates (3 queries)."""
+        xyzs = {coord: self.read_xyz(coord) for coord in ('C', 'H', 'Z')}
+        self._offsets = {coord: tuple(a - c for a, c in
+                                      zip(xyz, xyzs['C']))
+                         for coord, xyz in xyzs.items()}
+        self._xyz = xyzs['C']
+        self._moves_unchecked = 0
+
+    def _position(self, coord):
+        """
+        Chuck position from the local model: read from the prober only
+        when unknown (first use, after invalidate_shadow()) or if not
+        use_shadow.
+
+        >>> from instr.emulator import SussPA300Emulator
+        >>> s = SussPA300(SussPA300Emulator())
+        >>> s._position('H')
+        (-9669.5, -2349.5, 11000.0)
+        >>> s._rsrc.log.clear()
+        >>> s._position('C'), s._convert_coord('C', 'Z', 0, 0)
+        ((0.0, 0.0, 11000.0), (157600.0, 155000.0))
+        >>> len(s._rsrc.log)
+        0
 
-        # Y: micron.
-        res = self.q('ReadChuckPosition Y {} D'.format(coordinate)).split()
-        # "0: 0.0 -0.5 -300.08" -> ["0:", "0.0", "-0.5", "-300.08"]
-        return tuple(map(float, res[1:]))
+        :return: x, y, z (um)
+        """
+        if self._offsets is None:
+            self._load_offsets()
+        elif self._xyz is None or not self.use_shadow:
+            self.read_xyz('C')
+        return self._convert_coord('C', coord, *self._xyz)
+
+    def _confirm_move(self, coord, resp, *target):
+        """
+        Update the local model from the response of a move, e.g.
+        '0: 100.0 0.0' (MoveChuck) or '0: 11900.0' (MoveChuckZ).
+        :param target: x, y (MoveChuck) or z (MoveChuckZ) in coord
+        """
+        code, _, values = resp.partition(':')
+        values = tuple(map(float, values.split()))
+        if self._xyz is None or code.strip() != '0' or \
+                len(values) != len(target):
+            self._xyz = None
+            return
+        xyz = list(self._convert_coord('C', coord, *self._xyz))
+        if len(values) == 2:
+            xyz[:2] = values
+        else:
+            xyz[2] = values[0]
+        self._xyz = self._convert_coord(coord, 'C', *xyz)
+        self._moves_unchecked += 1
+
+    def _verify_position(self):
+        """Read the position and compare it with the local model."""
+        expected = self._xyz
+        xyz = self.read_xyz('C')
+        if expected is not None and \
+                max(abs(a - b) for a, b in zip(xyz, expected)) > \
+                self._position_tolerance:
+            raise RuntimeError('Chuck at {}, not at {} as expected. '
+                               '(moved outside of this driver?)'.
+                               format(xyz, expected))
 
     @property
     def z(self) -> float:
-        z = self.read_xyz('H')[2]
+        z = self._position('H')[2]
         if self._z_contact - 1 < z < self._z_contact + 1:
             return self._z_contact
         elif self._z_align - 1 < z < self._z_align + 1:
@@ -132,9 +225,11 @@ class SussPA300(BaseInstr):
         if coord_mode_from == coord_mode_to:
             return xyz
 
-        xyz_now_from = self.read_xyz(coord_mode_from)
-        xyz_now_to = self.read_xyz(coord_mode_to)
-        xyz_offset = [xt - xf for xf, xt in zip(xyz_now_from, xyz_now_to)]
+        if self._offsets is None:
+            self._load_offsets()
+        xyz_offset = [xt - xf for xf, xt in
+                      zip(self._offsets[coord_mode_from],
+                          self._offsets[coord_mode_to])]
         ret = tuple(map(sum, zip(xyz, xyz_offset)))
         return ret
 
@@ -162,6 +257,7 @@ class SussPA300(BaseInstr):
                 return True
         return False
 
+    @operation_method
     def _move_xy(self, coord, velocity, *xy):
         """
         Debug mode: only check_error().
@@ -175,6 +271,7 @@ class SussPA300(BaseInstr):
         if self._debug_mode:
             self._x_home_debug, self._y_home_debug = \
                 self._convert_coord('C', 'H', *xy)
+            self._confirm_move('C', '0: {} {}'.format(*xy), *xy)
             return
         # TODO implement
         # example '7 7 0 0 L 1 C 0'
@@ -182,9 +279,14 @@ class SussPA300(BaseInstr):
         # if not separation or alignment
         # if not query_response.split()[6] in ('S', 'A'):
         #     raise RuntimeError('Separate or align before!')
-        self.q('MoveChuck {} {} C Y {}'.format(*xy, velocity))
+        x0, y0, _ = self._position('C')
+        distance = math.hypot(xy[0] - x0, xy[1] - y0)
+        with self.deadline(self._move_sec(distance, velocity)):
+            resp = self.q('MoveChuck {} {} C Y {}'.format(*xy, velocity))
+        self._confirm_move('C', resp, *xy)
         self.check_error()
 
+    @operation_method
     def _move_z(self, velocity, z):
         """
         Debug mode: only checks given z
@@ -194,15 +296,28 @@ class SussPA300(BaseInstr):
                     self._xyz_center_limit_max[2]):
             raise RuntimeError('Parameter exceeds z limit.')
         self.check_error()
-        self.q('MoveChuckZ {} Z Y {}'.format(z, velocity))
+        distance = abs(z - self._position('Z')[2])
+        if self._debug_mode:
+            self._z_debug = self._convert_coord('Z', 'H', 0, 0, z)[2]
+            self._confirm_move('Z', '0: {}'.format(z), z)
+            return
+        with self.deadline(self._move_sec(distance, velocity)):
+            resp = self.q('MoveChuckZ {} Z Y {}'.format(z, velocity))
+        self._confirm_move('Z', resp, z)
         self.check_error()
 
+    def _move_sec(self, distance, velocity):
+        """Expected duration of a move of distance (um)."""
+        return distance / (velocity * self._um_per_sec_per_velocity)
+
+    @operation_method
     def approach_separate(self):
         if self.z >= self._z_separate:
             print('Already z >= z_separate.')
             return
         self._move_z(20, self._z_separate)
 
+    @operation_method
     def approach_align(self):
         if self.z >= self._z_align:
             print('Already z >= z_align.')
@@ -210,6 +325,7 @@ class SussPA300(BaseInstr):
         self.approach_separate()
         self._move_z(5, self._z_align)
 
+    @operation_method
     def contact(self):
         """Debug mode: only checks given z"""
         if self.z >= self._z_contact:
@@ -218,20 +334,40 @@ class SussPA300(BaseInstr):
         self.approach_align()
         self._move_z(1, self._z_contact)
 
+    @operation_method
     def separate_align(self):
         if self.z <= self._z_align:
             print('Already z <= z_align.')
             return
         self._move_z(1, self._z_align)
 
+    @operation_method
     def separate_separate(self):
         if self.z <= self._z_separate:
             print('Already z <= z_separate.')
             return
         self._move_z(5, self._z_separate)
 
+    @operation_method
     def safe_move(self, coord, x, y):
-        x0, y0, _ = self.read_xyz(coord)
+        """
+        Separate (long move) or align (short move), then move.  The
+        positions come from the local model (see _position), confirmed by
+        the responses of the moves: a move is one query and a status read.
+
+        >>> from instr.emulator import SussPA300Emulator
+        >>> s = SussPA300(SussPA300Emulator())
+        >>> s.safe_move('H', -9569.5, -2349.5)
+        Already z <= z_align.
+        >>> s._rsrc.log.clear()
+        >>> s.safe_move('H', -9469.5, -2349.5)
+        Already z <= z_align.
+        >>> list(s._rsrc.log)
+        ['MoveChuck 200.0 0.0 C Y 1', 'ReadSystemStatus']
+        >>> s.read_xyz('H')
+        (-9469.5, -2349.5, 11000.0)
+        """
+        x0, y0, _ = self._position(coord)
         x_move = x - x0
         y_move = y - y0
         distance = math.hypot(x_move, y_move)
@@ -242,12 +378,47 @@ class SussPA300(BaseInstr):
             self.separate_align()
             self._move_xy(coord, 1, x, y)
 
+    @operation_method
     def safe_move_contact(self, coord, x, y):
         self.safe_move(coord, x, y)
         self.contact()
 
+    def safe_move_sec(self, distance):
+        """
+        Expected duration of safe_move_contact from contact: separate, move
+        fast and approach for a long move, align and move slowly for a
+        short one.  The cost of lib.algorithms.probe_order.
 
-class TestSussPA300(unittest2.TestCase):
+        >>> s = SussPA300()
+        debug mode (SussPA300): skip BaseInstr.__init__.
+        >>> s.safe_move_sec([100, 2900, 3100])
+        array([ 12. , 124. ,  14.2])
+
+        :param distance: xy distance(s) of the move (um)
+        :rtype: np.ndarray
+        """
+        distance = np.asarray(distance, np.float64)
+        dz_align = self._z_contact - self._z_align
+        dz_separate = self._z_contact - self._z_separate
+        # Velocities of safe_move, separate_*, approach_* and contact
+        short = 2 * self._move_sec(dz_align, 1) + self._move_sec(distance, 1)
+        long = self._move_sec(dz_separate, 5) + \
+            self._move_sec(dz_separate - dz_align, 5) + \
+            self._move_sec(dz_align, 1) + self._move_sec(distance, 20)
+        return np.where(
+            distance > self._safe_move_separate_threshold_distance, long,
+            short)
+
+    async def asafe_move(self, coord, x, y):
+        """Awaitable safe_move."""
+        await self.run_async(self.safe_move, coord, x, y)
+
+    async def asafe_move_contact(self, coord, x, y):
+        """Awaitable safe_move_contact."""
+        await self.run_async(self.safe_move_contact, coord, x, y)
+
+
+class TestSussPA300(unittest.TestCase):
     def test00(self):
         suss.check_error()
         suss.reset()
@@ -300,4 +471,4 @@ if __name__ == '__main__':
         resp = input('Use debugger! Doing dengerous test.')
         if resp != 'yes':
             raise RuntimeError('Use debugger and execute lines one-by-one.')
-    unittest2.main()
+    unittest.main()
@@ -0,0 +1,224 @@
+"""
+Sweep plans for SourceMeter.iv_sweep_plan: a list of voltage segments run
+as one instrument-side program with one data transfer.  Also the results
+of sweeps with abort conditions.
+
+>>> SweepPlan.linear([0, 0.2, 0, -0.2, 0], v_points=3).voltages()
+array([ 0. ,  0.1,  0.2,  0.1,  0. , -0.1, -0.2, -0.1,  0. ])
+>>> plan = SweepPlan.doubles([0.3, -0.3], v_points=4)
+>>> plan.lengths()
+[8, 8]
+>>> plan.linear_runs()  # doctest: +NORMALIZE_WHITESPACE
+[(0.0, 0.3, 4), (0.3, 0.0, 4), (0.0, -0.3, 4), (-0.3, 0.0, 4)]
+
+Any array is a segment, e.g. lib.algorithms.log_list(1e-3, 1, 31).
+"""
+from math import floor
+from operator import itemgetter
+
+import numpy as np
+
+
+def _points(v_start, v_end, v_step=1e-3, v_points=None):
+    """Same as SourceMeter._v_step_to_points, v_points overrides v_step."""
+    if v_points is not None:
+        return v_points
+    if v_step < 0:
+        raise ValueError('v_step must be positive.')
+    return floor(abs(v_end - v_start) / v_step) + 1
+
+
+class SweepPlan:
+    """
+    :param segments: list of array-like voltages (V), swept in order
+    """
+    def __init__(self, segments):
+        self.segments = [np.asarray(seg, np.float64).ravel()
+                         for seg in segments]
+
+    @classmethod
+    def of(cls, plan):
+        """plan itself if SweepPlan, else a plan of one segment."""
+        return plan if isinstance(plan, cls) else cls([plan])
+
+    @classmethod
+    def linear(cls, vertices, v_step=1e-3, v_points=None):
+        """
+        Linear legs through vertices, e.g. [0, V, 0, -V, 0].  A vertex is
+        measured once.  One segment per leg.
+
+        :param v_points: per leg, including both ends; overrides v_step
+        """
+        segments = []
+        for i, (v0, v1) in enumerate(zip(vertices[:-1], vertices[1:])):
+            vs = np.linspace(v0, v1, _points(v0, v1, v_step, v_points))
+            segments.append(vs if i == 0 else vs[1:])
+        return cls(segments)
+
+    @classmethod
+    def doubles(cls, v_maxes, v_step=1e-3, v_points=None):
+        """
+        One segment 0V -> v_max -> 0V (as SourceMeter.iv_sweep_double) for
+        each v_max.
+        """
+        segments = []
+        for v_max in v_maxes:
+            n = _points(0, v_max, v_step, v_points)
+            segments.append(np.concatenate((np.linspace(0, v_max, n),
+                                            np.linspace(v_max, 0, n))))
+        return cls(segments)
+
+    def __len__(self):
+        return len(self.segments)
+
+    def lengths(self):
+        return [len(seg) for seg in self.segments]
+
+    def voltages(self):
+        """:rtype: np.ndarray"""
+        if not self.segments:
+            return np.array([])
+        return np.concatenate(self.segments)
+
+    def split(self, vis):
+        """
+        Split the result of the whole plan into segments.  Segments not
+        reached (aborted sweep) are omitted, the last one may be short.
+
+        >>> plan = SweepPlan([[0, 1], [2, 3, 4]])
+        >>> plan.split(np.arange(4))
+        [array([0, 1]), array([2, 3])]
+        """
+        ret = []
+        start = 0
+        for n in self.lengths():
+            if start >= len(vis):
+                break
+            ret.append(vis[start:start + n])
+            start += n
+        return ret
+
+    def linear_runs(self, rtol=1e-9):
+        """
+        The voltages as maximal runs of a constant nonzero step, for
+        instruments without list sweeps.
+
+        >>> SweepPlan([[1, 2, 4, 8]]).linear_runs()
+        [(1.0, 2.0, 2), (4.0, 8.0, 2)]
+
+        :return: [(start, stop, points), ...]
+        """
+        vs = self.voltages()
+        atol = rtol * max(np.abs(vs).max(), 1.0) if len(vs) else 0.0
+        runs = []
+        i = 0
+        while i < len(vs):
+            j = i  # last point of the run
+            if i + 1 < len(vs) and vs[i + 1] != vs[i]:
+                step = vs[i + 1] - vs[i]
+                j = i + 1
+                while j + 1 < len(vs) and \
+                        abs(vs[j + 1] - vs[j] - step) <= atol:
+                    j += 1
+            runs.append((float(vs[i]), float(vs[j]), j - i + 1))
+            i = j + 1
+        return runs
+
+
+def refine(vis, max_new, atol=1e-9, rtol=1e-2, min_step=0.0):
+    """
+    Voltages to add to a measured I-V: the midpoints of the intervals where
+    the linear interpolation error, estimated from the second differences
+    (|I''| h^2 / 8), exceeds atol + rtol * max|I|.  Worst first.
+
+    >>> vs = np.linspace(-1, 1, 5)
+    >>> refine(np.array([vs, vs ** 3]).transpose(), 2, rtol=0.05)
+    array([-0.75,  0.75])
+    >>> refine(np.array([vs, 2 * vs]).transpose(), 2)  # linear: done
+    array([], dtype=float64)
+
+    :param vis: [(v, i), ...] in any order
+    :param max_new: maximum number of voltages returned
+    :param min_step: do not split intervals narrower than 2 * min_step
+    :return: sorted voltages
+    :rtype: np.ndarray
+    """
+    vs, idx = np.unique(np.asarray(vis)[:, 0], return_index=True)
+    Is = np.asarray(vis)[idx, 1]
+    if len(vs) < 3 or max_new <= 0:
+        return np.array([])
+    h = np.diff(vs)
+    d2 = np.abs(np.diff(np.diff(Is) / h) / ((h[:-1] + h[1:]) / 2))
+    # Curvature in an interval: the mean at its ends (one end at the edges)
+    curv = np.concatenate((d2[:1], (d2[:-1] + d2[1:]) / 2, d2[-1:]))
+    err = curv * h ** 2 / 8
+    tol = atol + rtol * np.abs(Is).max()
+    bad = np.flatnonzero((err > tol) & (h > 2 * min_step))
+    bad = bad[np.argsort(-err[bad], kind='stable')][:max_new]
+    return np.sort(vs[bad] + h[bad] / 2)
+
+
+class SweepResult(tuple):
+    """
+    (vis, is_aborted) of a sweep, with the reason of the abort:
+    None (not aborted), 'compliance', 'jump' (|dI| between points) or
+    'unknown'.
+
+    >>> vis, aborted = result = SweepResult(np.zeros((2, 2)), True, 'jump')
+    >>> aborted, result.reason
+    (True, 'jump')
+    """
+    def __new__(cls, vis, aborted, reason=None):
+        self = super().__new__(cls, (vis, aborted))
+        self.reason = reason
+        return self
+
+    @classmethod
+    def compliance_stop(cls, vis, aborted, abort_at_compliance):
+        """
+        Result of an instrument stopping sweeps only at compliance: a short
+        sweep without abort_at_compliance has stopped for an unknown reason.
+
+        >>> SweepResult.compliance_stop(np.zeros((1, 2)), True, False).reason
+        'unknown'
+        """
+        if not aborted:
+            return cls(vis, False)
+        return cls(vis, True, 'compliance' if abort_at_compliance
+                   else 'unknown')
+
+    vis = property(itemgetter(0))
+    aborted = property(itemgetter(1))
+
+    def __repr__(self):
+        return 'SweepResult(vis={!r}, aborted={!r}, reason={!r})'.format(
+            self.vis, self.aborted, self.reason)
+
+
+def abort_index(Is, i_stop=None, di_stop=None):
+    """
+    First point meeting an abort condition, as checked in the instrument
+    after measuring each point.
+
+    >>> abort_index([0.0, 1e-3, 5e-3, 1e-2], di_stop=2e-3)
+    (2, 'jump')
+    >>> abort_index([0.0, 1e-3, 5e-3, 1e-2], i_stop=1e-2)
+    (3, 'compliance')
+    >>> abort_index([0.0, 1e-3], i_stop=1e-2)
+    (None, None)
+
+    :param i_stop: |I| >= i_stop: 'compliance'
+    :param di_stop: |I - I of the previous point| >= di_stop: 'jump'
+    :return: index, reason
+    """
+    Is = np.asarray(Is, np.float64)
+    stop = np.zeros(len(Is), bool)
+    if i_stop:
+        stop |= np.abs(Is) >= i_stop
+    if di_stop and len(Is) > 1:
+        stop[1:] |= np.abs(np.diff(Is)) >= di_stop
+    if not stop.any():
+        return None, None
+    i = int(np.argmax(stop))
+    reason = 'compliance' if i_stop and abs(Is[i]) >= i_stop else 'jump'
+    return i, reason
@@ -1,10 +1,9 @@
 ﻿from collections import defaultdict
+from itertools import product
 import math
+import unittest
 
 import numpy as np
-from scipy.signal import savgol_filter
-import statsmodels.api as sm
-import unittest2
 
 
 def calc_coord(X, Y, dX, dY, xm_mesa, ym_mesa, xm_pad, ym_pad) -> list:
@@ -36,6 +35,7 @@ def fit_R3(VIs):
     """
     Vs, Is = np.array(VIs).T
     X = np.column_stack((Vs, Vs ** 2, Vs ** 3))
+    import statsmodels.api as sm
     model = sm.OLS(Is, X)
     results = model.fit()
     c1, c2, c3 = results.params
@@ -244,6 +244,78 @@ def num_9th(value):
     return abs(math.log10(1 + eps - value))
 
 
+def probe_order(xys, cost=None, start=None):
+    """
+    Probing order of positions with a small total travel cost: serpentine
+    strips of rows or of columns, the strip height and the orientation
+    chosen by the total cost.  Heuristic in O(n log n), e.g. 0.1s for
+    50,000 positions.
+
+    >>> xys = [(x, y) for y in range(3) for x in range(3)]
+    >>> probe_order(xys).tolist()
+    [0, 1, 2, 5, 4, 3, 6, 7, 8]
+    >>> probe_order(xys, start=(3, 0)).tolist()
+    [2, 1, 0, 3, 4, 5, 8, 7, 6]
+
+    Two mesas per die, 1000um pitch: the mesas of a die one after another
+    >>> xys = [(x + m, y) for y in (0, 1000) for x in (0, 1000)
+    ...        for m in (0, 200)]
+    >>> probe_order(xys).tolist()
+    [0, 1, 2, 3, 7, 6, 5, 4]
+
+    :param xys: [(x, y), ...] e.g. all (mesa, X, Y) probe positions (um)
+    :param cost: vectorized cost of moves by distance, e.g.
+                 SussPA300.safe_move_sec (the long-move vs. short-move
+                 split of safe_move).  None: the distance.
+    :param start: (x, y) before the first position
+    :return: indices of xys in the probing order
+    :rtype: np.ndarray
+    """
+    xys = np.asarray(xys, np.float64).reshape(-1, 2)
+    if len(xys) < 2:
+        return np.arange(len(xys))
+
+    if cost is None:
+        def cost(distance):
+            return distance
+
+    def move_cost(xy0, xy1):
+        return cost(np.hypot(xy1[..., 0] - xy0[..., 0],
+                             xy1[..., 1] - xy0[..., 1]))
+
+    best, best_cost = None, None
+    for axis in (0, 1):  # strips of rows (along x), of columns (along y)
+        along, across = xys[:, axis], xys[:, 1 - axis]
+        levels = np.unique(across)
+        # Heights of the strips: the typical spacings of the levels (e.g.
+        # the die pitch over the mesa offsets within a die) unless much
+        # thinner than sqrt(3 * area / n), the height of the classic strip
+        # heuristic for scattered positions, which is also tried; one strip
+        typical = float(np.sqrt(3 * np.ptp(along) * np.ptp(across) /
+                                len(xys)))
+        heights = {float(np.median(levels[k:] - levels[:-k]))
+                   for k in range(1, min(len(levels), 7))}
+        heights = {h for h in heights if h > typical / 10}
+        heights.update((typical or np.inf, np.inf))
+        for height, first in product(sorted(heights), (1.0, -1.0)):
+            strip = np.floor((across - levels[0]) / height + 1e-9)
+            sign = np.where(strip % 2, -first, first)
+            order = np.lexsort((across * sign, along * sign, strip))
+            path = xys[order]
+            order_cost = float(np.sum(move_cost(path[:-1], path[1:])))
+            # Also backwards, from the other end
+            for forward in (True, False):
+                cand_cost = order_cost
+                if start is not None:
+                    cand_cost += float(move_cost(
+                        np.asarray(start, np.float64),
+                        path[0 if forward else -1]))
+                if best is None or cand_cost < best_cost:
+                    best = order if forward else order[::-1]
+                    best_cost = cand_cost
+    return best
+
+
 def rotate_vector(x, y, theta_deg):
     theta_rad = theta_deg * math.pi / 180
     return math.cos(theta_rad) * x - math.sin(theta_rad) * y, math.sin(
@@ -459,6 +531,7 @@ def savgol_vis(vis, window_length, polyoder, deriv=0):
     """
     See test cases.
     """
+    from scipy.signal import savgol_filter
     ret = []
     viss, dvs = list_to_monolists_concat(vis, key=lambda x: x[0])
 
@@ -472,7 +545,7 @@ def savgol_vis(vis, window_length, polyoder, deriv=0):
     return ret
 
 
-class TestAlgorithms(unittest2.TestCase):
+class TestAlgorithms(unittest.TestCase):
     def test_savgol_VIs(self):
         from matplotlib import pyplot as plt
         step = 0.050
@@ -1,19 +1,43 @@
+from collections.abc import Mapping
 import os
 
-import keyring
-
 
 # Commons
 # home = os.path.expanduser('~/')
 
-mysql_config = {
-    'user': 'wsh',
-    'password': keyring.get_password('rds', 'wsh'),
-    'database': 'master_db',
-    'host': 'mysql1.foobar.ap-northeast-1.rds.amazonaws.com',
-    'port': '3306'
-    }
-if mysql_config['password'] is None:
-    raise RuntimeError('Set password before: '
-                       'import keyring; '
-                       "keyring.set_password('rds', 'wsh', 'password')")
+class _LazyPasswordConfig(Mapping):
+    """Config dict reading the password from keyring on first access."""
+    def __init__(self, keyring_service, **config):
+        self._keyring_service = keyring_service
+        self._config = config
+
+    def _resolved(self):
+        if 'password' not in self._config:
+            import keyring
+            password = keyring.get_password(self._keyring_service,
+                                            self._config['user'])
+            if password is None:
+                raise RuntimeError(
+                    'Set password before: import keyring; '
+                    "keyring.set_password('{}', '{}', 'password')".format(
+                        self._keyring_service, self._config['user']))
+            self._config['password'] = password
+        return self._config
+
+    def __getitem__(self, key):
+        return self._resolved()[key]
+
+    def __iter__(self):
+        return iter(self._resolved())
+
+    def __len__(self):
+        return len(self._resolved())
+
+
+mysql_config = _LazyPasswordConfig(
+    'rds',
+    user='wsh',
+    database='master_db',
+    host='mysql1.foobar.ap-northeast-1.rds.amazonaws.com',
+    port='3306',
+    )
@@ -1,9 +1,8 @@
 from datetime import datetime
 import math
+import unittest
 
 import numpy as np
-import pandas.io.sql as psql
-import unittest2
 
 import lib.constants as c
 from lib.algorithms import calc_coord, fit_R3, is_good_RA
@@ -188,7 +187,7 @@ def update_tx_rotating(db_rds, sample, commit=False):
         db_rds.cnx.commit()
 
 
-class TestDatabase(unittest2.TestCase):
+class TestDatabase(unittest.TestCase):
     def setUp(self):
         self.db = Database(**c.mysql_config)
         self.mask = 'dummy_mask'
@@ -257,7 +256,7 @@ class TestDatabase(unittest2.TestCase):
 if __name__ == "__main__":
     # Carefully commit in evaluator!
 
-    # unittest2.main()  # DO NOT commit.
+    # unittest.main()  # DO NOT commit.
     sample = 'dummy_sample'
     db = Database(**c.mysql_config)
     db_read = Database(user='readonly', database='master_db')
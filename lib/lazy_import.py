@@ -0,0 +1,27 @@
+import importlib
+
+
+class LazyModule:
+    """
+    Stand-in for a module which is imported on the first attribute access.
+    Keeps heavy dependencies (matplotlib, seaborn, pandas, ...) out of the
+    startup of scripts that do not use them.
+
+    >>> import sys
+    >>> _ = sys.modules.pop('colorsys', None)  # e.g. imported by matplotlib
+    >>> colorsys = LazyModule('colorsys')
+    >>> 'colorsys' in sys.modules
+    False
+    >>> colorsys.rgb_to_hsv(1, 0, 0)
+    (0.0, 1.0, 1)
+    >>> 'colorsys' in sys.modules
+    True
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return getattr(self._module, attr)
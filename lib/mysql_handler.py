@@ -1,12 +1,10 @@
 from datetime import datetime, timedelta
-
-import mysql.connector
-import pandas.io.sql as psql
-import unittest2
+import unittest
 
 
 class MySqlHandler:
     def __init__(self, **config):
+        import mysql.connector
         self.cnx = mysql.connector.connect(**config)
         self.cursor = self.cnx.cursor()
         self.exe = self.cursor.execute
@@ -45,6 +43,7 @@ class MySqlHandler:
         return dt + timedelta(hours=-9)
 
     def pdq(self, query, params=None, index_col=None):
+        import pandas.io.sql as psql
         df = psql.read_sql_query(query, self.cnx,
                                  params=params, index_col=index_col)
         return df
@@ -177,7 +176,7 @@ class MySqlHandler:
 
 
 
-class TestMySqlHandler(unittest2.TestCase):
+class TestMySqlHandler(unittest.TestCase):
     def setUp(self):
         self.my = MySqlHandler()
 
@@ -299,4 +298,4 @@ class TestMySqlHandler(unittest2.TestCase):
                          self.dt1)
 
 if __name__ == "__main__":
-    unittest2.main()
+    unittest.main()
@@ -1,17 +1,18 @@
-﻿from datetime import datetime
-from multiprocessing.pool import ThreadPool
+﻿import asyncio
+from datetime import datetime
 from os.path import expanduser
 from shutil import copy2
 from tempfile import gettempdir
 
 import numpy as np
-import visa
 
 from instr.ap1628t2 import AP1628T2
+from instr.daemon import resource_manager
 from instr.ke2636a import Keithley2636A
 
 
 room = 'debug'
+record_dir = None  # Directory to record the instrument traffic (instr.replay)
 if room == 'debug':
     ap = AP1628T2(None)
     ke = Keithley2636A(None)
@@ -26,10 +27,19 @@ else:
     else:
         raise RuntimeError
 
-    rm = visa.ResourceManager()
+    rm = resource_manager()
     print(rm.list_resources())
-    ap = AP1628T2(rm.open_resource(ap_rsrc_name))
-    ke = Keithley2636A(rm.open_resource(ke_rsrc_name))
+    ap_rsrc = rm.open_resource(ap_rsrc_name)
+    ke_rsrc = rm.open_resource(ke_rsrc_name)
+    if record_dir is not None:
+        from instr.replay import RecordingResource
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        ap_rsrc = RecordingResource(
+            ap_rsrc, '{}/ap_{}.jsonl.gz'.format(record_dir, stamp))
+        ke_rsrc = RecordingResource(
+            ke_rsrc, '{}/ke_{}.jsonl.gz'.format(record_dir, stamp))
+    ap = AP1628T2(ap_rsrc, reset=not getattr(ap_rsrc, 'shared', False))
+    ke = Keithley2636A(ke_rsrc, reset=not getattr(ke_rsrc, 'shared', False))
 
 save_dir = expanduser('~/Desktop/')
 backup_dir = gettempdir() + '/'
@@ -59,16 +69,20 @@ try:
     # tIHs = pd.DataFrame(columns=['Time (s)', 'I (A)', 'H (Oe) (interpolated)'])
     tHIs = np.array([], dtype=np.float64).reshape((0, 3))  # I: interpolation
     tIHs = np.array([], dtype=np.float64).reshape((0, 3))  # H: interpolation
-    pool = ThreadPool(processes=2)  # for ap and ke
+    loop = asyncio.get_event_loop()
     dt0 = datetime.now()
+    H_prev = Hs[-1]  # Hs ends at the initial field
     for H in Hs:
         time_offset = (datetime.now() - dt0).total_seconds()
 
-        async_result_ap = pool.apply_async(ap.sweep, (H,),
-                                           {'speed':speed, 'unit':'Oe'})
-        async_result_ke = pool.apply_async(ke.time_sampling)  # TODO                                           {'speed':speed*0.6, 'unit':'Oe'})
-        tIs = np.array(async_result_ke.get())
-        tHs = np.array(async_result_ap.get())
+        # Buffered sampling in the instrument during the field sweep
+        tHs, tIs = loop.run_until_complete(asyncio.gather(
+            ap.asweep(H, speed=speed, unit='Oe'),
+            ke.run_async(ke.time_sampling, abs(H - H_prev) / speed,
+                         voltage=voltage, i_limit=i_limit)))
+        H_prev = H
+        tIs = np.array(tIs)
+        tHs = np.array(tHs)
 
         tHs[:,0] += time_offset
         tIs[:,0] += time_offset
@@ -90,4 +104,4 @@ try:
     copy2(path_tIHs, backup_dir + 'tIHs_' + str(dt0).replace(':', '-') +'.csv')
 finally:
     ap.sweep(0)
-    ke.off()  # TODO
+    ke.off()
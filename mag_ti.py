@@ -2,9 +2,8 @@
 import os
 import sqlite3
 import time
-# Non-std libs
-import visa
 # My libs
+from instr.daemon import resource_manager
 from instr.ke2636a import Keithley2636A
 from instr.sci9700 import Sci9700
 
@@ -33,13 +32,13 @@ if debug_mode:
     ke_rsrc = None
     sci_rsrc = None
 else:
-    rm = visa.ResourceManager()
+    rm = resource_manager()
     print(rm.list_resources())
     ke_rsrc = rm.open_resource(ke_rsrc_name)
     sci_rsrc = rm.open_resource(sci_rsrc_name)
 
-ke = Keithley2636A(debug_mode, ke_rsrc, ke_timeout_sec)
-sci = Sci9700(debug_mode, sci_rsrc, sci_timeout_sec)
+ke = Keithley2636A(ke_rsrc, ke_timeout_sec)
+sci = Sci9700(sci_rsrc, sci_timeout_sec)
 
 
 # Connect to database ----------------------------------------------------------
@@ -60,7 +60,7 @@ class PA300Setup(Database, SussPA300):
 
 
 if __name__ == '__main__':
-    import visa
+    from instr.daemon import resource_manager
 
     debug_mode = False
     sample = 'dummy_sample'
@@ -68,9 +68,11 @@ if __name__ == '__main__':
     if debug_mode:
         suss = PA300Setup(sample, **c.mysql_config)
     else:
-        rm = visa.ResourceManager()
+        rm = resource_manager()
         print(rm.list_resources())
         suss_rsrc = rm.open_resource('GPIB0::7::INSTR')
-        suss = PA300Setup(sample, suss_rsrc, **c.mysql_config)
+        suss = PA300Setup(sample, suss_rsrc,
+                          reset=not getattr(suss_rsrc, 'shared', False),
+                          **c.mysql_config)
 
     suss.check_xm_ym_probe()
@@ -6,7 +6,7 @@ import lib.constants as c
 from lib.database import Database, update_fit_R3
 from instr.agilent4156c import Agilent4156C
 from instr.suss_pa300 import SussPA300
-from vi_meas import meas_vi_double
+from vi_meas import meas_vi_doubles
 
 # Configurations ---------------------------------------------------------------
 sample = 'dummy_sample'
@@ -14,6 +14,7 @@ inst = 'suss_test'
 # inst = 'suss_BD_test'
 # inst = 'suss'
 debug_mode = False  # Set True during development without instruments.
+record_dir = None  # Directory to record the instrument traffic (instr.replay)
 
 
 agi_comp = 0.010  # Compliance (A)
@@ -25,7 +26,7 @@ agi_Vs = [0.3, -0.3]  # Sweep voltages for suss_test
 if debug_mode:
     sample = 'dummy_sample'
 if not debug_mode:
-    import visa
+    from instr.daemon import resource_manager
 
 db_rds = Database(**c.mysql_config)
 db_read = Database(user='readonly', database='master_db')
@@ -34,9 +35,7 @@ sql = ('SELECT mask, dX, dY, Xmin, Xmax, Ymin, Ymax FROM v02_sample '
        'WHERE sample=%s')
 mask, dX, dY, X_min, X_max, Y_min, Y_max = db_rds.q_row_abs(sql, (sample,))
 
-# XYs = spiral_XYs(X_min, X_max, Y_min, Y_max)
 XYs = list(product(range(X_min, X_max+1), range(Y_min, Y_max+1)))
-XYs = sorted(XYs, key=lambda x: (x[1], x[0]))
 
 sql = ('SELECT mesa_id, xm_probe, ym_probe FROM v03_sample_mesa '
        'WHERE sample=%s')
@@ -56,12 +55,21 @@ if debug_mode:
     agi = Agilent4156C(False)
     suss = SussPA300()
 else:
-    rm = visa.ResourceManager()
+    rm = resource_manager()
     print(rm.list_resources())
     agi_rsrc = rm.open_resource('GPIB0::18::INSTR')
     suss_rsrc = rm.open_resource('GPIB0::7::INSTR')
-    agi = Agilent4156C(False, rsrc=agi_rsrc)
-    suss = SussPA300(rsrc=suss_rsrc)
+    if record_dir is not None:
+        from instr.replay import RecordingResource
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        agi_rsrc = RecordingResource(
+            agi_rsrc, '{}/agi_{}.jsonl.gz'.format(record_dir, stamp))
+        suss_rsrc = RecordingResource(
+            suss_rsrc, '{}/suss_{}.jsonl.gz'.format(record_dir, stamp))
+    agi = Agilent4156C(False, rsrc=agi_rsrc,
+                       reset=not getattr(agi_rsrc, 'shared', False))
+    suss = SussPA300(rsrc=suss_rsrc,
+                     reset=not getattr(suss_rsrc, 'shared', False))
 
 # Measure ----------------------------------------------------------------------
 first_measurement = True
@@ -70,7 +78,8 @@ if resp != 'yes':
     exit()
 suss.approach_separate()
 
-# Measure I-Vs.  Be sure separate!
+# Probe positions of all (mesa, X, Y)
+sites = []  # [(mesa_id, X, Y, xs, ys), ...]
 mesa_ids = sorted(dic_mesaid_xypr_default)
 for mesa_id in mesa_ids:
     print('{} (mesa_id {})'.format(dic_mesaid_mesa[mesa_id], mesa_id))
@@ -78,10 +87,6 @@ for mesa_id in mesa_ids:
         print('Skip mesa.')
         continue
     for (X, Y) in XYs:
-        if first_measurement and sample == 'dummy_sample' and \
-                not (mesa_id == 3 and (X, Y) == (3, 4)):
-            print('({},{})'.format(X, Y), end=' ')
-            continue
         if inst != 'suss_test':
             sql = ('SELECT suss_R2 FROM v04_device '
                    'WHERE sample=%s AND mesa_id=%s AND X=%s AND Y=%s')
@@ -89,35 +94,42 @@ for mesa_id in mesa_ids:
             if al.num_9th(R2) < 1.5:
                 print('NG({},{})'.format(X, Y), end=' ')
                 continue
-        print('X{}Y{}'.format(X, Y))
         if mesa_id in dic_mesaid_xypr_spec:
             xs = dic_mesaid_xypr_spec[mesa_id][0] + (X - X_min) * dX
             ys = dic_mesaid_xypr_spec[mesa_id][1] + (Y - Y_min) * dY
         else:
             xs = dic_mesaid_xypr_default[mesa_id][0] + (X - X_min) * dX
             ys = dic_mesaid_xypr_default[mesa_id][1] + (Y - Y_min) * dY
-        suss.safe_move_contact('H', -xs, -ys)
-        if first_measurement:
-            input('Contact the prober.')
-            first_measurement = False
-        for V in agi_Vs:
-            mesa = dic_mesaid_mesa[mesa_id]
-            print('Measure {}...'.format(V))
-            # vis, aborted = meas_vi_double(agi, db, sample, mesa, X, Y,
-            #                               'SUSS PA300 + Agilent 4156C',
-            #                               V, v_points=101, i_limit=10e-3)
-            # TODO hard code
-            vis, aborted = meas_vi_double(agi, db_rds, sample, mesa, X, Y,
-                                          inst,
-                                          V, v_points=101, i_limit=agi_comp)
-            # time.sleep(3)  # wait replication TODO test
-            # update_fit_R3(db_read, db, sample, mesa, X, Y)  # TODO test
-            db_rds.cnx.commit()
-            print('Committed.')
-            if debug_mode:
-                time.sleep(1)  # To avoid duplicates of "t0" in database
-            if aborted:
-                break
+        sites.append((mesa_id, X, Y, xs, ys))
+
+# Visit all sites in the order of the least stage travel time (safe_move)
+x_home, y_home, _ = suss.read_xyz('H')
+order = al.probe_order([site[3:] for site in sites], cost=suss.safe_move_sec,
+                       start=(-x_home, -y_home))
+print('{} sites.'.format(len(sites)))
+
+# Measure I-Vs.  Be sure separate!
+for mesa_id, X, Y, xs, ys in (sites[i] for i in order):
+    if first_measurement and sample == 'dummy_sample' and \
+            not (mesa_id == 3 and (X, Y) == (3, 4)):
+        print('({},{})'.format(X, Y), end=' ')
+        continue
+    mesa = dic_mesaid_mesa[mesa_id]
+    print('{} X{}Y{}'.format(mesa, X, Y))
+    suss.safe_move_contact('H', -xs, -ys)
+    if first_measurement:
+        input('Contact the prober.')
+        first_measurement = False
+    print('Measure {}...'.format(agi_Vs))
+    # All agi_Vs in one sweep plan (one program, one data transfer)
+    # TODO hard code
+    visl, aborted = meas_vi_doubles(agi, db_rds, sample, mesa, X, Y,
+                                    inst, agi_Vs, v_points=101,
+                                    i_limit=agi_comp)
+    # time.sleep(3)  # wait replication TODO test
+    # update_fit_R3(db_read, db, sample, mesa, X, Y)  # TODO test
+    db_rds.cnx.commit()
+    print('Committed.')
 
 suss.separate_separate()
 input('Done.')
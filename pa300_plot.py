@@ -1,13 +1,14 @@
 ﻿import math
 
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.axes import Axes
-import pandas.io.sql as psql
-import seaborn as sns
 
 import lib.algorithms as al
 from lib.database import Database
+from lib.lazy_import import LazyModule
+
+plt = LazyModule('matplotlib.pyplot')
+psql = LazyModule('pandas.io.sql')
+sns = LazyModule('seaborn')
 
 # TODO ampere engineer form, twin ticks A/m2
 
@@ -46,7 +47,7 @@ def RX(db, sample, plot_mesas=None, RA=False, annotate=False, RY=False,
     yvar = 'RA' if RA else 'R'
 
     ax = plt.axes()
-    assert isinstance(ax, Axes)
+    assert isinstance(ax, plt.Axes)
     ax.set_yscale('log')
     ax.set_xlabel('Y') if RY else ax.set_xlabel('X')
     ax.set_ylabel(dic_var_label[yvar])
@@ -0,0 +1,80 @@
+"""
+Sweep time vs. noise of the measurement profiles (SourceMeter.profile) of
+each source meter, on the emulators (noise of 1 / sqrt(NPLC)) or on a real
+instrument.
+
+python profile_benchmark.py                            # emulators
+python profile_benchmark.py ke2636a GPIB0::26::INSTR   # a real instrument
+python -m unittest profile_benchmark                   # guard
+"""
+import sys
+import time
+import unittest
+
+import numpy as np
+
+from instr.agilent4156c import Agilent4156C
+from instr.emulator import (Agilent4156CEmulator, Keithley2400Emulator,
+                            Keithley2636AEmulator)
+from instr.ke2400 import Keithley2400
+from instr.ke2636a import Keithley2636A
+
+drivers = {
+    'agilent4156c': (Agilent4156C, Agilent4156CEmulator),
+    'ke2400': (Keithley2400, Keithley2400Emulator),
+    'ke2636a': (Keithley2636A, Keithley2636AEmulator),
+}
+profiles = ('fast', 'balanced', 'precise')
+
+
+def emulated(name, noise=1e-9, time_scale=1.0):
+    """:return: driver of name on its emulator (with 1kOhm)"""
+    driver, emulator = drivers[name]
+    return driver(rsrc=emulator(noise=noise, seed=0, time_scale=time_scale))
+
+
+def benchmark(smu, vs, i_limit=1e-3, profile='fast'):
+    """
+    Sweep vs with profile.  The noise is the standard deviation of the
+    residual of a linear fit, i.e. for an ohmic device.
+
+    :return: sweep seconds, noise (A)
+    :rtype: float, float
+    """
+    smu.profile = profile
+    t0 = time.perf_counter()
+    vis, aborted = smu.iv_sweep_plan(vs, i_limit)
+    t = time.perf_counter() - t0
+    vs, Is = vis[:, 0], vis[:, 1]
+    residual = Is - np.polyval(np.polyfit(vs, Is, 1), vs)
+    return t, float(np.std(residual, ddof=2))
+
+
+class TestProfiles(unittest.TestCase):
+    def test_trade_off(self):
+        vs = np.linspace(0, 0.1, 21)
+        for name in sorted(drivers):
+            with self.subTest(driver=name):
+                smu = emulated(name, time_scale=0.1)
+                t_fast, noise_fast = benchmark(smu, vs, profile='fast')
+                t_precise, noise_precise = benchmark(smu, vs,
+                                                     profile='precise')
+                self.assertLess(t_fast, t_precise)
+                self.assertGreater(noise_fast, noise_precise)
+
+
+if __name__ == '__main__':
+    vs = np.linspace(0, 0.1, 11)
+    if len(sys.argv) == 3:
+        import visa
+
+        name, address = sys.argv[1:]
+        rsrc = visa.ResourceManager().open_resource(address)
+        smus = {name: drivers[name][0](rsrc=rsrc)}
+    else:
+        smus = {name: emulated(name) for name in sorted(drivers)}
+    for name, smu in smus.items():
+        for profile in profiles:
+            t, noise = benchmark(smu, vs, profile=profile)
+            print('{:<14} {:<9} {:8.3f}s  {:9.3g}A'.format(
+                name, profile, t, noise))
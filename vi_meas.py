@@ -1,10 +1,11 @@
-from datetime import datetime
-import time
-
-import matplotlib.pyplot as plt
+from datetime import datetime, timedelta
 
 from instr.base import SourceMeter
+from instr.sweep_plan import SweepPlan
 from lib.database import Database
+from lib.lazy_import import LazyModule
+
+plt = LazyModule('matplotlib.pyplot')
 
 
 def meas_vi_double(srcmtr, db, sample, mesa, X, Y, instrument,
@@ -29,8 +30,39 @@ def meas_vi_double(srcmtr, db, sample, mesa, X, Y, instrument,
     return VIs, aborted
 
 
+def meas_vi_doubles(srcmtr, db, sample, mesa, X, Y, instrument,
+                    v_ends, v_step=1e-3, v_points=None, i_limit=1e-3):
+    """
+    Sweep 0V -> v_end -> 0V for each of v_ends in one iv_sweep_plan and
+    insert each double sweep into database.  Does not commit.
+    The time of a double sweep is its start estimated from the start and
+    the end of the plan by its share of the points, truncated to seconds.
+    It is moved to the next second if the previous double sweep has the
+    same time (t0 is unique for a device), i.e. it may be up to 1 sec late.
+
+    :return: [vis of each double sweep measured], aborted
+    :rtype: list, bool
+    """
+    plan = SweepPlan.doubles(v_ends, v_step, v_points)
+    t_start = datetime.utcnow()
+    VIs, aborted = srcmtr.iv_sweep_plan(plan, i_limit)
+    point_time = (datetime.utcnow() - t_start) / max(len(VIs), 1)
+    visl = plan.split(VIs)
+    n_before = 0
+    dt_prev = None
+    for v_end, vis in zip(v_ends, visl):
+        dt = (t_start + point_time * n_before).replace(microsecond=0)
+        if dt_prev is not None and dt <= dt_prev:
+            dt = dt_prev + timedelta(seconds=1)
+        db.insert_vis(sample, mesa, X, Y, dt, len(vis), i_limit, v_end,
+                      instrument, vis)
+        dt_prev = dt
+        n_before += len(vis)
+    return visl, aborted
+
+
 if __name__ == '__main__':
-    import visa
+    from instr.daemon import resource_manager
     import lib.constants as c
 
     sample = 'dummy_sample'
@@ -51,7 +83,7 @@ if __name__ == '__main__':
 
     db = Database(**c.mysql_config)
 
-    rm = visa.ResourceManager()
+    rm = resource_manager()
     print(rm.list_resources())
 
     # from instr.agilent4156c import Agilent4156C
@@ -63,27 +95,23 @@ if __name__ == '__main__':
     from instr.ke2636a import Keithley2636A
     # rsrc = rm.open_resource('TCPIP::169.254.000.001::INSTR')
     rsrc = rm.open_resource('visa://169.254.136.196/GPIB0::20::INSTR')
-    srcmtr = Keithley2636A(rsrc=rsrc)
+    srcmtr = Keithley2636A(rsrc=rsrc,
+                           reset=not getattr(rsrc, 'shared', False))
     srcmtr.smu = 'a'
     inst = 'Keithley 2636A'
     v_points, i_limit = 101, 1e-3
 
-    for v in vs:
-        print('Measure {}...'.format(v))
-        vis, aborted = meas_vi_double(srcmtr, db, sample, mesa, X, Y, inst,
-                                      v, v_points=v_points, i_limit=i_limit)
-        vs, Is = vis.transpose()
+    print('Measure {}...'.format(vs))
+    visl, aborted = meas_vi_doubles(srcmtr, db, sample, mesa, X, Y, inst,
+                                    vs, v_points=v_points, i_limit=i_limit)
+    db.cnx.commit()
+    print('Commited.')
+    for vis in visl:
+        Vs, Is = vis.transpose()
         plt.subplot(121)
-        plt.plot(vs, Is, 'o-')  # TODO RV, multi-thread
+        plt.plot(Vs, Is, 'o-')  # TODO RV, multi-thread
         plt.subplot(122)
-        plt.plot(vs, vs/Is, 'o-')  # TODO RV, multi-thread
-        plt.show()
-        time.sleep(1)
-        db.cnx.commit()
-        print('Commited.')
-        if debug_mode:
-            time.sleep(1)  # To avoid duplicates of "t0" in database
-        if aborted:
-            break
+        plt.plot(Vs, Vs/Is, 'o-')  # TODO RV, multi-thread
+    plt.show()
     # TODO update fitR3
     pass  # Breakpoint